@@ -5,7 +5,7 @@ from models import db
 from flask_jwt_extended import JWTManager
 from flask_cors import CORS
 from flask_migrate import Migrate
-from flask_limiter import Limiter
+from flask_limiter import ExemptionScope, Limiter
 from flask_limiter.util import get_remote_address
 from flask_caching import Cache
 from flasgger import Swagger
@@ -52,17 +52,36 @@ def create_app(config_name=None):
     
     # JWT
     jwt = JWTManager(app)
-    app.config['JWT_ACCESS_TOKEN_EXPIRES'] = app.config.get('JWT_ACCESS_TOKEN_EXPIRES', 3600)
+    app.config['JWT_ACCESS_TOKEN_EXPIRES'] = app.config.get('JWT_ACCESS_TOKEN_EXPIRES', 900)
+    
+    # Отозванные токены (logout)
+    from services.revocation import TokenDenylist
+    app.token_denylist = TokenDenylist(
+        redis_url=app.config.get('TOKEN_DENYLIST_REDIS_URL'),
+        sqlite_path=app.config.get('TOKEN_DENYLIST_SQLITE_PATH'),
+        capacity=app.config.get('TOKEN_DENYLIST_CAPACITY', 100000),
+        poll_interval=app.config.get('TOKEN_DENYLIST_POLL_INTERVAL', 1)
+    )
+    
+    @jwt.token_in_blocklist_loader
+    def check_token_revoked(jwt_header, jwt_payload):
+        return app.token_denylist.is_revoked(jwt_payload["jti"])
     
     # CORS
     CORS(app, supports_credentials=True)
     
-    # Rate Limiting
+    # Rate Limiting: общее хранилище счетчиков (redis:// или sqlite:///) и бюджет
+    # стоимости запросов, см. services/ratelimit.py (импорт регистрирует схему sqlite://)
+    from services.ratelimit import RequestCosts
+    app.request_costs = RequestCosts(app)
     limiter = Limiter(
         app=app,
         key_func=get_remote_address,
         default_limits=[app.config.get('RATELIMIT_DEFAULT', '200 per hour')],
-        storage_uri=app.config.get('RATELIMIT_STORAGE_URL', 'memory://')
+        application_limits=[app.config.get('RATELIMIT_COST_BUDGET', '1000 per hour')],
+        application_limits_cost=app.request_costs,
+        storage_uri=app.config.get('RATELIMIT_STORAGE_URL', 'memory://'),
+        strategy=app.config.get('RATELIMIT_STRATEGY', 'sliding-window-counter')
     )
     app.limiter = limiter
     
@@ -74,6 +93,20 @@ def create_app(config_name=None):
     cache = Cache(app, config=cache_config)
     app.cache = cache
     
+    # Рассылка событий заказов для SSE
+    from services.events import EventBroker
+    app.event_broker = EventBroker(
+        redis_url=app.config.get('EVENTS_REDIS_URL'),
+        queue_size=app.config.get('SSE_QUEUE_SIZE', 100)
+    )
+    
+    # Кэш роли и версии пользователей для проверок прав по JWT
+    from services.identity import IdentityCache
+    app.identity_cache = IdentityCache(
+        ttl=app.config.get('IDENTITY_CACHE_TTL', 30),
+        maxsize=app.config.get('IDENTITY_CACHE_SIZE', 10000)
+    )
+    
     # Swagger/OpenAPI документация
     swagger = Swagger(app, config=app.config.get('SWAGGER', {}))
     
@@ -100,6 +133,68 @@ def create_app(config_name=None):
     app.register_blueprint(orders.orders_bp, url_prefix="/api/orders", name="orders_legacy")
     app.register_blueprint(admin.admin_bp, url_prefix="/api/admin", name="admin_legacy")
     app.register_blueprint(works.works_bp, url_prefix="/api", name="works_legacy")
+    
+    # Загруженные файлы: ETag, Range, 304 и отдача через прокси (services/media, routes/media);
+    # исходные картинки не расходуют лимиты запросов, копии по запросу - только бюджет стоимости
+    from routes import media
+    app.register_blueprint(media.media_bp)
+    limiter.exempt(media.static_media)
+    limiter.exempt(media.resized_media, flags=ExemptionScope.DEFAULT)
+    limiter.exempt(works.get_work_image)
+    limiter.exempt(auth.avatar)
+    from services.media_cache import DiskLRU
+    app.media_cache = DiskLRU(
+        app.config.get('MEDIA_RESIZE_CACHE_DIR'),
+        app.config.get('MEDIA_RESIZE_CACHE_BYTES', 512 * 1024 * 1024)
+    )
+
+    # Transactional outbox: CLI-команда и (опционально) фоновый диспетчер
+    from services.outbox import OutboxDispatcher, outbox_dispatch_command
+    app.cli.add_command(outbox_dispatch_command)
+    if app.config.get('OUTBOX_DISPATCHER_ENABLED'):
+        app.outbox_dispatcher = OutboxDispatcher(app).start()
+    
+    # Очередь исходящих писем: CLI-команда и (опционально) фоновый отправитель
+    from services.mailer import MailDispatcher, mail_dispatch_command
+    app.cli.add_command(mail_dispatch_command)
+    if app.config.get('MAIL_DISPATCHER_ENABLED'):
+        app.mail_dispatcher = MailDispatcher(app).start()
+    
+    # Очистка истекших и использованных кодов восстановления пароля
+    from services.reset_codes import ResetCodeSweeper, reset_codes_purge_command
+    app.cli.add_command(reset_codes_purge_command)
+    if app.config.get('RESET_CODE_SWEEPER_ENABLED'):
+        app.reset_code_sweeper = ResetCodeSweeper(app).start()
+    
+    # Пересчет агрегатов статистики
+    from services.stats import stats_rebuild_command
+    app.cli.add_command(stats_rebuild_command)
+    
+    # Перенос завершенных заказов в архив
+    from services.archive import orders_archive_command
+    app.cli.add_command(orders_archive_command)
+    
+    # Очередь оформления заказов
+    from services.checkout import CheckoutQueue, CheckoutSweeper, checkout_worker_command
+    app.cli.add_command(checkout_worker_command)
+    app.checkout_queue = CheckoutQueue(app, workers=app.config.get('CHECKOUT_WORKERS', 4))
+    if app.config.get('CHECKOUT_QUEUE_ENABLED') and app.checkout_queue.workers > 0:
+        # Тикеты после рестарта и зависшие в processing
+        app.checkout_sweeper = CheckoutSweeper(app).start()
+    
+    # Импорт товаров из CSV
+    from services.product_import import ProductImportRunner, products_import_command
+    app.cli.add_command(products_import_command)
+    app.product_import = ProductImportRunner(app)
+    
+    # Копии изображений для srcset (пул процессов Pillow)
+    from services.images import ImagePipeline, images_variants_command
+    app.cli.add_command(images_variants_command)
+    app.image_pipeline = ImagePipeline(app)
+    
+    # Загрузки по хэшу содержимого: удаление файлов без ссылок
+    from services.media import media_gc_command
+    app.cli.add_command(media_gc_command)
 
     # Создать БД если не существует (только для разработки)
     # В production используйте миграции: flask db upgrade
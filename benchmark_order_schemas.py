@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк сериализации заказов: полная OrderSchema против облегченной OrderSummarySchema
+
+Заполняет временную БД в памяти заказами с "тяжелыми" товарами (длинное
+описание, JSON с изображениями и характеристиками) и сравнивает размер
+ответа и время загрузки + сериализации одной страницы админского списка.
+
+Использование:
+    python3 benchmark_order_schemas.py [--orders 200] [--items 5] [--page 20] [--repeat 20]
+"""
+import argparse
+import json
+import os
+import time
+
+os.environ["DATABASE_URL"] = "sqlite://"
+os.environ.setdefault("FLASK_ENV", "production")
+os.environ.setdefault("SECRET_KEY", "benchmark")
+os.environ.setdefault("JWT_SECRET_KEY", "benchmark")
+
+import warnings
+warnings.filterwarnings("ignore")
+
+from sqlalchemy.orm import joinedload
+from app import create_app
+from models import db, User, Product, Order, OrderItem
+from schemas import OrderSchema, OrderSummarySchema
+from routes.orders import lean_order_options
+
+def seed(orders_count, items_per_order):
+    user = User(first_name="Bench", last_name="User", email="bench@example.com", password_hash="x")
+    db.session.add(user)
+    products = [
+        Product(
+            title=f"Ткань {i}",
+            description="Плотная костюмная ткань с эластаном. " * 40,
+            price=100.0 + i,
+            stock=1000,
+            images=json.dumps([f"static/products/{i}_{n}.jpg" for n in range(6)]),
+            specifications=json.dumps({"Состав": "шерсть 70%, полиэстер 30%", "Ширина": "150 см",
+                                       "Плотность": "280 г/м2", "Страна": "Италия"}, ensure_ascii=False)
+        )
+        for i in range(50)
+    ]
+    db.session.add_all(products)
+    db.session.flush()
+    for n in range(orders_count):
+        order = Order(user_id=user.id, total=0.0, status="pending")
+        db.session.add(order)
+        db.session.flush()
+        for k in range(items_per_order):
+            product = products[(n + k) % len(products)]
+            db.session.add(OrderItem(order_id=order.id, product_id=product.id, quantity=2, price=product.price))
+    db.session.commit()
+
+def measure(load_page, schema, repeat):
+    best = None
+    payload = b""
+    for _ in range(repeat):
+        db.session.expunge_all()
+        started = time.perf_counter()
+        orders = load_page()
+        payload = json.dumps(schema.dump(orders), default=str).encode("utf-8")
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return len(payload), best
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--orders", type=int, default=200)
+    parser.add_argument("--items", type=int, default=5)
+    parser.add_argument("--page", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    app = create_app("production")
+    with app.app_context():
+        db.create_all()
+        seed(args.orders, args.items)
+
+        def full_page():
+            return Order.query.options(
+                joinedload(Order.user), joinedload(Order.items).joinedload(OrderItem.product)
+            ).order_by(Order.created_at.desc(), Order.id.desc()).limit(args.page).all()
+
+        def lean_page():
+            return Order.query.options(*lean_order_options(with_user=True)) \
+                .order_by(Order.created_at.desc(), Order.id.desc()).limit(args.page).all()
+
+        full_size, full_time = measure(full_page, OrderSchema(many=True), args.repeat)
+        lean_size, lean_time = measure(lean_page, OrderSummarySchema(many=True), args.repeat)
+
+    print(f"Страница: {args.page} заказов x {args.items} позиций (лучшее из {args.repeat})")
+    print(f"{'схема':<22}{'размер, байт':>14}{'время, мс':>12}")
+    print(f"{'OrderSchema':<22}{full_size:>14}{full_time * 1000:>12.2f}")
+    print(f"{'OrderSummarySchema':<22}{lean_size:>14}{lean_time * 1000:>12.2f}")
+    print(f"Размер меньше в {full_size / lean_size:.1f} раз, время - в {full_time / lean_time:.1f} раз")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк хранилищ лимитов запросов: накладные расходы на одну проверку
+
+Для каждого хранилища (memory://, sqlite:/// во временном файле и, если
+указан --redis, redis://) измеряет время одной проверки sliding-window-counter
+в одном процессе, а затем запускает несколько процессов, которые одновременно
+расходуют общий лимит, и проверяет, что в сумме пропущено не больше лимита.
+
+Использование:
+    python3 benchmark_ratelimit.py [--checks 5000] [--processes 4] [--redis redis://localhost:6379]
+"""
+import argparse
+import multiprocessing
+import os
+import tempfile
+import time
+
+from limits import parse
+from limits.storage import storage_from_string
+from limits.strategies import SlidingWindowCounterRateLimiter
+import services.ratelimit  # noqa: F401 - регистрирует схему sqlite://
+
+def per_check(uri, checks):
+    """Среднее время проверки (мкс); у каждого клиента свой ключ, лимит не исчерпывается"""
+    limiter = SlidingWindowCounterRateLimiter(storage_from_string(uri))
+    item = parse(f"{checks * 2}/minute")
+    limiter.hit(item, "warmup")
+    started = time.perf_counter()
+    for n in range(checks):
+        limiter.hit(item, f"client-{n % 100}")
+    return (time.perf_counter() - started) / checks * 1e6
+
+def _worker(uri, limit, hits, key, results):
+    limiter = SlidingWindowCounterRateLimiter(storage_from_string(uri))
+    item = parse(limit)
+    results.put(sum(limiter.hit(item, key) for _ in range(hits)))
+
+def shared_limit(uri, processes, limit_count, hits):
+    """Сколько запросов пропустили processes процессов при общем лимите limit_count"""
+    ctx = multiprocessing.get_context("spawn")
+    results = ctx.Queue()
+    key = f"shared-{time.time()}"
+    workers = [
+        ctx.Process(target=_worker, args=(uri, f"{limit_count}/hour", hits, key, results))
+        for _ in range(processes)
+    ]
+    for worker in workers:
+        worker.start()
+    allowed = sum(results.get(timeout=60) for _ in workers)
+    for worker in workers:
+        worker.join()
+    return allowed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--checks", type=int, default=5000)
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--limit", type=int, default=200)
+    parser.add_argument("--redis", default=None, help="URL Redis, например redis://localhost:6379")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        storages = [
+            ("memory://", "memory://"),
+            ("sqlite (WAL)", "sqlite:///" + os.path.join(tmp, "ratelimit.db")),
+        ]
+        if args.redis:
+            storages.append(("redis (Lua)", args.redis))
+
+        hits = args.limit  # каждый процесс пытается израсходовать весь лимит
+        print(f"Проверок: {args.checks}; процессов: {args.processes}, общий лимит {args.limit}/hour")
+        print(f"{'хранилище':<16}{'мкс/проверка':>14}{'пропущено':>12}{'ожидалось':>12}")
+        for name, uri in storages:
+            overhead = per_check(uri, args.checks)
+            allowed = shared_limit(uri, args.processes, args.limit, hits)
+            print(f"{name:<16}{overhead:>14.1f}{allowed:>12}{args.limit:>12}")
+        print("memory:// считает в каждом процессе отдельно, поэтому пропускает лимит x процессов")
+
+if __name__ == "__main__":
+    main()
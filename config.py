@@ -13,8 +13,22 @@ class Config:
     
     # JWT
     JWT_SECRET_KEY = os.environ.get("JWT_SECRET_KEY", "jwt-secret-string-change-in-production")
-    JWT_ACCESS_TOKEN_EXPIRES = int(os.environ.get("JWT_ACCESS_TOKEN_EXPIRES", 3600))  # 1 час по умолчанию
+    JWT_ACCESS_TOKEN_EXPIRES = int(os.environ.get("JWT_ACCESS_TOKEN_EXPIRES", 900))  # 15 минут, продление - через refresh
+    JWT_REFRESH_TOKEN_EXPIRES = int(os.environ.get("JWT_REFRESH_TOKEN_EXPIRES", 30 * 24 * 3600))  # 30 дней
     JWT_ALGORITHM = "HS256"
+    # Отзыв токенов (logout): denylist jti в памяти, синхронизация между воркерами через Redis или файл SQLite
+    TOKEN_DENYLIST_REDIS_URL = os.environ.get("TOKEN_DENYLIST_REDIS_URL", None)
+    TOKEN_DENYLIST_SQLITE_PATH = os.environ.get("TOKEN_DENYLIST_SQLITE_PATH", None)
+    TOKEN_DENYLIST_POLL_INTERVAL = float(os.environ.get("TOKEN_DENYLIST_POLL_INTERVAL", 1))  # секунды
+    TOKEN_DENYLIST_CAPACITY = int(os.environ.get("TOKEN_DENYLIST_CAPACITY", 100000))
+    IDENTITY_CACHE_TTL = int(os.environ.get("IDENTITY_CACHE_TTL", 30))  # секунды, кэш роли/версии пользователя
+    IDENTITY_CACHE_SIZE = int(os.environ.get("IDENTITY_CACHE_SIZE", 10000))
+    
+    # Хэширование паролей (формат werkzeug: pbkdf2:sha256:<итерации> или scrypt:<n>:<r>:<p>)
+    PASSWORD_HASH_METHOD = os.environ.get("PASSWORD_HASH_METHOD", "pbkdf2:sha256:600000")
+    PASSWORD_HASH_WORKERS = int(os.environ.get("PASSWORD_HASH_WORKERS", 2))  # 0 - в потоке запроса
+    PASSWORD_HASH_MAX_PENDING = int(os.environ.get("PASSWORD_HASH_MAX_PENDING", 32))
+    PASSWORD_HASH_QUEUE_TIMEOUT = float(os.environ.get("PASSWORD_HASH_QUEUE_TIMEOUT", 5))  # секунды
     
     # File Uploads
     UPLOAD_FOLDER = os.path.join(basedir, "static", "avatars")
@@ -24,9 +38,23 @@ class Config:
     ALLOWED_EXTENSIONS = {"png", "jpg", "jpeg", "gif", "webp"}
     
     # Rate Limiting
+    # memory:// считает в каждом воркере отдельно; для нескольких воркеров -
+    # redis://host:6379 (Lua, один запрос на проверку) или sqlite:///путь (один сервер)
     RATELIMIT_STORAGE_URL = os.environ.get("RATELIMIT_STORAGE_URL", "memory://")
+    RATELIMIT_STRATEGY = os.environ.get("RATELIMIT_STRATEGY", "sliding-window-counter")
     RATELIMIT_DEFAULT = os.environ.get("RATELIMIT_DEFAULT", "200 per hour")
     RATELIMIT_AUTH = os.environ.get("RATELIMIT_AUTH", "5 per minute")
+    # Общий бюджет на клиента: запрос списывает свою стоимость (поиск 10, заказ 20, пароль 50)
+    RATELIMIT_COST_BUDGET = os.environ.get("RATELIMIT_COST_BUDGET", "1000 per hour")
+    RATELIMIT_COST_DB_MS_PER_UNIT = float(os.environ.get("RATELIMIT_COST_DB_MS_PER_UNIT", 50))  # 0 - не учитывать время БД
+    RATELIMIT_COST_MAX = int(os.environ.get("RATELIMIT_COST_MAX", 100))
+    
+    # Блокировка входа после неудачных попыток (счетчики по email и IP в кэше)
+    LOGIN_THROTTLE_EMAIL_FREE_ATTEMPTS = int(os.environ.get("LOGIN_THROTTLE_EMAIL_FREE_ATTEMPTS", 5))
+    LOGIN_THROTTLE_IP_FREE_ATTEMPTS = int(os.environ.get("LOGIN_THROTTLE_IP_FREE_ATTEMPTS", 20))
+    LOGIN_THROTTLE_BASE_DELAY = float(os.environ.get("LOGIN_THROTTLE_BASE_DELAY", 2))  # секунды, удваивается
+    LOGIN_THROTTLE_MAX_DELAY = float(os.environ.get("LOGIN_THROTTLE_MAX_DELAY", 900))
+    LOGIN_THROTTLE_WINDOW = int(os.environ.get("LOGIN_THROTTLE_WINDOW", 3600))  # память о неудачах
     
     # Caching
     CACHE_TYPE = os.environ.get("CACHE_TYPE", "SimpleCache")
@@ -46,6 +74,88 @@ class Config:
             'CACHE_DEFAULT_TIMEOUT': CACHE_DEFAULT_TIMEOUT
         }
     
+    # Исходящая почта (очередь outbound_email и фоновый отправитель)
+    MAIL_SERVER = os.environ.get("MAIL_SERVER", None)  # без сервера письма остаются в очереди
+    MAIL_PORT = int(os.environ.get("MAIL_PORT", 587))
+    MAIL_USE_TLS = os.environ.get("MAIL_USE_TLS", "True").lower() == "true"
+    MAIL_USE_SSL = os.environ.get("MAIL_USE_SSL", "False").lower() == "true"
+    MAIL_USERNAME = os.environ.get("MAIL_USERNAME", None)
+    MAIL_PASSWORD = os.environ.get("MAIL_PASSWORD", None)
+    MAIL_DEFAULT_SENDER = os.environ.get("MAIL_DEFAULT_SENDER", "noreply@tkani.local")
+    MAIL_TIMEOUT = float(os.environ.get("MAIL_TIMEOUT", 10))
+    MAIL_DISPATCHER_ENABLED = os.environ.get("MAIL_DISPATCHER_ENABLED", "False").lower() == "true"
+    MAIL_BATCH_SIZE = int(os.environ.get("MAIL_BATCH_SIZE", 50))
+    MAIL_POLL_INTERVAL = float(os.environ.get("MAIL_POLL_INTERVAL", 2))
+    MAIL_MAX_ATTEMPTS = int(os.environ.get("MAIL_MAX_ATTEMPTS", 8))
+    MAIL_BACKOFF_BASE = float(os.environ.get("MAIL_BACKOFF_BASE", 10))
+    MAIL_BACKOFF_MAX = float(os.environ.get("MAIL_BACKOFF_MAX", 3600))
+    MAIL_RETENTION_DAYS = int(os.environ.get("MAIL_RETENTION_DAYS", 7))
+    MAIL_SENSITIVE_RETENTION_MINUTES = int(os.environ.get("MAIL_SENSITIVE_RETENTION_MINUTES", 60))  # письма с кодами
+    
+    # Коды восстановления пароля
+    RESET_CODE_TTL_MINUTES = int(os.environ.get("RESET_CODE_TTL_MINUTES", 15))
+    RESET_CODE_SWEEPER_ENABLED = os.environ.get("RESET_CODE_SWEEPER_ENABLED", "False").lower() == "true"
+    RESET_CODE_SWEEP_INTERVAL = float(os.environ.get("RESET_CODE_SWEEP_INTERVAL", 300))  # секунды
+    RESET_CODE_SWEEP_BATCH_SIZE = int(os.environ.get("RESET_CODE_SWEEP_BATCH_SIZE", 1000))
+    
+    # Выгрузки для админки (размер порции серверного курсора)
+    EXPORT_YIELD_PER = int(os.environ.get("EXPORT_YIELD_PER", 1000))
+    
+    # Transactional outbox: доставка событий заказов во внешние системы
+    OUTBOX_WEBHOOKS = [url.strip() for url in os.environ.get("OUTBOX_WEBHOOKS", "").split(",") if url.strip()]
+    OUTBOX_DISPATCHER_ENABLED = os.environ.get("OUTBOX_DISPATCHER_ENABLED", "False").lower() == "true"
+    OUTBOX_BATCH_SIZE = int(os.environ.get("OUTBOX_BATCH_SIZE", 100))
+    OUTBOX_POLL_INTERVAL = float(os.environ.get("OUTBOX_POLL_INTERVAL", 2))
+    OUTBOX_WEBHOOK_TIMEOUT = float(os.environ.get("OUTBOX_WEBHOOK_TIMEOUT", 5))
+    OUTBOX_MAX_ATTEMPTS = int(os.environ.get("OUTBOX_MAX_ATTEMPTS", 10))
+    OUTBOX_BACKOFF_BASE = float(os.environ.get("OUTBOX_BACKOFF_BASE", 5))  # секунды
+    OUTBOX_BACKOFF_MAX = float(os.environ.get("OUTBOX_BACKOFF_MAX", 3600))
+    OUTBOX_RETENTION_DAYS = int(os.environ.get("OUTBOX_RETENTION_DAYS", 7))
+    
+    # Server-Sent Events для статусов заказов
+    EVENTS_REDIS_URL = os.environ.get("EVENTS_REDIS_URL", None)  # общий канал для нескольких воркеров
+    SSE_HEARTBEAT_INTERVAL = float(os.environ.get("SSE_HEARTBEAT_INTERVAL", 15))  # секунды
+    SSE_QUEUE_SIZE = int(os.environ.get("SSE_QUEUE_SIZE", 100))
+    
+    # Архивирование завершенных заказов
+    ORDERS_ARCHIVE_AFTER_DAYS = int(os.environ.get("ORDERS_ARCHIVE_AFTER_DAYS", 180))
+    ORDERS_ARCHIVE_BATCH_SIZE = int(os.environ.get("ORDERS_ARCHIVE_BATCH_SIZE", 500))
+    
+    # Очередь оформления заказов (ответ 202 + тикет вместо синхронного создания)
+    CHECKOUT_QUEUE_ENABLED = os.environ.get("CHECKOUT_QUEUE_ENABLED", "False").lower() == "true"
+    CHECKOUT_WORKERS = int(os.environ.get("CHECKOUT_WORKERS", 4))  # 0 - только внешний `flask checkout-worker`
+    CHECKOUT_POLL_INTERVAL = float(os.environ.get("CHECKOUT_POLL_INTERVAL", 1))
+    CHECKOUT_MAX_ATTEMPTS = int(os.environ.get("CHECKOUT_MAX_ATTEMPTS", 3))
+    CHECKOUT_STALE_AFTER = int(os.environ.get("CHECKOUT_STALE_AFTER", 300))  # секунды в processing до повтора
+    CHECKOUT_SWEEP_INTERVAL = int(os.environ.get("CHECKOUT_SWEEP_INTERVAL", 30))  # проверка очереди в API
+    
+    # Импорт товаров из CSV
+    PRODUCT_IMPORT_IMAGES_DIR = os.environ.get("PRODUCT_IMPORT_IMAGES_DIR", os.path.join(basedir, "import_images"))
+    PRODUCT_IMPORT_BATCH_SIZE = int(os.environ.get("PRODUCT_IMPORT_BATCH_SIZE", 500))
+    PRODUCT_IMPORT_IMAGE_WORKERS = int(os.environ.get("PRODUCT_IMPORT_IMAGE_WORKERS", 4))
+    PRODUCT_IMPORT_MAX_ERRORS = int(os.environ.get("PRODUCT_IMPORT_MAX_ERRORS", 1000))
+    
+    # Уменьшенные копии изображений (WebP и JPEG без EXIF) для srcset
+    IMAGE_VARIANT_WIDTHS = [int(w) for w in os.environ.get("IMAGE_VARIANT_WIDTHS", "320,640,1280").split(",") if w.strip()]
+    IMAGE_AVATAR_WIDTHS = [int(w) for w in os.environ.get("IMAGE_AVATAR_WIDTHS", "64,128,256").split(",") if w.strip()]
+    IMAGE_VARIANT_QUALITY = int(os.environ.get("IMAGE_VARIANT_QUALITY", 80))
+    IMAGE_WORKERS = int(os.environ.get("IMAGE_WORKERS", 2))  # процессы Pillow; 0 - синхронно в запросе
+    
+    # Хранилище загрузок по хэшу содержимого
+    MEDIA_GC_GRACE_SECONDS = int(os.environ.get("MEDIA_GC_GRACE_SECONDS", 3600))  # файлы без ссылок удаляются не раньше
+    MEDIA_IMMUTABLE_MAX_AGE = int(os.environ.get("MEDIA_IMMUTABLE_MAX_AGE", 31536000))  # год
+    MEDIA_MAX_AGE = int(os.environ.get("MEDIA_MAX_AGE", 86400))  # файлы со старыми именами (uuid)
+    # Отдача тела файла прокси: "" - приложением, "x-accel-redirect" - nginx, "x-sendfile" - Apache/lighttpd
+    MEDIA_OFFLOAD = os.environ.get("MEDIA_OFFLOAD", "")
+    MEDIA_ACCEL_PREFIX = os.environ.get("MEDIA_ACCEL_PREFIX", "/protected-media")  # internal location nginx
+    # Копии по запросу /media/<путь>?w=&h=&fmt= - только разрешенные размеры и форматы
+    MEDIA_RESIZE_WIDTHS = [int(w) for w in os.environ.get("MEDIA_RESIZE_WIDTHS", "64,128,256,320,480,640,960,1280,1920").split(",") if w.strip()]
+    MEDIA_RESIZE_HEIGHTS = [int(h) for h in os.environ.get("MEDIA_RESIZE_HEIGHTS", "64,128,256,320,480,640,960,1280").split(",") if h.strip()]
+    MEDIA_RESIZE_FORMATS = [f.strip() for f in os.environ.get("MEDIA_RESIZE_FORMATS", "webp,jpeg,png").split(",") if f.strip()]
+    MEDIA_RESIZE_CACHE_DIR = os.environ.get("MEDIA_RESIZE_CACHE_DIR", os.path.join(basedir, "instance", "media-cache"))
+    MEDIA_RESIZE_CACHE_BYTES = int(os.environ.get("MEDIA_RESIZE_CACHE_BYTES", 512 * 1024 * 1024))
+    MEDIA_ACCEL_CACHE_PREFIX = os.environ.get("MEDIA_ACCEL_CACHE_PREFIX", "/protected-media-cache")
+    
     # API
     API_VERSION = "v1"
     API_BASE_URL = os.environ.get("API_BASE_URL", "http://localhost:5001")
@@ -88,6 +198,15 @@ class ProductionConfig(Config):
     """Конфигурация для production"""
     DEBUG = False
     FLASK_ENV = "production"
+    # Лимиты общие для всех воркеров на сервере, если не задан Redis
+    RATELIMIT_STORAGE_URL = os.environ.get(
+        "RATELIMIT_STORAGE_URL", "sqlite:///" + os.path.join(basedir, "instance", "ratelimit.db")
+    )
+    # Отзыв токенов общий для всех воркеров на сервере, если не задан Redis
+    TOKEN_DENYLIST_SQLITE_PATH = os.environ.get(
+        "TOKEN_DENYLIST_SQLITE_PATH",
+        None if os.environ.get("TOKEN_DENYLIST_REDIS_URL") else os.path.join(basedir, "instance", "denylist.db")
+    )
 
 # Выбор конфигурации на основе переменной окружения
 config = {
@@ -43,6 +43,24 @@ class ConflictError(APIError):
     """Конфликт данных"""
     status_code = 409
 
+class TooManyRequestsError(APIError):
+    """Слишком много попыток, повторить можно через retry_after секунд"""
+    status_code = 429
+
+    def __init__(self, message=None, retry_after=None, payload=None):
+        APIError.__init__(self, message, payload=payload)
+        self.retry_after = retry_after
+
+    def to_dict(self):
+        rv = APIError.to_dict(self)
+        if self.retry_after is not None:
+            rv['retry_after'] = self.retry_after
+        return rv
+
+class ServiceUnavailableError(APIError):
+    """Сервис временно перегружен"""
+    status_code = 503
+
 class InternalServerError(APIError):
     """Внутренняя ошибка сервера"""
     status_code = 500
@@ -54,6 +72,8 @@ def register_error_handlers(app):
     def handle_api_error(error):
         response = jsonify(error.to_dict())
         response.status_code = error.status_code
+        if getattr(error, 'retry_after', None) is not None:
+            response.headers['Retry-After'] = str(error.retry_after)
         return response
 
     @app.errorhandler(HTTPException)
@@ -1,6 +1,5 @@
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
-from werkzeug.security import generate_password_hash, check_password_hash
 
 db = SQLAlchemy()
 
@@ -12,6 +11,7 @@ class User(db.Model):
     password_hash = db.Column(db.String(200), nullable=False)
     avatar = db.Column(db.String(300))  # путь к файлу в static/avatars
     role = db.Column(db.String(20), default="user", index=True)  # user, admin
+    token_version = db.Column(db.Integer, default=1, nullable=False)  # claim ver в JWT
     created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     orders = db.relationship("Order", backref="user", lazy=True)
     
@@ -21,10 +21,16 @@ class User(db.Model):
     )
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password, method='pbkdf2:sha256')
+        from services.passwords import hash_password
+        self.password_hash = hash_password(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        from services.passwords import verify_password
+        return verify_password(self.password_hash, password)
+
+    def password_needs_rehash(self):
+        from services.passwords import needs_rehash
+        return needs_rehash(self.password_hash)
 
 class Category(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -49,6 +55,7 @@ class Brand(db.Model):
 
 class Product(db.Model):
     id = db.Column(db.Integer, primary_key=True)
+    sku = db.Column(db.String(64), unique=True, index=True)  # артикул поставщика (ключ импорта)
     title = db.Column(db.String(200), nullable=False, index=True)
     description = db.Column(db.Text)
     price = db.Column(db.Float, nullable=False, index=True)
@@ -84,6 +91,10 @@ class Order(db.Model):
         db.Index('idx_order_user', 'user_id'),
         db.Index('idx_order_status', 'status'),
         db.Index('idx_order_created', 'created_at'),
+        # Составные индексы под выборки "мои заказы" и очередь заказов в админке
+        db.Index('idx_order_user_created', 'user_id', 'created_at', 'id'),
+        db.Index('idx_order_user_status_created', 'user_id', 'status', 'created_at', 'id'),
+        db.Index('idx_order_status_created', 'status', 'created_at', 'id'),
     )
 
 class OrderItem(db.Model):
@@ -128,14 +139,156 @@ class Work(db.Model):
 class PasswordResetCode(db.Model):
     """Коды восстановления пароля"""
     id = db.Column(db.Integer, primary_key=True)
-    email = db.Column(db.String(200), nullable=False, index=True)
-    code = db.Column(db.String(6), nullable=False)  # 6-значный код
+    email = db.Column(db.String(200), nullable=False)
+    code_hash = db.Column(db.String(64), nullable=False)  # HMAC-SHA256 от email и 6-значного кода
     expires_at = db.Column(db.DateTime, nullable=False, index=True)
-    used = db.Column(db.Boolean, default=False, index=True)
+    used = db.Column(db.Boolean, default=False, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     
     __table_args__ = (
         db.Index('idx_resetcode_email', 'email'),
-        db.Index('idx_resetcode_expires', 'expires_at'),
-        db.Index('idx_resetcode_used', 'used'),
-    )
\ No newline at end of file
+        db.Index('idx_resetcode_lookup', 'code_hash', 'used', 'expires_at'),
+    )
+
+class OutboxEvent(db.Model):
+    """Исходящие события (transactional outbox) для внешних систем"""
+    id = db.Column(db.Integer, primary_key=True)
+    event_type = db.Column(db.String(100), nullable=False)  # order.created, order.status_changed
+    aggregate_id = db.Column(db.Integer, nullable=False, index=True)  # id заказа
+    payload = db.Column(db.Text, nullable=False)  # JSON с данными события
+    status = db.Column(db.String(20), default="pending", nullable=False)  # pending, delivered, failed
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    delivered_at = db.Column(db.DateTime)
+    
+    __table_args__ = (
+        db.Index('idx_outbox_status_next', 'status', 'next_attempt_at', 'id'),
+    )
+
+class SalesDailyStat(db.Model):
+    """Агрегаты заказов по дням и статусам (обновляются вместе с заказами)"""
+    day = db.Column(db.Date, primary_key=True)
+    status = db.Column(db.String(50), primary_key=True)
+    orders_count = db.Column(db.Integer, default=0, nullable=False)
+    revenue = db.Column(db.Float, default=0.0, nullable=False)
+
+class ProductDailyStat(db.Model):
+    """Продажи товаров по дням (штуки и выручка)"""
+    day = db.Column(db.Date, primary_key=True)
+    product_id = db.Column(db.Integer, primary_key=True, index=True)
+    units = db.Column(db.Integer, default=0, nullable=False)
+    revenue = db.Column(db.Float, default=0.0, nullable=False)
+
+class ArchivedOrder(db.Model):
+    """Архив завершенных заказов (холодные данные, переносятся из order)"""
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)  # id сохраняется из order
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False, index=True)
+    created_at = db.Column(db.DateTime, index=True)
+    total = db.Column(db.Float, nullable=False)
+    status = db.Column(db.String(50), index=True)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+    items = db.relationship("ArchivedOrderItem", backref="order", lazy=True, cascade="all, delete-orphan")
+    history = db.relationship("ArchivedOrderHistory", backref="order", lazy=True, cascade="all, delete-orphan")
+    user = db.relationship("User")
+    
+    __table_args__ = (
+        db.Index('idx_archorder_user_created', 'user_id', 'created_at', 'id'),
+        db.Index('idx_archorder_status_created', 'status', 'created_at', 'id'),
+    )
+
+class ArchivedOrderItem(db.Model):
+    """Позиции архивных заказов"""
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    order_id = db.Column(db.Integer, db.ForeignKey("archived_order.id"), nullable=False, index=True)
+    product_id = db.Column(db.Integer, db.ForeignKey("product.id"), nullable=False, index=True)
+    quantity = db.Column(db.Integer, nullable=False)
+    price = db.Column(db.Float, nullable=False)
+    product = db.relationship("Product")
+
+class ArchivedOrderHistory(db.Model):
+    """История архивных заказов"""
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    order_id = db.Column(db.Integer, db.ForeignKey("archived_order.id"), nullable=False, index=True)
+    status = db.Column(db.String(50), nullable=False)
+    changed_by = db.Column(db.String(200))
+    comment = db.Column(db.Text)
+    created_at = db.Column(db.DateTime)
+
+class CheckoutTicket(db.Model):
+    """Тикет оформления заказа в очереди (асинхронный checkout)"""
+    id = db.Column(db.String(32), primary_key=True)  # uuid4 hex
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False, index=True)
+    cart = db.Column(db.Text, nullable=False)  # JSON {product_id: quantity}
+    details = db.Column(db.Text)  # JSON: адрес доставки, телефон, комментарий
+    status = db.Column(db.String(20), default="queued", nullable=False)  # queued, processing, completed, failed
+    attempts = db.Column(db.Integer, default=0, nullable=False)  # сколько раз тикет брался в обработку
+    order_id = db.Column(db.Integer)
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('idx_checkout_status_created', 'status', 'created_at'),
+    )
+
+class ProductImportJob(db.Model):
+    """Задача массового импорта товаров из CSV"""
+    id = db.Column(db.String(32), primary_key=True)  # uuid4 hex
+    filename = db.Column(db.String(300))
+    status = db.Column(db.String(20), default="queued", nullable=False, index=True)  # queued, running, completed, failed
+    processed_rows = db.Column(db.Integer, default=0, nullable=False)
+    created_count = db.Column(db.Integer, default=0, nullable=False)
+    updated_count = db.Column(db.Integer, default=0, nullable=False)
+    failed_count = db.Column(db.Integer, default=0, nullable=False)
+    errors = db.Column(db.Text)  # JSON [{"row": номер строки, "errors": ...}]
+    created_by = db.Column(db.Integer, db.ForeignKey("user.id"))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    finished_at = db.Column(db.DateTime)
+
+class OutboundEmail(db.Model):
+    """Очередь исходящих писем (отправляет фоновый воркер)"""
+    id = db.Column(db.Integer, primary_key=True)
+    recipient = db.Column(db.String(200), nullable=False)
+    subject = db.Column(db.String(300), nullable=False)
+    body = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(20), default="pending", nullable=False)  # pending, sent, failed
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    last_error = db.Column(db.Text)
+    sensitive = db.Column(db.Boolean, default=False, nullable=False)  # тело с секретом, стирается после отправки
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    sent_at = db.Column(db.DateTime)
+    
+    __table_args__ = (
+        db.Index('idx_email_status_next', 'status', 'next_attempt_at', 'id'),
+    )
+
+class ImageVariant(db.Model):
+    """Уменьшенная копия загруженного изображения (для srcset)"""
+    id = db.Column(db.Integer, primary_key=True)
+    source = db.Column(db.String(500), nullable=False)  # путь исходного файла, как в Product.image / User.avatar
+    format = db.Column(db.String(10), nullable=False)  # webp, jpeg
+    width = db.Column(db.Integer, nullable=False)
+    height = db.Column(db.Integer, nullable=False)
+    path = db.Column(db.String(500), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.UniqueConstraint('source', 'format', 'width', name='uq_image_variant'),
+    )
+
+class MediaBlob(db.Model):
+    """Загруженный файл, хранящийся по хэшу содержимого, со счетчиком ссылок"""
+    id = db.Column(db.Integer, primary_key=True)
+    path = db.Column(db.String(500), unique=True, nullable=False)  # static/<вид>/ab/cd/<sha256>.<ext>
+    sha256 = db.Column(db.String(64), nullable=False)
+    size = db.Column(db.Integer, nullable=False, default=0)
+    ref_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('idx_mediablob_orphans', 'ref_count', 'updated_at'),
+    )
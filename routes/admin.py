@@ -1,26 +1,73 @@
-from flask import Blueprint, request, jsonify, current_app
-from models import db, Product, Category, User, Order, OrderItem, OrderHistory
-from routes.utils import save_product_image
+from flask import Blueprint, request, jsonify, current_app, Response, stream_with_context, url_for
+from models import (
+    db, Product, Category, User, Order, OrderItem, OrderHistory, SalesDailyStat, ProductDailyStat,
+    ArchivedOrder, ArchivedOrderItem, ProductImportJob
+)
+from routes.utils import (
+    save_product_image, keyset_paginate, encode_cursor, iter_export_rows, iter_json_list,
+    gzip_stream, row_to_dict
+)
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from errors import NotFoundError, ValidationError, ForbiddenError
-from schemas import ProductCreateSchema, ProductUpdateSchema, ProductSchema, OrderSchema
+from services.stats import record_status_change, record_status_changes
+from services.events import sse_stream, ADMIN_TOPIC
+from services.archive import order_rows_query, order_totals_by_user
+from services.identity import current_identity, revoke_identity, forget_identity
+from services.media import release_media, product_media
+from routes.orders import lean_order_options, add_order_history, add_order_history_bulk, ORDER_STATUS_TRANSITIONS
+from schemas import (
+    ProductCreateSchema, ProductUpdateSchema, ProductSchema, ProductBulkUpdateItemSchema,
+    OrderSchema, OrderSummarySchema, OrderBulkStatusSchema
+)
+from routes.catalog import invalidate_product_caches
 from marshmallow import ValidationError as MarshmallowValidationError
-from sqlalchemy import func
+from sqlalchemy import func, select, union_all, or_, update
 from sqlalchemy.orm import joinedload
+from werkzeug.utils import secure_filename
+from datetime import datetime, timedelta
+from uuid import uuid4
+import json
 import os
+import tempfile
 
 admin_bp = Blueprint("admin", __name__)
 
+# Максимум заказов в одном массовом обновлении статуса
+BULK_STATUS_LIMIT = 5000
+
+# Остаток, ниже которого товар считается заканчивающимся
+LOW_STOCK_THRESHOLD = 10
+
+# Колонки товара, доступные в списке админки (параметр fields)
+PRODUCT_LIST_FIELDS = (
+    "id", "sku", "title", "description", "price", "stock", "image", "images", "specifications",
+    "rating", "reviews_count", "category_id", "brand_id", "created_at", "updated_at"
+)
+# По умолчанию без тяжелых текстовых колонок (описание, изображения, характеристики)
+PRODUCT_LIST_DEFAULT_FIELDS = (
+    "id", "sku", "title", "price", "stock", "image", "category_id", "brand_id", "created_at", "updated_at"
+)
+PRODUCT_LIST_MAX_LIMIT = 200
+
+# Массовое обновление цен и остатков
+PRODUCT_BULK_UPDATE_LIMIT = 50000
+PRODUCT_BULK_LOOKUP_CHUNK = 5000
+USER_LIST_MAX_LIMIT = 200
+
+def ensure_admin():
+    """Проверить, что текущий пользователь - администратор (роль из JWT, без запроса к БД)"""
+    identity = current_identity()
+    if not identity or identity.role != "admin":
+        raise ForbiddenError("Требуются права администратора")
+    return identity
+
 def admin_required(f):
     """Декоратор для проверки прав администратора"""
     from functools import wraps
     @wraps(f)
     @jwt_required()
     def decorated_function(*args, **kwargs):
-        user_id = get_jwt_identity()
-        user = User.query.get(user_id)
-        if not user or user.role != "admin":
-            raise ForbiddenError("Требуются права администратора")
+        ensure_admin()
         return f(*args, **kwargs)
     return decorated_function
 
@@ -28,27 +75,122 @@ def admin_required(f):
 @admin_required
 def list_all_products():
     """
-    Получить список всех товаров (для админа)
+    Получить список товаров (для админа) с пагинацией, поиском и выбором колонок
     ---
     tags:
       - admin
     security:
       - Bearer: []
+    parameters:
+      - name: q
+        in: query
+        type: string
+        description: Поиск по названию
+      - name: category_id
+        in: query
+        type: integer
+      - name: brand_id
+        in: query
+        type: integer
+      - name: low_stock
+        in: query
+        type: boolean
+        default: false
+        description: Только товары с остатком меньше LOW_STOCK_THRESHOLD
+      - name: fields
+        in: query
+        type: string
+        description: Колонки через запятую (например, "id,title,price,stock")
+      - name: page
+        in: query
+        type: integer
+        default: 1
+      - name: limit
+        in: query
+        type: integer
+        default: 50
+      - name: cursor
+        in: query
+        type: string
+        description: Курсор следующей страницы (keyset-пагинация). Пустое значение - первая страница
+      - name: stream
+        in: query
+        type: boolean
+        default: false
+        description: Отдать все подходящие товары потоковым JSON без пагинации
     responses:
       200:
-        description: Список всех товаров
+        description: Страница товаров
     """
     try:
-        products = Product.query.order_by(Product.id.desc()).all()
-        product_schema = ProductSchema(many=True)
+        fields = _parse_product_fields(request.args.get("fields"))
+        page = request.args.get("page", 1, type=int)
+        limit = max(min(request.args.get("limit", 50, type=int), PRODUCT_LIST_MAX_LIMIT), 1)
+        cursor = request.args.get("cursor")
+        stream = request.args.get("stream", "false").lower() in ("1", "true", "yes")
         
-        return jsonify({
+        # Только выбранные колонки, без ORM-объектов и ленивой загрузки связей
+        query = db.session.query(*[getattr(Product, name) for name in fields])
+        q = request.args.get("q", "").strip()
+        if q:
+            query = query.filter(Product.title.ilike(f"%{q}%"))
+        category_id = request.args.get("category_id", type=int)
+        if category_id:
+            query = query.filter(Product.category_id == category_id)
+        brand_id = request.args.get("brand_id", type=int)
+        if brand_id:
+            query = query.filter(Product.brand_id == brand_id)
+        if request.args.get("low_stock", "false").lower() in ("1", "true", "yes"):
+            query = query.filter(Product.stock < LOW_STOCK_THRESHOLD)
+        
+        if stream:
+            rows = query.order_by(Product.id.desc()).yield_per(current_app.config.get("EXPORT_YIELD_PER", 1000))
+            response = Response(
+                stream_with_context(iter_json_list(rows, fields, key="products")),
+                mimetype="application/json"
+            )
+            response.headers["Cache-Control"] = "no-store"
+            return response
+        
+        pagination = None
+        if cursor is not None:
+            page_rows, next_cursor = keyset_paginate(query, [Product.id], cursor=cursor, limit=limit)
+        else:
+            pagination = query.order_by(Product.id.desc()).paginate(page=page, per_page=limit, error_out=False)
+            page_rows = pagination.items
+            next_cursor = None
+            if pagination.has_next and page_rows:
+                next_cursor = encode_cursor([page_rows[-1].id])
+        
+        result = {
             "success": True,
-            "products": product_schema.dump(products)
-        }), 200
+            "products": [row_to_dict(row, fields) for row in page_rows],
+            "next_cursor": next_cursor
+        }
+        if pagination is not None:
+            result.update({
+                "total": pagination.total,
+                "page": page,
+                "totalPages": pagination.pages
+            })
+        return jsonify(result), 200
+    except ValidationError as e:
+        raise
     except Exception as e:
         raise ValidationError(f"Ошибка при получении товаров: {str(e)}")
 
+def _parse_product_fields(value):
+    """Список колонок товара из параметра fields (id добавляется всегда)"""
+    if not value:
+        return list(PRODUCT_LIST_DEFAULT_FIELDS)
+    fields = [name.strip() for name in value.split(",") if name.strip()]
+    unknown = [name for name in fields if name not in PRODUCT_LIST_FIELDS]
+    if unknown:
+        raise ValidationError(f"Недопустимые поля: {', '.join(unknown)}")
+    if "id" not in fields:
+        fields.insert(0, "id")
+    return list(dict.fromkeys(fields))
+
 @admin_bp.route("/products", methods=["POST"])
 @admin_required
 def create_product():
@@ -113,9 +255,8 @@ def create_product():
         db.session.commit()
         
         # Очищаем кэш каталога
-        cache = current_app.cache
-        cache.delete_memoized(list_all_products)
-        cache.delete("categories_list")
+        invalidate_product_caches()
+        current_app.cache.delete("categories_list")
         
         product_schema = ProductSchema()
         return jsonify({
@@ -130,6 +271,177 @@ def create_product():
         db.session.rollback()
         raise ValidationError(f"Ошибка при создании товара: {str(e)}")
 
+@admin_bp.route("/products", methods=["PATCH"])
+@admin_required
+def bulk_update_products():
+    """
+    Массово обновить цены и остатки товаров одной транзакцией
+    ---
+    tags:
+      - admin
+    security:
+      - Bearer: []
+    parameters:
+      - name: body
+        in: body
+        required: true
+        schema:
+          type: array
+          items:
+            type: object
+            required: [id]
+            properties:
+              id:
+                type: integer
+              price:
+                type: number
+              stock:
+                type: integer
+    responses:
+      200:
+        description: Количество обновленных товаров и id, которых нет в каталоге
+      400:
+        description: Ошибка валидации (с номерами элементов)
+    """
+    data = request.get_json(silent=True)
+    if isinstance(data, dict):
+        data = data.get("items")
+    if not isinstance(data, list) or not data:
+        raise ValidationError("Ожидается непустой массив {id, price, stock}")
+    if len(data) > PRODUCT_BULK_UPDATE_LIMIT:
+        raise ValidationError(f"Не больше {PRODUCT_BULK_UPDATE_LIMIT} товаров за запрос")
+    try:
+        items = ProductBulkUpdateItemSchema(many=True).load(data)
+    except MarshmallowValidationError as err:
+        messages = err.messages if isinstance(err.messages, dict) else {"_": err.messages}
+        errors = [{"index": index, "errors": errors} for index, errors in list(messages.items())[:100]]
+        raise ValidationError("Ошибка валидации", payload={"errors": errors})
+    
+    try:
+        # Повторы id: побеждает последний элемент
+        changes = {item["id"]: item for item in items}
+        ids = list(changes)
+        existing = set()
+        for start in range(0, len(ids), PRODUCT_BULK_LOOKUP_CHUNK):
+            chunk = ids[start:start + PRODUCT_BULK_LOOKUP_CHUNK]
+            existing.update(row[0] for row in db.session.query(Product.id).filter(Product.id.in_(chunk)))
+        
+        now = datetime.utcnow()
+        rows = [dict(changes[product_id], updated_at=now) for product_id in ids if product_id in existing]
+        if rows:
+            # ORM bulk UPDATE по первичному ключу: executemany, сгруппированный по набору полей
+            db.session.execute(update(Product), rows)
+        db.session.commit()
+        
+        invalidate_product_caches([row["id"] for row in rows])
+        
+        not_found = [product_id for product_id in ids if product_id not in existing]
+        return jsonify({
+            "success": True,
+            "updated": len(rows),
+            "not_found": not_found[:1000],
+            "not_found_count": len(not_found)
+        }), 200
+    except ValidationError as e:
+        db.session.rollback()
+        raise
+    except Exception as e:
+        db.session.rollback()
+        raise ValidationError(f"Ошибка при массовом обновлении товаров: {str(e)}")
+
+@admin_bp.route("/products/import", methods=["POST"])
+@admin_required
+def import_products():
+    """
+    Запустить импорт товаров из CSV (upsert по sku или названию)
+    ---
+    tags:
+      - admin
+    security:
+      - Bearer: []
+    consumes:
+      - multipart/form-data
+    parameters:
+      - name: file
+        in: formData
+        type: file
+        required: true
+        description: CSV с колонками sku, title, description, price, stock, category, brand, image
+    responses:
+      202:
+        description: Задача импорта создана, прогресс - по job_id
+      400:
+        description: Файл не передан
+    """
+    f = request.files.get("file")
+    if not f or not f.filename:
+        raise ValidationError("Файл импорта не передан")
+    if not f.filename.lower().endswith((".csv", ".txt")):
+        raise ValidationError("Поддерживается только CSV")
+    try:
+        # Файл сохраняется на диск, чтобы импорт читал его потоково в фоне
+        fd, path = tempfile.mkstemp(suffix=".csv", prefix="product-import-")
+        with os.fdopen(fd, "wb") as out:
+            f.save(out)
+        job = ProductImportJob(
+            id=uuid4().hex,
+            filename=secure_filename(f.filename),
+            status="queued",
+            created_by=int(get_jwt_identity())
+        )
+        db.session.add(job)
+        db.session.commit()
+        current_app.product_import.submit(job.id, path)
+        resp = jsonify({"success": True, "job_id": job.id, "status": job.status})
+        resp.headers["Location"] = url_for(".import_job_status", job_id=job.id)
+        return resp, 202
+    except ValidationError as e:
+        db.session.rollback()
+        raise
+    except Exception as e:
+        db.session.rollback()
+        raise ValidationError(f"Ошибка при запуске импорта: {str(e)}")
+
+@admin_bp.route("/products/import/<string:job_id>", methods=["GET"])
+@admin_required
+def import_job_status(job_id):
+    """
+    Прогресс и ошибки задачи импорта товаров
+    ---
+    tags:
+      - admin
+    security:
+      - Bearer: []
+    parameters:
+      - name: job_id
+        in: path
+        type: string
+        required: true
+    responses:
+      200:
+        description: Статус задачи (queued, running, completed, failed), счетчики и ошибки по строкам
+      404:
+        description: Задача не найдена
+    """
+    job = db.session.get(ProductImportJob, job_id)
+    if not job:
+        raise NotFoundError("Задача импорта не найдена")
+    return jsonify({
+        "success": True,
+        "job": {
+            "id": job.id,
+            "filename": job.filename,
+            "status": job.status,
+            "processed_rows": job.processed_rows,
+            "created": job.created_count,
+            "updated": job.updated_count,
+            "failed": job.failed_count,
+            "errors": json.loads(job.errors) if job.errors else [],
+            "created_at": job.created_at.isoformat() if job.created_at else None,
+            "finished_at": job.finished_at.isoformat() if job.finished_at else None
+        }
+    }), 200
+
 @admin_bp.route("/products/<int:product_id>", methods=["PUT"])
 @admin_required
 def update_product(product_id):
@@ -200,14 +512,14 @@ def update_product(product_id):
                 saved = save_product_image(f)
                 if saved is None:
                     raise ValidationError("Недопустимое расширение файла изображения")
+                release_media(product.image)
                 product.image = saved
         
         db.session.commit()
         
         # Очищаем кэш
-        cache = current_app.cache
-        cache.delete(f"product_{product_id}")
-        cache.delete("categories_list")
+        invalidate_product_caches([product_id])
+        current_app.cache.delete("categories_list")
         
         product_schema = ProductSchema()
         return jsonify({
@@ -248,13 +560,14 @@ def delete_product(product_id):
         if not product:
             raise NotFoundError("Товар не найден")
         
+        # Файлы без ссылок удалит media-gc
+        release_media(*product_media(product.image, product.images))
         db.session.delete(product)
         db.session.commit()
         
         # Очищаем кэш
-        cache = current_app.cache
-        cache.delete(f"product_{product_id}")
-        cache.delete("categories_list")
+        invalidate_product_caches([product_id])
+        current_app.cache.delete("categories_list")
         
         return jsonify({
             "success": True,
@@ -277,6 +590,27 @@ def list_all_orders():
       - admin
     security:
       - Bearer: []
+    parameters:
+      - name: status
+        in: query
+        type: string
+      - name: page
+        in: query
+        type: integer
+        default: 1
+      - name: limit
+        in: query
+        type: integer
+        default: 20
+      - name: cursor
+        in: query
+        type: string
+        description: Курсор следующей страницы (keyset-пагинация). Пустое значение - первая страница
+      - name: include_archived
+        in: query
+        type: boolean
+        default: false
+        description: Включить архивные заказы
     responses:
       200:
         description: Список всех заказов
@@ -284,29 +618,94 @@ def list_all_orders():
     try:
         status = request.args.get('status')
         page = request.args.get('page', 1, type=int)
-        limit = request.args.get('limit', 20, type=int)
+        limit = max(min(request.args.get('limit', 20, type=int), 100), 1)
+        cursor = request.args.get('cursor')
+        include_archived = request.args.get('include_archived', 'false').lower() in ('1', 'true', 'yes')
         
-        query = Order.query.options(joinedload(Order.user), joinedload(Order.items).joinedload(OrderItem.product))
+        # Сначала выбираем страницу легких строк (в т.ч. из архива), затем догружаем заказы
+        query, rows = order_rows_query(include_archived=include_archived, status=status)
         
-        if status:
-            query = query.filter(Order.status == status)
+        pagination = None
+        if cursor is not None:
+            page_rows, next_cursor = keyset_paginate(
+                query, [rows.c.created_at, rows.c.id], cursor=cursor, limit=limit
+            )
+        else:
+            pagination = query.order_by(rows.c.created_at.desc(), rows.c.id.desc()).paginate(
+                page=page, per_page=limit, error_out=False
+            )
+            page_rows = pagination.items
+            next_cursor = None
+            if pagination.has_next and page_rows:
+                next_cursor = encode_cursor([page_rows[-1].created_at, page_rows[-1].id])
         
-        orders = query.order_by(Order.created_at.desc()).paginate(
-            page=page, per_page=limit, error_out=False
-        )
+        orders = _load_lean_orders(page_rows)
+        order_schema = OrderSummarySchema(many=True)
         
-        order_schema = OrderSchema(many=True)
-        
-        return jsonify({
+        result = {
             "success": True,
-            "orders": order_schema.dump(orders.items),
-            "total": orders.total,
-            "page": page,
-            "totalPages": orders.pages
-        }), 200
+            "orders": order_schema.dump(orders),
+            "next_cursor": next_cursor
+        }
+        if pagination is not None:
+            result.update({
+                "total": pagination.total,
+                "page": page,
+                "totalPages": pagination.pages
+            })
+        return jsonify(result), 200
+    except ValidationError as e:
+        raise
     except Exception as e:
         raise ValidationError(f"Ошибка при получении заказов: {str(e)}")
 
+def _load_lean_orders(page_rows):
+    """Загрузить заказы страницы (оперативные и архивные) в порядке строк"""
+    hot_ids = [row.id for row in page_rows if not row.archived]
+    archived_ids = [row.id for row in page_rows if row.archived]
+    loaded = {}
+    if hot_ids:
+        for order in Order.query.options(*lean_order_options(with_user=True)).filter(Order.id.in_(hot_ids)):
+            loaded[(order.id, False)] = order
+    if archived_ids:
+        for order in ArchivedOrder.query.options(
+            *lean_order_options(with_user=True, archived=True)
+        ).filter(ArchivedOrder.id.in_(archived_ids)):
+            loaded[(order.id, True)] = order
+    return [loaded[(row.id, bool(row.archived))] for row in page_rows if (row.id, bool(row.archived)) in loaded]
+
+@admin_bp.route("/orders/events", methods=["GET"])
+@jwt_required(locations=["headers", "query_string"])
+def order_events():
+    """
+    Поток изменений статусов всех заказов (Server-Sent Events, для админа)
+    ---
+    tags:
+      - admin
+    security:
+      - Bearer: []
+    parameters:
+      - name: jwt
+        in: query
+        type: string
+        description: Токен доступа (EventSource не умеет передавать заголовки)
+    produces:
+      - text/event-stream
+    responses:
+      200:
+        description: События update_order_status
+    """
+    ensure_admin()
+    broker = current_app.event_broker
+    subscription = broker.subscribe([ADMIN_TOPIC])
+    response = Response(
+        sse_stream(broker, subscription, current_app.config.get("SSE_HEARTBEAT_INTERVAL", 15)),
+        mimetype="text/event-stream"
+    )
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
 @admin_bp.route("/orders/<int:order_id>", methods=["GET"])
 @admin_required
 def get_order(order_id):
@@ -330,6 +729,14 @@ def get_order(order_id):
             joinedload(Order.history)
         ).get(order_id)
         
+        # Завершенные старые заказы могли быть перенесены в архив
+        if not order:
+            order = ArchivedOrder.query.options(
+                joinedload(ArchivedOrder.user),
+                joinedload(ArchivedOrder.items).joinedload(ArchivedOrderItem.product),
+                joinedload(ArchivedOrder.history)
+            ).get(order_id)
+        
         if not order:
             raise NotFoundError("Заказ не найден")
         
@@ -343,6 +750,137 @@ def get_order(order_id):
     except Exception as e:
         raise ValidationError(f"Ошибка при получении заказа: {str(e)}")
 
+@admin_bp.route("/orders/status", methods=["PUT"])
+@admin_required
+def bulk_update_order_status():
+    """
+    Массово обновить статус заказов (для админа)
+    ---
+    tags:
+      - admin
+    security:
+      - Bearer: []
+    parameters:
+      - name: body
+        in: body
+        required: true
+        schema:
+          type: object
+          required: [status]
+          properties:
+            ids:
+              type: array
+              items:
+                type: integer
+            filter:
+              type: object
+              properties:
+                status:
+                  type: string
+                user_id:
+                  type: integer
+                date_from:
+                  type: string
+                date_to:
+                  type: string
+            status:
+              type: string
+            comment:
+              type: string
+    responses:
+      200:
+        description: Результат по каждому заказу
+      400:
+        description: Ошибка валидации
+    """
+    try:
+        try:
+            data = OrderBulkStatusSchema().load(request.get_json(silent=True) or {})
+        except MarshmallowValidationError as err:
+            raise ValidationError(f"Ошибка валидации: {err.messages}")
+        
+        new_status = data["status"]
+        if new_status not in ORDER_STATUS_TRANSITIONS:
+            raise ValidationError(
+                f"Недопустимый статус. Допустимые: {', '.join(ORDER_STATUS_TRANSITIONS)}"
+            )
+        allowed_sources = [
+            status for status, targets in ORDER_STATUS_TRANSITIONS.items() if new_status in targets
+        ]
+        
+        # Блокируем выбранные строки до конца транзакции
+        query = db.session.query(
+            Order.id, Order.status, Order.created_at, Order.total, Order.user_id
+        ).with_for_update()
+        if "ids" in data:
+            requested_ids = list(dict.fromkeys(data["ids"]))
+            query = query.filter(Order.id.in_(requested_ids))
+        else:
+            flt = data["filter"]
+            if "status" in flt:
+                query = query.filter(Order.status == flt["status"])
+            if "user_id" in flt:
+                query = query.filter(Order.user_id == flt["user_id"])
+            if "date_from" in flt:
+                query = query.filter(Order.created_at >= flt["date_from"])
+            if "date_to" in flt:
+                query = query.filter(Order.created_at <= flt["date_to"])
+            requested_ids = None
+        rows = query.order_by(Order.id).limit(BULK_STATUS_LIMIT + 1).all()
+        if len(rows) > BULK_STATUS_LIMIT:
+            raise ValidationError(f"Слишком много заказов за один запрос (максимум {BULK_STATUS_LIMIT})")
+        
+        updated_ids = []
+        changed_rows = []
+        owners = {}
+        failed = []
+        for order_id, current_status, created_at, total, owner_id in rows:
+            if current_status in allowed_sources:
+                updated_ids.append(order_id)
+                changed_rows.append((created_at, total, current_status))
+                owners[order_id] = owner_id
+            else:
+                failed.append({
+                    "id": order_id,
+                    "status": current_status,
+                    "error": f"Недопустимый переход из '{current_status}' в '{new_status}'"
+                })
+        if requested_ids is not None:
+            found = {row[0] for row in rows}
+            failed.extend(
+                {"id": order_id, "status": None, "error": "Заказ не найден"}
+                for order_id in requested_ids if order_id not in found
+            )
+        
+        if updated_ids:
+            # Один UPDATE на всю пачку вместо загрузки каждого заказа
+            Order.query.filter(
+                Order.id.in_(updated_ids),
+                Order.status.in_(allowed_sources)
+            ).update({Order.status: new_status}, synchronize_session=False)
+            add_order_history_bulk(
+                updated_ids, new_status,
+                changed_by=get_jwt_identity(),
+                comment=data.get("comment"),
+                user_ids=owners
+            )
+            record_status_changes(changed_rows, new_status)
+        db.session.commit()
+        
+        return jsonify({
+            "success": True,
+            "status": new_status,
+            "updated": len(updated_ids),
+            "updated_ids": updated_ids,
+            "failed": failed
+        }), 200
+    except ValidationError as e:
+        db.session.rollback()
+        raise
+    except Exception as e:
+        db.session.rollback()
+        raise ValidationError(f"Ошибка при массовом обновлении статусов: {str(e)}")
+
 @admin_bp.route("/orders/<int:order_id>/status", methods=["PUT"])
 @admin_required
 def update_order_status(order_id):
@@ -371,17 +909,13 @@ def update_order_status(order_id):
         if not new_status:
             raise ValidationError("Статус не указан")
         
-        # Добавляем в историю
+        # Добавляем в историю (и событие в outbox)
         admin_id = get_jwt_identity()
-        history = OrderHistory(
-            order_id=order_id,
-            status=new_status,
-            changed_by=str(admin_id),
-            comment=comment
-        )
-        db.session.add(history)
+        add_order_history(order_id, new_status, changed_by=admin_id, comment=comment)
         
+        old_status = order.status
         order.status = new_status
+        record_status_change(order, old_status, new_status)
         db.session.commit()
         
         order_schema = OrderSchema()
@@ -401,39 +935,105 @@ def update_order_status(order_id):
 @admin_required
 def list_all_users():
     """
-    Получить список всех пользователей (для админа)
+    Получить список пользователей (для админа) с количеством заказов и суммой покупок
     ---
     tags:
       - admin
     security:
       - Bearer: []
+    parameters:
+      - name: q
+        in: query
+        type: string
+        description: Поиск по началу email, имени или фамилии
+      - name: role
+        in: query
+        type: string
+        enum: [user, admin]
+      - name: page
+        in: query
+        type: integer
+        default: 1
+      - name: limit
+        in: query
+        type: integer
+        default: 50
+      - name: cursor
+        in: query
+        type: string
+        description: Курсор следующей страницы (keyset-пагинация). Пустое значение - первая страница
     responses:
       200:
-        description: Список всех пользователей
+        description: Страница пользователей
     """
     try:
-        users = User.query.order_by(User.created_at.desc()).all()
-        
-        users_data = []
-        for user in users:
-            users_data.append({
-                "id": user.id,
-                "first_name": user.first_name,
-                "last_name": user.last_name,
-                "email": user.email,
-                "role": user.role,
-                "avatar": user.avatar,
-                "created_at": user.created_at.isoformat() if user.created_at else None,
-                "orders_count": len(user.orders) if user.orders else 0
-            })
+        page = request.args.get("page", 1, type=int)
+        limit = max(min(request.args.get("limit", 50, type=int), USER_LIST_MAX_LIMIT), 1)
+        cursor = request.args.get("cursor")
         
-        return jsonify({
+        query = db.session.query(
+            User.id, User.first_name, User.last_name, User.email, User.role, User.avatar, User.created_at
+        )
+        q = request.args.get("q", "").strip()
+        if q:
+            prefix = f"{q}%"
+            query = query.filter(or_(
+                User.email.ilike(prefix), User.first_name.ilike(prefix), User.last_name.ilike(prefix)
+            ))
+        role = request.args.get("role")
+        if role:
+            query = query.filter(User.role == role)
+        
+        pagination = None
+        if cursor is not None:
+            page_rows, next_cursor = keyset_paginate(
+                query, [User.created_at, User.id], cursor=cursor, limit=limit
+            )
+        else:
+            pagination = query.order_by(User.created_at.desc(), User.id.desc()).paginate(
+                page=page, per_page=limit, error_out=False
+            )
+            page_rows = pagination.items
+            next_cursor = None
+            if pagination.has_next and page_rows:
+                next_cursor = encode_cursor([page_rows[-1].created_at, page_rows[-1].id])
+        
+        # Агрегаты по заказам - одним сгруппированным запросом для страницы
+        totals = order_totals_by_user([row.id for row in page_rows])
+        users_data = [_user_data(row, totals.get(row.id, (0, 0.0))) for row in page_rows]
+        
+        result = {
             "success": True,
-            "users": users_data
-        }), 200
+            "users": users_data,
+            "next_cursor": next_cursor
+        }
+        if pagination is not None:
+            result.update({
+                "total": pagination.total,
+                "page": page,
+                "totalPages": pagination.pages
+            })
+        return jsonify(result), 200
+    except ValidationError as e:
+        raise
     except Exception as e:
         raise ValidationError(f"Ошибка при получении пользователей: {str(e)}")
 
+def _user_data(user, totals):
+    """Данные пользователя для админки; totals - (orders_count, lifetime_spend)"""
+    orders_count, lifetime_spend = totals
+    return {
+        "id": user.id,
+        "first_name": user.first_name,
+        "last_name": user.last_name,
+        "email": user.email,
+        "role": user.role,
+        "avatar": user.avatar,
+        "created_at": user.created_at.isoformat() if user.created_at else None,
+        "orders_count": orders_count,
+        "lifetime_spend": lifetime_spend
+    }
+
 @admin_bp.route("/users/<int:user_id>", methods=["GET"])
 @admin_required
 def get_user(user_id):
@@ -455,20 +1055,11 @@ def get_user(user_id):
         if not user:
             raise NotFoundError("Пользователь не найден")
         
-        user_data = {
-            "id": user.id,
-            "first_name": user.first_name,
-            "last_name": user.last_name,
-            "email": user.email,
-            "role": user.role,
-            "avatar": user.avatar,
-            "created_at": user.created_at.isoformat() if user.created_at else None,
-            "orders_count": len(user.orders) if user.orders else 0
-        }
+        totals = order_totals_by_user([user.id]).get(user.id, (0, 0.0))
         
         return jsonify({
             "success": True,
-            "user": user_data
+            "user": _user_data(user, totals)
         }), 200
     except NotFoundError as e:
         raise
@@ -508,12 +1099,19 @@ def update_user(user_id):
             if existing_user:
                 raise ValidationError("Email уже используется")
             user.email = data["email"]
+        role_changed = False
         if "role" in data:
             if data["role"] not in ["user", "admin"]:
                 raise ValidationError("Недопустимая роль")
+            role_changed = data["role"] != user.role
             user.role = data["role"]
+            if role_changed:
+                # Токены со старой ролью больше не принимаются
+                revoke_identity(user)
         
         db.session.commit()
+        if role_changed:
+            forget_identity(user.id)
         
         user_data = {
             "id": user.id,
@@ -559,12 +1157,14 @@ def delete_user(user_id):
             raise NotFoundError("Пользователь не найден")
         
         # Нельзя удалить самого себя
-        current_user_id = get_jwt_identity()
+        current_user_id = int(get_jwt_identity())
         if user.id == current_user_id:
             raise ValidationError("Нельзя удалить самого себя")
         
+        release_media(user.avatar)
         db.session.delete(user)
         db.session.commit()
+        forget_identity(user_id)
         
         return jsonify({
             "success": True,
@@ -595,25 +1195,22 @@ def get_stats():
         # Общее количество товаров
         total_products = Product.query.count()
         
-        # Общее количество заказов
-        total_orders = Order.query.count()
-        
         # Общее количество пользователей
         total_users = User.query.count()
         
-        # Общая сумма всех заказов
-        total_revenue = db.session.query(func.sum(Order.total)).scalar() or 0
-        
-        # Заказы по статусам
+        # Заказы и выручка - из агрегатов по дням (O(дней), без сканирования заказов)
         orders_by_status = db.session.query(
-            Order.status,
-            func.count(Order.id)
-        ).group_by(Order.status).all()
+            SalesDailyStat.status,
+            func.sum(SalesDailyStat.orders_count),
+            func.sum(SalesDailyStat.revenue)
+        ).group_by(SalesDailyStat.status).all()
         
-        status_counts = {status: count for status, count in orders_by_status}
+        status_counts = {status: int(count) for status, count, _ in orders_by_status if count}
+        total_orders = sum(status_counts.values())
+        total_revenue = sum(revenue or 0 for _, _, revenue in orders_by_status)
         
-        # Товары с низким остатком (меньше 10)
-        low_stock_products = Product.query.filter(Product.stock < 10).count()
+        # Товары с низким остатком
+        low_stock_products = Product.query.filter(Product.stock < LOW_STOCK_THRESHOLD).count()
         
         return jsonify({
             "success": True,
@@ -621,10 +1218,199 @@ def get_stats():
                 "total_products": total_products,
                 "total_orders": total_orders,
                 "total_users": total_users,
-                "total_revenue": float(total_revenue),
+                "total_revenue": round(float(total_revenue), 2),
                 "orders_by_status": status_counts,
                 "low_stock_products": low_stock_products
             }
         }), 200
     except Exception as e:
         raise ValidationError(f"Ошибка при получении статистики: {str(e)}")
+
+
+def _parse_export_date(value, name, end_of_range=False):
+    """Разобрать границу периода выгрузки (YYYY-MM-DD или ISO datetime)"""
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise ValidationError(f"Некорректная дата в параметре {name}")
+    # Дата без времени в date_to включает весь день
+    if end_of_range and len(value) == 10:
+        parsed += timedelta(days=1)
+    return parsed
+
+def _export_query(entity):
+    """Запрос выгрузки: только нужные колонки, без ORM-объектов и связей"""
+    if entity == "orders":
+        columns = [
+            "order_id", "created_at", "status", "order_total", "user_id", "user_email",
+            "product_id", "product_title", "quantity", "price"
+        ]
+        # Оперативные и архивные заказы выгружаются одним потоком
+        def order_lines(order_model, item_model):
+            return select(
+                order_model.id.label("order_id"), order_model.created_at, order_model.status,
+                order_model.total, order_model.user_id, User.email,
+                item_model.product_id, Product.title, item_model.quantity, item_model.price
+            ).join(User, User.id == order_model.user_id) \
+             .outerjoin(item_model, item_model.order_id == order_model.id) \
+             .outerjoin(Product, Product.id == item_model.product_id)
+        lines = union_all(
+            order_lines(Order, OrderItem), order_lines(ArchivedOrder, ArchivedOrderItem)
+        ).subquery("order_lines")
+        query = db.session.query(lines).order_by(lines.c.order_id, lines.c.product_id)
+        return query, columns, lines.c.created_at
+    if entity == "users":
+        columns = ["id", "first_name", "last_name", "email", "role", "created_at"]
+        query = db.session.query(
+            User.id, User.first_name, User.last_name, User.email, User.role, User.created_at
+        ).order_by(User.id)
+        return query, columns, User.created_at
+    if entity == "products":
+        columns = [
+            "id", "sku", "title", "price", "stock", "category_id", "brand_id", "created_at", "updated_at"
+        ]
+        query = db.session.query(
+            Product.id, Product.sku, Product.title, Product.price, Product.stock, Product.category_id,
+            Product.brand_id, Product.created_at, Product.updated_at
+        ).order_by(Product.id)
+        return query, columns, Product.created_at
+    raise NotFoundError("Неизвестный тип выгрузки")
+
+@admin_bp.route("/export/<string:entity>", methods=["GET"])
+@admin_required
+def export_entity(entity):
+    """
+    Потоковая выгрузка заказов, пользователей или товаров (для админа)
+    ---
+    tags:
+      - admin
+    security:
+      - Bearer: []
+    parameters:
+      - name: entity
+        in: path
+        type: string
+        enum: [orders, users, products]
+        required: true
+      - name: format
+        in: query
+        type: string
+        enum: [csv, ndjson]
+        default: csv
+      - name: gzip
+        in: query
+        type: boolean
+        default: false
+      - name: date_from
+        in: query
+        type: string
+        description: Начало периода по created_at (YYYY-MM-DD или ISO datetime)
+      - name: date_to
+        in: query
+        type: string
+        description: Конец периода по created_at включительно
+    responses:
+      200:
+        description: Файл выгрузки (отдается потоком)
+      404:
+        description: Неизвестный тип выгрузки
+    """
+    fmt = request.args.get("format", "csv")
+    if fmt not in ("csv", "ndjson"):
+        raise ValidationError("Допустимые форматы: csv, ndjson")
+    compress = request.args.get("gzip", "false").lower() in ("1", "true", "yes")
+    date_from = _parse_export_date(request.args.get("date_from"), "date_from")
+    date_to = _parse_export_date(request.args.get("date_to"), "date_to", end_of_range=True)
+    
+    query, columns, created_column = _export_query(entity)
+    if date_from:
+        query = query.filter(created_column >= date_from)
+    if date_to:
+        query = query.filter(created_column < date_to)
+    
+    # Серверный курсор: строки читаются порциями, а не загружаются целиком
+    rows = query.yield_per(current_app.config.get("EXPORT_YIELD_PER", 1000))
+    body = iter_export_rows(rows, columns, fmt=fmt)
+    
+    filename = f"{entity}.{fmt}"
+    mimetype = "text/csv" if fmt == "csv" else "application/x-ndjson"
+    if compress:
+        body = gzip_stream(body)
+        filename += ".gz"
+        mimetype = "application/gzip"
+    
+    response = Response(stream_with_context(body), mimetype=mimetype)
+    response.headers["Content-Disposition"] = f"attachment; filename={filename}"
+    response.headers["Cache-Control"] = "no-store"
+    return response
+
+@admin_bp.route("/stats/timeseries", methods=["GET"])
+@admin_required
+def get_stats_timeseries():
+    """
+    Временной ряд продаж по дням для графиков (для админа)
+    ---
+    tags:
+      - admin
+    security:
+      - Bearer: []
+    parameters:
+      - name: date_from
+        in: query
+        type: string
+        description: Начало периода (YYYY-MM-DD)
+      - name: date_to
+        in: query
+        type: string
+        description: Конец периода включительно (YYYY-MM-DD)
+      - name: product_id
+        in: query
+        type: integer
+        description: Вернуть продажи конкретного товара
+    responses:
+      200:
+        description: Значения по дням
+    """
+    date_from = _parse_export_date(request.args.get("date_from"), "date_from")
+    date_to = _parse_export_date(request.args.get("date_to"), "date_to")
+    product_id = request.args.get("product_id", type=int)
+    
+    try:
+        if product_id:
+            query = db.session.query(
+                ProductDailyStat.day, ProductDailyStat.units, ProductDailyStat.revenue
+            ).filter(ProductDailyStat.product_id == product_id)
+            if date_from:
+                query = query.filter(ProductDailyStat.day >= date_from.date())
+            if date_to:
+                query = query.filter(ProductDailyStat.day <= date_to.date())
+            series = [
+                {"date": day.isoformat(), "units": units, "revenue": round(revenue, 2)}
+                for day, units, revenue in query.order_by(ProductDailyStat.day)
+            ]
+            return jsonify({"success": True, "product_id": product_id, "series": series}), 200
+        
+        query = db.session.query(
+            SalesDailyStat.day, SalesDailyStat.status,
+            SalesDailyStat.orders_count, SalesDailyStat.revenue
+        )
+        if date_from:
+            query = query.filter(SalesDailyStat.day >= date_from.date())
+        if date_to:
+            query = query.filter(SalesDailyStat.day <= date_to.date())
+        
+        days = {}
+        for day, status, count, revenue in query.order_by(SalesDailyStat.day):
+            point = days.setdefault(day, {
+                "date": day.isoformat(), "orders": 0, "revenue": 0.0, "orders_by_status": {}
+            })
+            if count:
+                point["orders_by_status"][status] = count
+            point["orders"] += count
+            point["revenue"] = round(point["revenue"] + revenue, 2)
+        
+        return jsonify({"success": True, "series": list(days.values())}), 200
+    except Exception as e:
+        raise ValidationError(f"Ошибка при получении статистики: {str(e)}")
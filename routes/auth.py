@@ -1,20 +1,33 @@
-from flask import Blueprint, request, jsonify, current_app, send_from_directory
-from models import db, User, PasswordResetCode
+from flask import Blueprint, request, jsonify, current_app
+from flask_limiter.util import get_remote_address
+from models import db, User
 from routes.utils import save_avatar
-from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity
-from errors import ValidationError, NotFoundError, UnauthorizedError, ConflictError
+from flask_jwt_extended import (
+    create_access_token, create_refresh_token, decode_token, jwt_required, get_jwt, get_jwt_identity
+)
+from errors import (
+    ValidationError, NotFoundError, UnauthorizedError, ConflictError,
+    ServiceUnavailableError, TooManyRequestsError
+)
+from services.identity import identity_claims, current_identity
+from services.media import release_media
+from routes.media import send_media
+from services.mailer import enqueue_email
+from services.reset_codes import issue_reset_code, find_active_code
+from services.ratelimit import request_cost, PASSWORD_HASH_COST
+from services.login_throttle import check_login_allowed, record_login_failure, reset_login_failures
 from schemas import (
     UserRegisterSchema, UserLoginSchema, UserUpdateSchema, 
-    ChangePasswordSchema, UserSchema, ForgotPasswordSchema,
+    ChangePasswordSchema, UserProfileSchema, ForgotPasswordSchema,
     VerifyCodeSchema, ResetPasswordSchema
 )
-from datetime import datetime, timedelta
-import random
+from datetime import timedelta
 import os
 
 auth_bp = Blueprint("auth", __name__)
 
 @auth_bp.route("/register", methods=["POST"])
+@request_cost(PASSWORD_HASH_COST)
 def register():
     """Регистрация нового пользователя"""
     try:
@@ -43,41 +56,57 @@ def register():
         db.session.add(user)
         db.session.commit()
         
-        user_schema = UserSchema()
+        user_schema = UserProfileSchema()
         return jsonify({
             "success": True,
             "message": "Пользователь успешно создан",
             "user": user_schema.dump(user),
             "user_id": user.id
         }), 201
-    except ValidationError as e:
+    except (ValidationError, ServiceUnavailableError) as e:
         raise
     except Exception as e:
         db.session.rollback()
         raise ValidationError(f"Ошибка при создании пользователя: {str(e)}")
 
 @auth_bp.route("/login", methods=["POST"])
+@request_cost(PASSWORD_HASH_COST)
 def login():
     """Вход в систему"""
     try:
         schema = UserLoginSchema()
         data = schema.load(request.get_json() or {})
         
+        # Заблокированную попытку отклоняем до поиска пользователя и хэширования
+        ip = get_remote_address()
+        check_login_allowed(data["email"], ip)
+        
         user = User.query.filter_by(email=data["email"]).first()
         if not user or not user.check_password(data["password"]):
+            record_login_failure(data["email"], ip)
             raise UnauthorizedError("Неверный email или пароль")
+        reset_login_failures(data["email"])
         
-        access_token = create_access_token(identity=str(user.id))
-        user_schema = UserSchema()
+        # Хэш со старыми параметрами пересчитываем, пока известен пароль
+        if user.password_needs_rehash():
+            user.set_password(data["password"])
+            db.session.commit()
+        
+        claims = identity_claims(user)
+        access_token = create_access_token(identity=str(user.id), additional_claims=claims)
+        refresh_token = create_refresh_token(identity=str(user.id), additional_claims=claims)
+        user_schema = UserProfileSchema()
         
         return jsonify({
             "success": True,
             "access_token": access_token,
+            "refresh_token": refresh_token,
             "user": user_schema.dump(user)
         }), 200
-    except ValidationError as e:
+    except (ValidationError, ServiceUnavailableError, TooManyRequestsError) as e:
         raise
     except Exception as e:
+        db.session.rollback()
         raise UnauthorizedError("Ошибка при входе в систему")
 
 @auth_bp.route("/me", methods=["GET"])
@@ -89,17 +118,16 @@ def me():
     if not user:
         raise NotFoundError("Пользователь не найден")
     
-    user_schema = UserSchema()
+    user_schema = UserProfileSchema()
     return jsonify({
         "success": True,
         "user": user_schema.dump(user)
     }), 200
 
-@auth_bp.route("/avatar/<filename>", methods=["GET"])
+@auth_bp.route("/avatar/<path:filename>", methods=["GET"])
 def avatar(filename):
     """Получить аватар пользователя"""
-    folder = current_app.config['UPLOAD_FOLDER']
-    return send_from_directory(folder, filename)
+    return send_media("avatars", filename)
 
 @auth_bp.route("/update", methods=["PUT"])
 @jwt_required()
@@ -135,10 +163,11 @@ def update_profile():
                 saved = save_avatar(f)
                 if saved is None:
                     raise ValidationError("Недопустимое расширение файла аватара")
+                release_media(user.avatar)
                 user.avatar = saved
         
         db.session.commit()
-        user_schema = UserSchema()
+        user_schema = UserProfileSchema()
         
         return jsonify({
             "success": True,
@@ -152,6 +181,7 @@ def update_profile():
         raise ValidationError(f"Ошибка при обновлении профиля: {str(e)}")
 
 @auth_bp.route("/change-password", methods=["POST"])
+@request_cost(PASSWORD_HASH_COST)
 @jwt_required()
 def change_password():
     """Изменить пароль"""
@@ -174,30 +204,27 @@ def change_password():
             "success": True,
             "message": "Пароль успешно изменен"
         }), 200
-    except (ValidationError, UnauthorizedError) as e:
+    except (ValidationError, UnauthorizedError, ServiceUnavailableError) as e:
         raise
     except Exception as e:
         db.session.rollback()
         raise ValidationError(f"Ошибка при изменении пароля: {str(e)}")
 
-def generate_reset_code():
-    """Генерирует 6-значный код восстановления"""
-    return str(random.randint(100000, 999999))
-
 def send_reset_code_email(email, code):
     """
-    Отправляет код восстановления на email
-    В production здесь должна быть реальная отправка email
+    Поставить письмо с кодом восстановления в очередь отправки.
+    Письмо уходит вместе с commit кода; SMTP-сессия - в фоновом отправителе.
+    Тело с кодом стирается из очереди сразу после отправки.
     """
-    # TODO: Реализовать отправку email через SMTP или сервис (SendGrid, Mailgun и т.д.)
-    # Для разработки просто логируем
     if current_app.config.get('FLASK_ENV') == 'development':
         print(f"[DEV] Код восстановления для {email}: {code}")
-    # В production:
-    # from flask_mail import Message
-    # msg = Message('Код восстановления пароля', recipients=[email])
-    # msg.body = f'Ваш код восстановления: {code}'
-    # mail.send(msg)
+    enqueue_email(
+        email,
+        "Код восстановления пароля",
+        f"Ваш код восстановления: {code}\n\n"
+        f"Код действителен {current_app.config.get('RESET_CODE_TTL_MINUTES', 15)} минут.",
+        sensitive=True
+    )
 
 @auth_bp.route("/forgot-password", methods=["POST"])
 def forgot_password():
@@ -216,24 +243,12 @@ def forgot_password():
                 "message": "Если пользователь с таким email существует, код отправлен на вашу электронную почту"
             }), 200
         
-        # Генерируем код
-        code = generate_reset_code()
-        expires_at = datetime.utcnow() + timedelta(minutes=15)  # Код действителен 15 минут
+        # Новый код (прежние коды этого email удаляются)
+        code = issue_reset_code(email)
         
-        # Помечаем старые коды как использованные
-        PasswordResetCode.query.filter_by(email=email, used=False).update({"used": True})
-        
-        # Создаем новый код
-        reset_code = PasswordResetCode(
-            email=email,
-            code=code,
-            expires_at=expires_at
-        )
-        db.session.add(reset_code)
-        db.session.commit()
-        
-        # Отправляем код (в production - реальный email)
+        # Письмо ставится в очередь в той же транзакции, что и код
         send_reset_code_email(email, code)
+        db.session.commit()
         
         return jsonify({
             "success": True,
@@ -255,11 +270,7 @@ def verify_code():
         code = data["code"]
         
         # Ищем активный код
-        reset_code = PasswordResetCode.query.filter_by(
-            email=email,
-            code=code,
-            used=False
-        ).filter(PasswordResetCode.expires_at > datetime.utcnow()).first()
+        reset_code = find_active_code(email, code)
         
         if not reset_code:
             raise UnauthorizedError("Неверный или истекший код")
@@ -298,24 +309,12 @@ def resend_code():
                 "message": "Если пользователь с таким email существует, код отправлен повторно"
             }), 200
         
-        # Генерируем новый код
-        code = generate_reset_code()
-        expires_at = datetime.utcnow() + timedelta(minutes=15)
+        # Новый код (прежние коды этого email удаляются)
+        code = issue_reset_code(email)
         
-        # Помечаем старые коды как использованные
-        PasswordResetCode.query.filter_by(email=email, used=False).update({"used": True})
-        
-        # Создаем новый код
-        reset_code = PasswordResetCode(
-            email=email,
-            code=code,
-            expires_at=expires_at
-        )
-        db.session.add(reset_code)
-        db.session.commit()
-        
-        # Отправляем код
+        # Отправляем код (через очередь писем)
         send_reset_code_email(email, code)
+        db.session.commit()
         
         return jsonify({
             "success": True,
@@ -328,6 +327,7 @@ def resend_code():
         raise ValidationError(f"Ошибка при повторной отправке кода: {str(e)}")
 
 @auth_bp.route("/reset-password", methods=["POST"])
+@request_cost(PASSWORD_HASH_COST)
 def reset_password():
     """Сброс пароля по коду"""
     try:
@@ -338,11 +338,7 @@ def reset_password():
         new_password = data["new_password"]
         
         # Проверяем код
-        reset_code = PasswordResetCode.query.filter_by(
-            email=email,
-            code=code,
-            used=False
-        ).filter(PasswordResetCode.expires_at > datetime.utcnow()).first()
+        reset_code = find_active_code(email, code)
         
         if not reset_code:
             raise UnauthorizedError("Неверный или истекший код")
@@ -364,20 +360,47 @@ def reset_password():
             "success": True,
             "message": "Пароль успешно изменен"
         }), 200
-    except (ValidationError, UnauthorizedError, NotFoundError) as e:
+    except (ValidationError, UnauthorizedError, NotFoundError, ServiceUnavailableError) as e:
         raise
     except Exception as e:
         db.session.rollback()
         raise ValidationError(f"Ошибка при сбросе пароля: {str(e)}")
 
+@auth_bp.route("/refresh", methods=["POST"])
+@jwt_required(refresh=True)
+def refresh():
+    """Получить новый access-токен по refresh-токену"""
+    identity = current_identity()
+    if not identity:
+        raise UnauthorizedError("Пользователь не найден")
+    access_token = create_access_token(
+        identity=str(identity.user_id),
+        additional_claims={"role": identity.role, "ver": identity.version}
+    )
+    return jsonify({
+        "success": True,
+        "access_token": access_token
+    }), 200
+
 @auth_bp.route("/logout", methods=["POST"])
-@jwt_required()
+@jwt_required(verify_type=False)
 def logout():
-    """Выход из системы"""
-    # В JWT токены stateless, поэтому просто возвращаем успех
-    # В production можно добавить blacklist токенов
+    """Выход из системы: отзыв текущего токена и (если передан) refresh-токена"""
+    token = get_jwt()
+    denylist = current_app.token_denylist
+    denylist.revoke(token["jti"], token["exp"])
+    
+    data = request.get_json(silent=True) or {}
+    if data.get("refresh_token"):
+        try:
+            refresh_claims = decode_token(data["refresh_token"])
+        except Exception:
+            raise ValidationError("Некорректный refresh-токен")
+        if refresh_claims.get("sub") != token.get("sub"):
+            raise ValidationError("Refresh-токен принадлежит другому пользователю")
+        denylist.revoke(refresh_claims["jti"], refresh_claims["exp"])
+    
     return jsonify({
         "success": True,
         "message": "Вы успешно вышли из системы"
     }), 200
-
@@ -6,10 +6,52 @@ from schemas import ProductListQuerySchema, ProductSchema, CategorySchema
 from flask_caching import Cache
 from marshmallow import ValidationError as MarshmallowValidationError
 import json as json_lib
+from services.ratelimit import DEEP_PAGE, SEARCH_COST, request_cost
+from services.images import image_sets
 
 catalog_bp = Blueprint("catalog", __name__)
 
+# Версия закэшированных страниц каталога (входит в ключ кэша списка товаров)
+PRODUCTS_LIST_VERSION_KEY = "products_list_version"
+
+def products_list_version(cache):
+    return cache.get(PRODUCTS_LIST_VERSION_KEY) or 0
+
+def invalidate_product_caches(product_ids=()):
+    """
+    Сбросить кэш карточек товаров product_ids и страниц каталога.
+    Страницы кэшируются по комбинации фильтров, поэтому вместо перебора
+    ключей увеличивается их версия: старые записи просто перестают читаться.
+    """
+    cache = current_app.cache
+    keys = [f"product_{product_id}" for product_id in product_ids]
+    if keys:
+        cache.delete_many(*keys)
+    cache.set(PRODUCTS_LIST_VERSION_KEY, products_list_version(cache) + 1, timeout=0)
+
+def products_list_cache_key(cache, params, categories_str):
+    """Ключ кэша страницы каталога: текущая версия и все параметры выборки"""
+    return (
+        f"products_v{products_list_version(cache)}_{params.get('q')}_{params.get('category')}_"
+        f"{categories_str}_{params.get('min_price')}_{params.get('max_price')}_"
+        f"{params.get('sort', 'id_desc')}_{params.get('page', 1)}_{params.get('per_page', 12)}"
+    )
+
+def catalog_search_cost():
+    """Просмотр и закэшированная страница - 1, поиск и глубокие страницы мимо кэша - SEARCH_COST"""
+    try:
+        params = ProductListQuerySchema().load(request.args.to_dict())
+    except MarshmallowValidationError:
+        return 1  # ошибку вернет сам маршрут
+    if not params.get("q") and params.get("page", 1) <= DEEP_PAGE:
+        return 1
+    cache = current_app.cache
+    if cache.has(products_list_cache_key(cache, params, request.args.get("categories", type=str))):
+        return 1
+    return SEARCH_COST
+
 @catalog_bp.route("/products", methods=["GET"])
+@request_cost(catalog_search_cost)
 def list_products():
     """
     Получить список товаров с фильтрацией, поиском и пагинацией
@@ -72,8 +114,8 @@ def list_products():
         per_page = params.get("per_page", 12)
 
         # Кэширование ключа
-        cache_key = f"products_{q}_{category}_{categories_str}_{min_price}_{max_price}_{sort}_{page}_{per_page}"
         cache = current_app.cache
+        cache_key = products_list_cache_key(cache, params, categories_str)
         
         # Проверяем кэш
         cached_result = cache.get(cache_key)
@@ -133,6 +175,10 @@ def list_products():
         
         product_schema = ProductSchema(many=True)
         items = product_schema.dump(pag.items)
+        # Копии изображений для srcset (одним запросом на страницу)
+        sets = image_sets([product.image for product in pag.items])
+        for item in items:
+            item["image_set"] = sets.get(item.get("image"))
 
         result = {
             "success": True,
@@ -314,6 +360,7 @@ def product_detail(product_id):
             "price": product.price,
             "image": product.image or "/placeholder-product.jpg",
             "images": all_images,
+            "image_sets": image_sets(all_images),
             "category_id": product.category_id,
             "category": category_data,
             "stock": product.stock,
@@ -0,0 +1,241 @@
+"""
+Отдача загруженных файлов (товары, работы, аватары)
+
+Все изображения отдаются одной функцией send_media: сильный ETag (для
+файлов по хэшу содержимого - сам хэш, для старых файлов - SHA-256
+содержимого, закэшированный по размеру и времени изменения), Last-Modified,
+ответы 304 и 206 (Range) и долгий Cache-Control (immutable для файлов по
+хэшу). При MEDIA_OFFLOAD тело файла отдает прокси: nginx по заголовку
+X-Accel-Redirect (внутренний location MEDIA_ACCEL_PREFIX) или Apache/lighttpd
+по X-Sendfile, а воркер приложения только проверяет заголовки запроса.
+
+/media/<путь>?w=&h=&fmt= отдает копию, уменьшенную по запросу: размеры и
+форматы только из списков MEDIA_RESIZE_*, копии хранятся в дисковом
+LRU-кэше (services/media_cache.py) и строятся в пуле процессов изображений.
+Исходные файлы не расходуют лимиты запросов, а копии списывают бюджет
+стоимости: готовая копия - 1, построение новой - RESIZE_COST.
+"""
+import hashlib
+import mimetypes
+import os
+import threading
+from collections import OrderedDict
+
+from flask import Blueprint, current_app, request
+from werkzeug.security import safe_join
+from werkzeug.utils import send_file
+from errors import APIError, NotFoundError, ValidationError
+from services.images import render_resized
+from services.media import MEDIA_FOLDERS, upload_folder, is_content_addressed
+from services.media_cache import cache_key
+from services.ratelimit import RESIZE_COST, request_cost
+
+media_bp = Blueprint("media", __name__)
+
+# ETag старых файлов: (путь, размер, mtime) -> хэш содержимого
+ETAG_CACHE_SIZE = 4096
+_etags = OrderedDict()
+_etags_lock = threading.Lock()
+
+# Форматы копий по запросу: fmt -> (формат Pillow, расширение)
+RESIZE_FORMATS = {"webp": ("WEBP", "webp"), "jpeg": ("JPEG", "jpg"), "png": ("PNG", "png")}
+# Формат по умолчанию - как у исходника
+SOURCE_FORMATS = {"jpg": "jpeg", "jpeg": "jpeg", "png": "png", "webp": "webp"}
+
+def file_etag(path, stat):
+    """Сильный ETag файла по содержимому"""
+    name = os.path.basename(path)
+    if is_content_addressed(name):
+        return name.split(".", 1)[0]
+    key = (path, stat.st_size, stat.st_mtime_ns)
+    with _etags_lock:
+        if key in _etags:
+            _etags.move_to_end(key)
+            return _etags[key]
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b""):
+            digest.update(chunk)
+    etag = digest.hexdigest()
+    with _etags_lock:
+        _etags[key] = etag
+        while len(_etags) > ETAG_CACHE_SIZE:
+            _etags.popitem(last=False)
+    return etag
+
+def send_path(path, etag, immutable, accel_uri):
+    """
+    Ответ с файлом path: ETag, Cache-Control, 304/206 или передача тела
+    прокси (accel_uri - путь во внутреннем location nginx)
+    """
+    config = current_app.config
+    max_age = config.get("MEDIA_IMMUTABLE_MAX_AGE", 31536000) if immutable else config.get("MEDIA_MAX_AGE", 86400)
+    offload = config.get("MEDIA_OFFLOAD") or ""
+
+    if offload == "x-accel-redirect":
+        # Тело и Range обрабатывает nginx, здесь только заголовки и 304
+        response = current_app.response_class(mimetype=mimetypes.guess_type(path)[0] or "application/octet-stream")
+        response.headers["X-Accel-Redirect"] = accel_uri
+        response.set_etag(etag)
+        response.last_modified = int(os.stat(path).st_mtime)
+        response.cache_control.max_age = max_age
+        response = response.make_conditional(request.environ)
+    else:
+        response = send_file(
+            path, request.environ,
+            etag=etag,
+            max_age=max_age,
+            use_x_sendfile=offload == "x-sendfile",
+            response_class=current_app.response_class
+        )
+    response.accept_ranges = "bytes"
+    response.cache_control.public = True
+    if immutable:
+        response.cache_control.immutable = True
+    return response
+
+def resolve_media(kind, filename):
+    """Путь файла загрузки на диске или NotFoundError"""
+    if kind not in MEDIA_FOLDERS:
+        raise NotFoundError(f"Изображение не найдено: {filename}")
+    path = safe_join(upload_folder(kind), filename)
+    if path is None or not os.path.isfile(path):
+        raise NotFoundError(f"Изображение не найдено: {filename}")
+    return path
+
+def send_media(kind, filename):
+    """Ответ с файлом filename из каталога загрузок вида kind"""
+    path = resolve_media(kind, filename)
+    accel_prefix = current_app.config.get("MEDIA_ACCEL_PREFIX", "/protected-media").rstrip("/")
+    return send_path(
+        path, file_etag(path, os.stat(path)), is_content_addressed(filename),
+        f"{accel_prefix}/{kind}/{filename}"
+    )
+
+@media_bp.route("/static/<any(%s):kind>/<path:filename>" % ", ".join(MEDIA_FOLDERS), methods=["GET"])
+def static_media(kind, filename):
+    """
+    Получить загруженный файл по пути из БД (static/products/...)
+    ---
+    tags:
+      - media
+    parameters:
+      - name: kind
+        in: path
+        type: string
+        enum: [avatars, products, works]
+        required: true
+      - name: filename
+        in: path
+        type: string
+        required: true
+    responses:
+      200:
+        description: Файл
+      206:
+        description: Часть файла (Range)
+      304:
+        description: Файл не изменился
+      404:
+        description: Файл не найден
+    """
+    return send_media(kind, filename)
+
+def _resize_param(name, allowed):
+    value = request.args.get(name)
+    if value is None or value == "":
+        return None
+    if not value.isdigit() or int(value) not in allowed:
+        raise ValidationError(
+            f"Недопустимое значение {name}: {value}; допустимо: {', '.join(map(str, sorted(allowed)))}"
+        )
+    return int(value)
+
+def resize_request(path):
+    """
+    Разобрать запрос копии: (kind, filename, source, params), где params -
+    None для исходного файла или (width, height, pil_format, ext, quality, key)
+    """
+    config = current_app.config
+    if path.startswith("static/"):
+        path = path[len("static/"):]
+    kind, _, filename = path.partition("/")
+    source = resolve_media(kind, filename)
+
+    width = _resize_param("w", set(config.get("MEDIA_RESIZE_WIDTHS", [])))
+    height = _resize_param("h", set(config.get("MEDIA_RESIZE_HEIGHTS", [])))
+    fmt = request.args.get("fmt") or None
+    if fmt is not None and (fmt not in RESIZE_FORMATS or fmt not in config.get("MEDIA_RESIZE_FORMATS", RESIZE_FORMATS)):
+        raise ValidationError(f"Недопустимый формат: {fmt}")
+    if width is None and height is None and fmt is None:
+        return kind, filename, source, None
+
+    source_ext = filename.rsplit(".", 1)[-1].lower()
+    fmt = fmt or SOURCE_FORMATS.get(source_ext, "png")
+    pil_format, ext = RESIZE_FORMATS[fmt]
+    quality = config.get("IMAGE_VARIANT_QUALITY", 80)
+    version = file_etag(source, os.stat(source))
+    key = cache_key(kind, filename, version, width, height, fmt, quality)
+    return kind, filename, source, (width, height, pil_format, ext, quality, key)
+
+def resize_cost():
+    """Готовая копия или исходный файл - 1, построение новой копии - RESIZE_COST"""
+    try:
+        _, _, _, params = resize_request(request.view_args["path"])
+    except APIError:
+        return 1  # ошибку вернет сам маршрут
+    if params is None or current_app.media_cache.get(params[5], params[3]) is not None:
+        return 1
+    return RESIZE_COST
+
+@media_bp.route("/media/<path:path>", methods=["GET"])
+@request_cost(resize_cost)
+def resized_media(path):
+    """
+    Получить изображение, уменьшенное по запросу
+    ---
+    tags:
+      - media
+    parameters:
+      - name: path
+        in: path
+        type: string
+        required: true
+        description: Путь файла, как в БД (static/products/...) или без static/
+      - name: w
+        in: query
+        type: integer
+        description: Максимальная ширина (из MEDIA_RESIZE_WIDTHS)
+      - name: h
+        in: query
+        type: integer
+        description: Максимальная высота (из MEDIA_RESIZE_HEIGHTS)
+      - name: fmt
+        in: query
+        type: string
+        enum: [webp, jpeg, png]
+    responses:
+      200:
+        description: Изображение
+      304:
+        description: Изображение не изменилось
+      400:
+        description: Размер или формат не из разрешенного списка
+      404:
+        description: Изображение не найдено
+      429:
+        description: Исчерпан бюджет запросов
+    """
+    kind, filename, source, params = resize_request(path)
+    if params is None:
+        return send_media(kind, filename)
+    width, height, pil_format, ext, quality, key = params
+
+    # Ошибка построения копии - сбой сервера (500), а не ошибка запроса
+    cache = current_app.media_cache
+    cached = cache.get_or_create(key, ext, lambda target: current_app.image_pipeline.run(
+        render_resized, source, target, width, height, pil_format, quality
+    ))
+    accel_prefix = current_app.config.get("MEDIA_ACCEL_CACHE_PREFIX", "/protected-media-cache").rstrip("/")
+    relpath = os.path.relpath(cached, cache.directory).replace(os.sep, "/")
+    return send_path(cached, key, is_content_addressed(filename), f"{accel_prefix}/{relpath}")
@@ -1,15 +1,66 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app, Response, url_for
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from models import db, Order, OrderItem, OrderHistory, Product, User
+from models import (
+    db, Order, OrderItem, OrderHistory, Product, User, ArchivedOrder, ArchivedOrderItem, CheckoutTicket
+)
 from routes.cart import read_cart_from_cookie
-from errors import NotFoundError, ValidationError
-from schemas import OrderSchema
-from sqlalchemy.orm import joinedload
+from errors import NotFoundError, ValidationError, UnauthorizedError, ForbiddenError
+from schemas import OrderSchema, OrderDetailSchema
+from sqlalchemy.orm import joinedload, selectinload, load_only
+from routes.utils import keyset_paginate, encode_cursor
+from services.outbox import enqueue_event, enqueue_events
+from services.stats import record_order_created, record_status_change
+from services.events import queue_order_event, sse_stream, user_topic
+from services.archive import order_rows_query, items_count_by_order
+from services.checkout import enqueue_checkout
+from services.identity import current_identity
+from services.ratelimit import request_cost, CHECKOUT_COST
+from sqlalchemy import insert, update
+from datetime import datetime
 
 orders_bp = Blueprint("orders", __name__)
 
-def add_order_history(order_id, status, changed_by="system", comment=None):
-    """Добавить запись в историю заказа"""
+# Допустимые переходы статусов для массовых операций
+ORDER_STATUS_TRANSITIONS = {
+    "created": {"pending", "paid", "processing", "cancelled"},
+    "pending": {"paid", "processing", "shipped", "cancelled"},
+    "paid": {"processing", "shipped", "cancelled"},
+    "processing": {"shipped", "cancelled"},
+    "shipped": {"delivered"},
+    "delivered": set(),
+    "cancelled": set(),
+}
+
+def lean_order_options(with_user=False, archived=False):
+    """
+    Опции загрузки под OrderSummarySchema/OrderDetailSchema: только нужные колонки.
+    archived=True - для ArchivedOrder с теми же полями.
+    """
+    order_model, item_model = (ArchivedOrder, ArchivedOrderItem) if archived else (Order, OrderItem)
+    options = [
+        selectinload(order_model.items).options(
+            load_only(item_model.id, item_model.order_id, item_model.product_id, item_model.price, item_model.quantity),
+            joinedload(item_model.product).load_only(Product.id, Product.title)
+        )
+    ]
+    if with_user:
+        options.append(
+            joinedload(order_model.user).load_only(User.id, User.email, User.first_name, User.last_name)
+        )
+    return options
+
+def _history_event(order_id, status, changed_by, comment):
+    """Данные события outbox для записи истории заказа"""
+    return {
+        "order_id": order_id,
+        "status": status,
+        "changed_by": str(changed_by),
+        "comment": comment,
+        "occurred_at": datetime.utcnow().isoformat()
+    }
+
+def add_order_history(order_id, status, changed_by="system", comment=None, event_type="order.status_changed"):
+    """Добавить запись в историю заказа и событие в outbox (в той же транзакции)"""
     history = OrderHistory(
         order_id=order_id,
         status=status,
@@ -17,8 +68,99 @@ def add_order_history(order_id, status, changed_by="system", comment=None):
         comment=comment
     )
     db.session.add(history)
+    enqueue_event(event_type, order_id, _history_event(order_id, status, changed_by, comment))
+    order = db.session.get(Order, order_id)  # обычно уже в identity map
+    queue_order_event(order_id, order.user_id if order else None, status,
+                      comment=comment, changed_by=changed_by)
+    return history
+
+def add_order_history_bulk(order_ids, status, changed_by="system", comment=None, user_ids=None):
+    """
+    Массово добавить записи истории и события outbox для списка заказов.
+    Выполняется двумя INSERT (executemany) без создания ORM-объектов.
+    user_ids - словарь {order_id: user_id} для адресации SSE-событий.
+    """
+    if not order_ids:
+        return
+    db.session.execute(insert(OrderHistory), [
+        {"order_id": order_id, "status": status, "changed_by": str(changed_by), "comment": comment}
+        for order_id in order_ids
+    ])
+    enqueue_events("order.status_changed", [
+        (order_id, _history_event(order_id, status, changed_by, comment))
+        for order_id in order_ids
+    ])
+    user_ids = user_ids or {}
+    for order_id in order_ids:
+        queue_order_event(order_id, user_ids.get(order_id), status,
+                          comment=comment, changed_by=changed_by)
+
+def place_order(user_id, cart, data):
+    """
+    Оформить заказ из корзины {product_id: quantity} в текущей транзакции.
+    Проверяет остатки, списывает их, пишет историю и агрегаты; commit - за вызывающим.
+    """
+    delivery_address = data.get("delivery_address")
+    phone = data.get("phone")
+    comment = data.get("comment")
+
+    # Все товары корзины - одним запросом
+    products = {p.id: p for p in Product.query.filter(Product.id.in_(list(cart.keys())))}
+
+    total = 0.0
+    items = []
+    for pid, qty in cart.items():
+        product = products.get(pid)
+        if not product:
+            continue
+        if product.stock is not None and qty > product.stock:
+            qty = product.stock
+        if qty <= 0:
+            continue
+        line_total = product.price * qty
+        total += line_total
+        items.append((product, qty, product.price))
+
+    if not items:
+        raise ValidationError("Нет валидных товаров для заказа")
+
+    # Создаем заказ (пока без delivery_address и phone в модели, можно добавить позже)
+    order = Order(user_id=user_id, total=round(total, 2), status="pending")
+    db.session.add(order)
+    db.session.flush()  # получить id
+
+    for product, qty, price in items:
+        oi = OrderItem(order_id=order.id, product_id=product.id, quantity=qty, price=price)
+        db.session.add(oi)
+        # Условное списание: параллельный заказ (в другом потоке или процессе)
+        # мог забрать остаток после чтения товара
+        if product.stock is not None:
+            taken = db.session.execute(
+                update(Product)
+                .where(Product.id == product.id, Product.stock >= qty)
+                .values(stock=Product.stock - qty)
+                .execution_options(synchronize_session=False)
+            ).rowcount
+            if not taken:
+                raise ValidationError(f"Недостаточно товара на складе: {product.title}")
+            db.session.expire(product, ["stock"])
+    
+    # Добавляем запись в историю с комментарием
+    history_comment = "Заказ создан"
+    if delivery_address:
+        history_comment += f". Адрес доставки: {delivery_address}"
+    if phone:
+        history_comment += f". Телефон: {phone}"
+    if comment:
+        history_comment += f". Комментарий: {comment}"
+    
+    add_order_history(order.id, "pending", changed_by=user_id, comment=history_comment,
+                      event_type="order.created")
+    record_order_created(order, [(product.id, qty, price) for product, qty, price in items])
+    return order
 
 @orders_bp.route("/create", methods=["POST"])
+@request_cost(CHECKOUT_COST)
 @jwt_required()
 def create_order():
     """
@@ -31,13 +173,14 @@ def create_order():
     responses:
       201:
         description: Заказ успешно создан
+      202:
+        description: Заказ принят в очередь (CHECKOUT_QUEUE_ENABLED), результат - по ticket_id
       400:
         description: Корзина пуста
     """
     try:
-        user_id = get_jwt_identity()
-        user = User.query.get(user_id)
-        if not user:
+        identity = current_identity()
+        if not identity:
             raise NotFoundError("Пользователь не найден")
         
         cart = read_cart_from_cookie()
@@ -45,74 +188,82 @@ def create_order():
             raise ValidationError("Корзина пуста")
 
         # Получаем дополнительные данные из запроса
-        data = request.get_json() or {}
-        delivery_address = data.get("delivery_address")
-        phone = data.get("phone")
-        comment = data.get("comment")
-
-        total = 0.0
-        items = []
-        for pid, qty in cart.items():
-            product = Product.query.get(pid)
-            if not product:
-                continue
-            if product.stock is not None and qty > product.stock:
-                qty = product.stock
-            if qty <= 0:
-                continue
-            line_total = product.price * qty
-            total += line_total
-            items.append((product, qty, product.price))
-
-        if not items:
-            raise ValidationError("Нет валидных товаров для заказа")
+        data = request.get_json(silent=True) or {}
+        details = {key: data.get(key) for key in ("delivery_address", "phone", "comment") if data.get(key)}
 
-        # Создаем заказ (пока без delivery_address и phone в модели, можно добавить позже)
-        order = Order(user_id=user_id, total=round(total, 2), status="pending")
-        db.session.add(order)
-        db.session.flush()  # получить id
+        # Очередь оформления: принимаем намерение и отдаем тикет, заказ создаст воркер
+        if current_app.config.get("CHECKOUT_QUEUE_ENABLED"):
+            ticket = enqueue_checkout(identity.user_id, cart, details)
+            resp = jsonify({
+                "success": True,
+                "ticket_id": ticket.id,
+                "status": ticket.status
+            })
+            resp.headers["Location"] = url_for(".checkout_ticket", ticket_id=ticket.id)
+            resp.set_cookie("cart", "", expires=0)
+            return resp, 202
 
-        for product, qty, price in items:
-            oi = OrderItem(order_id=order.id, product_id=product.id, quantity=qty, price=price)
-            db.session.add(oi)
-            # уменьшить stock если нужно
-            if product.stock is not None:
-                product.stock = max(0, product.stock - qty)
-        
-        # Добавляем запись в историю с комментарием
-        history_comment = "Заказ создан"
-        if delivery_address:
-            history_comment += f". Адрес доставки: {delivery_address}"
-        if phone:
-            history_comment += f". Телефон: {phone}"
-        if comment:
-            history_comment += f". Комментарий: {comment}"
-        
-        add_order_history(order.id, "pending", changed_by=user_id, comment=history_comment)
-        
+        order = place_order(identity.user_id, cart, details)
         db.session.commit()
 
-        # Загружаем заказ с полными данными для ответа
-        order = Order.query.options(
-            joinedload(Order.items).joinedload(OrderItem.product)
-        ).get(order.id)
+        # Загружаем заказ для ответа (только поля облегченной схемы)
+        order = Order.query.options(*lean_order_options()).get(order.id)
         
-        order_schema = OrderSchema()
+        order_schema = OrderDetailSchema()
         
         # Очистить cookie корзины
         resp = jsonify({
             "success": True,
+            "order_id": order.id,
             "order": order_schema.dump(order)
         })
         resp.set_cookie("cart", "", expires=0)
         return resp, 201
-    except (ValidationError, NotFoundError) as e:
+    except (ValidationError, NotFoundError, UnauthorizedError, ForbiddenError) as e:
         db.session.rollback()
         raise
     except Exception as e:
         db.session.rollback()
         raise ValidationError(f"Ошибка при создании заказа: {str(e)}")
 
+@orders_bp.route("/checkout/<string:ticket_id>", methods=["GET"])
+@jwt_required()
+def checkout_ticket(ticket_id):
+    """
+    Состояние тикета оформления заказа из очереди
+    ---
+    tags:
+      - orders
+    security:
+      - Bearer: []
+    parameters:
+      - name: ticket_id
+        in: path
+        type: string
+        required: true
+    responses:
+      200:
+        description: Статус тикета (queued, processing, completed, failed)
+      404:
+        description: Тикет не найден
+    """
+    ticket = CheckoutTicket.query.filter_by(id=ticket_id, user_id=get_jwt_identity()).first()
+    if not ticket:
+        raise NotFoundError("Тикет не найден")
+    
+    result = {
+        "success": True,
+        "ticket_id": ticket.id,
+        "status": ticket.status,
+        "order_id": ticket.order_id,
+        "error": ticket.error
+    }
+    if ticket.order_id:
+        order = Order.query.options(*lean_order_options()).get(ticket.order_id)
+        if order:
+            result["order"] = OrderDetailSchema().dump(order)
+    return jsonify(result), 200
+
 @orders_bp.route("/my", methods=["GET"])
 @jwt_required()
 def my_orders():
@@ -136,6 +287,15 @@ def my_orders():
         in: query
         type: integer
         default: 10
+      - name: cursor
+        in: query
+        type: string
+        description: Курсор следующей страницы (keyset-пагинация). Пустое значение - первая страница
+      - name: include_archived
+        in: query
+        type: boolean
+        default: false
+        description: Включить архивные (старые завершенные) заказы
     responses:
       200:
         description: Список заказов
@@ -146,45 +306,96 @@ def my_orders():
         # Получаем параметры запроса
         status = request.args.get("status")
         page = int(request.args.get("page", 1))
-        limit = int(request.args.get("limit", 10))
+        limit = max(min(int(request.args.get("limit", 10)), 100), 1)
+        cursor = request.args.get("cursor")
+        include_archived = request.args.get("include_archived", "false").lower() in ("1", "true", "yes")
         
-        # Формируем запрос
-        query = Order.query.filter_by(user_id=user_id)
+        # Формируем запрос (по оперативной таблице и, при необходимости, по архиву)
+        query, rows = order_rows_query(include_archived=include_archived, user_id=user_id, status=status)
         
-        # Фильтр по статусу
-        if status:
-            query = query.filter_by(status=status)
+        # Пагинация: по курсору (без OFFSET и COUNT) или по номеру страницы
+        if cursor is not None:
+            orders, next_cursor = keyset_paginate(
+                query, [rows.c.created_at, rows.c.id], cursor=cursor, limit=limit
+            )
+        else:
+            pagination = query.order_by(rows.c.created_at.desc(), rows.c.id.desc()).paginate(
+                page=page,
+                per_page=limit,
+                error_out=False
+            )
+            orders = pagination.items
+            next_cursor = None
+            if pagination.has_next and orders:
+                next_cursor = encode_cursor([orders[-1].created_at, orders[-1].id])
         
-        # Пагинация
-        pagination = query.order_by(Order.created_at.desc()).paginate(
-            page=page,
-            per_page=limit,
-            error_out=False
-        )
+        # Количество позиций - одним сгруппированным запросом вместо загрузки items
+        items_count = items_count_by_order([order.id for order in orders], include_archived)
         
         # Формируем упрощенный список заказов
         orders_list = []
-        for order in pagination.items:
-            orders_list.append({
+        for order in orders:
+            item = {
                 "id": order.id,
                 "status": order.status,
                 "total": order.total,
-                "items_count": len(order.items),
+                "items_count": items_count.get(order.id, 0),
                 "created_at": order.created_at.isoformat() if order.created_at else None
-            })
+            }
+            if include_archived:
+                item["archived"] = bool(order.archived)
+            orders_list.append(item)
         
         result = {
             "success": True,
             "orders": orders_list,
-            "total": pagination.total,
-            "page": page,
-            "totalPages": pagination.pages
+            "next_cursor": next_cursor
         }
+        if cursor is None:
+            result.update({
+                "total": pagination.total,
+                "page": page,
+                "totalPages": pagination.pages
+            })
         
         return jsonify(result), 200
+    except ValidationError as e:
+        raise
     except Exception as e:
         raise ValidationError(f"Ошибка при получении заказов: {str(e)}")
 
+@orders_bp.route("/events", methods=["GET"])
+@jwt_required(locations=["headers", "query_string"])
+def order_events():
+    """
+    Поток изменений статусов заказов текущего пользователя (Server-Sent Events)
+    ---
+    tags:
+      - orders
+    security:
+      - Bearer: []
+    parameters:
+      - name: jwt
+        in: query
+        type: string
+        description: Токен доступа (EventSource не умеет передавать заголовки)
+    produces:
+      - text/event-stream
+    responses:
+      200:
+        description: События update_order_status
+    """
+    broker = current_app.event_broker
+    subscription = broker.subscribe([user_topic(get_jwt_identity())])
+    # Генератор не использует контекст запроса, поэтому не удерживаем его на время потока
+    response = Response(
+        sse_stream(broker, subscription, current_app.config.get("SSE_HEARTBEAT_INTERVAL", 15)),
+        mimetype="text/event-stream"
+    )
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
 @orders_bp.route("/<int:order_id>", methods=["GET"])
 @jwt_required()
 def get_order(order_id):
@@ -215,6 +426,13 @@ def get_order(order_id):
             joinedload(Order.history)
         ).filter_by(id=order_id, user_id=user_id).first()
         
+        # Завершенные старые заказы могли быть перенесены в архив
+        if not order:
+            order = ArchivedOrder.query.options(
+                joinedload(ArchivedOrder.items).joinedload(ArchivedOrderItem.product),
+                joinedload(ArchivedOrder.history)
+            ).filter_by(id=order_id, user_id=user_id).first()
+        
         if not order:
             raise NotFoundError("Заказ не найден")
         
@@ -271,8 +489,8 @@ def update_order_status(order_id):
     """
     try:
         user_id = get_jwt_identity()
-        user = User.query.get(user_id)
-        if not user:
+        identity = current_identity()
+        if not identity:
             raise NotFoundError("Пользователь не найден")
         
         order = Order.query.get(order_id)
@@ -280,8 +498,7 @@ def update_order_status(order_id):
             raise NotFoundError("Заказ не найден")
         
         # Проверка прав: только владелец заказа или админ
-        if order.user_id != int(user_id) and user.role != "admin":
-            from errors import ForbiddenError
+        if order.user_id != identity.user_id and identity.role != "admin":
             raise ForbiddenError("У вас нет прав для изменения этого заказа")
         
         data = request.get_json() or {}
@@ -297,6 +514,7 @@ def update_order_status(order_id):
         
         old_status = order.status
         order.status = new_status
+        record_status_change(order, old_status, new_status)
         
         # Добавляем запись в историю
         add_order_history(
@@ -314,7 +532,7 @@ def update_order_status(order_id):
             "order_id": order.id,
             "status": new_status
         }), 200
-    except (ValidationError, NotFoundError) as e:
+    except (ValidationError, NotFoundError, UnauthorizedError, ForbiddenError) as e:
         db.session.rollback()
         raise
     except Exception as e:
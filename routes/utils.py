@@ -1,7 +1,17 @@
 import os
+import io
+import csv
+import json
+import zlib
+import base64
+import logging
+from datetime import datetime
 from flask import current_app
-from werkzeug.utils import secure_filename
-from uuid import uuid4
+from sqlalchemy import tuple_, DateTime
+from errors import ValidationError
+from services.media import store_stream, retain_media, upload_folder
+
+logger = logging.getLogger(__name__)
 
 def allowed_file(filename):
     if "." not in filename:
@@ -9,46 +19,152 @@ def allowed_file(filename):
     ext = filename.rsplit(".", 1)[1].lower()
     return ext in current_app.config['ALLOWED_EXTENSIONS']
 
-def save_avatar(file_storage):
-    """Сохранить аватар пользователя"""
+def queue_image_variants(path, stored, widths=None):
+    """Поставить построение копий для srcset (ошибка не мешает загрузке)"""
+    pipeline = getattr(current_app, "image_pipeline", None)
+    if pipeline is None:
+        return
+    try:
+        pipeline.submit(path, stored, widths)
+    except Exception:
+        logger.exception("Не удалось построить копии изображения %s", stored)
+
+def save_upload(file_storage, kind, widths=None):
+    """
+    Сохранить загрузку по хэшу содержимого и учесть ссылку на нее.
+    Повторная загрузка того же файла возвращает уже сохраненный путь.
+    """
     if not allowed_file(file_storage.filename):
         return None
-    filename = secure_filename(file_storage.filename)
-    unique = f"{uuid4().hex}_{filename}"
-    path = os.path.join(current_app.config['UPLOAD_FOLDER'], unique)
-    file_storage.save(path)
-    return os.path.join("static", "avatars", unique)
+    # Расширение уже проверено allowed_file, имя файла больше не используется
+    ext = file_storage.filename.rsplit(".", 1)[1].lower()
+    media = store_stream(file_storage.stream, upload_folder(kind), f"static/{kind}", ext)
+    if media.created:
+        queue_image_variants(media.path, media.stored, widths)
+    retain_media(media.stored)
+    return media.stored
+
+def save_avatar(file_storage):
+    """Сохранить аватар пользователя"""
+    return save_upload(file_storage, "avatars", current_app.config.get('IMAGE_AVATAR_WIDTHS'))
 
 def save_product_image(file_storage):
     """Сохранить изображение товара"""
-    if not allowed_file(file_storage.filename):
-        return None
-    filename = secure_filename(file_storage.filename)
-    unique = f"{uuid4().hex}_{filename}"
-    upload_folder = current_app.config.get('PRODUCTS_UPLOAD_FOLDER')
-    if not upload_folder:
-        upload_folder = os.path.join(
-            os.path.dirname(current_app.config['UPLOAD_FOLDER']),
-            "products"
-        )
-    os.makedirs(upload_folder, exist_ok=True)
-    path = os.path.join(upload_folder, unique)
-    file_storage.save(path)
-    return os.path.join("static", "products", unique)
+    return save_upload(file_storage, "products")
 
 def save_work_image(file_storage):
     """Сохранить изображение работы"""
-    if not allowed_file(file_storage.filename):
-        return None
-    filename = secure_filename(file_storage.filename)
-    unique = f"{uuid4().hex}_{filename}"
-    upload_folder = current_app.config.get('WORKS_UPLOAD_FOLDER')
-    if not upload_folder:
-        upload_folder = os.path.join(
-            os.path.dirname(current_app.config['UPLOAD_FOLDER']),
-            "works"
-        )
-    os.makedirs(upload_folder, exist_ok=True)
-    path = os.path.join(upload_folder, unique)
-    file_storage.save(path)
-    return os.path.join("static", "works", unique)
\ No newline at end of file
+    return save_upload(file_storage, "works")
+
+def encode_cursor(values):
+    """Закодировать позицию keyset-пагинации в непрозрачную строку"""
+    payload = [v.isoformat() if isinstance(v, datetime) else v for v in values]
+    raw = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor, columns):
+    """Раскодировать курсор в значения колонок сортировки"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        payload = json.loads(raw)
+        if not isinstance(payload, list) or len(payload) != len(columns):
+            raise ValueError("cursor length")
+        values = []
+        for column, value in zip(columns, payload):
+            if isinstance(column.type, DateTime) and value is not None:
+                value = datetime.fromisoformat(value)
+            values.append(value)
+        return values
+    except (ValueError, TypeError):
+        raise ValidationError("Некорректный курсор пагинации")
+
+def keyset_paginate(query, columns, cursor=None, limit=20):
+    """
+    Keyset-пагинация по убыванию колонок columns (последняя должна быть уникальной).
+    Вместо OFFSET продолжает выборку строго после позиции курсора, поэтому
+    стоимость страницы не зависит от ее номера при наличии составного индекса.
+    Возвращает (items, next_cursor); next_cursor равен None на последней странице.
+    """
+    limit = max(int(limit), 1)
+    if cursor:
+        values = decode_cursor(cursor, columns)
+        query = query.filter(tuple_(*columns) < tuple_(*values))
+    query = query.order_by(*[column.desc() for column in columns])
+    rows = query.limit(limit + 1).all()
+    items = rows[:limit]
+    next_cursor = None
+    if len(rows) > limit:
+        last = items[-1]
+        next_cursor = encode_cursor([getattr(last, column.key) for column in columns])
+    return items, next_cursor
+
+
+def _export_value(value):
+    """Привести значение колонки к виду, пригодному для CSV/NDJSON"""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+def row_to_dict(row, columns):
+    """Строка запроса в словарь {колонка: значение} с датами в ISO-формате"""
+    return {column: _export_value(value) for column, value in zip(columns, row)}
+
+def iter_export_rows(rows, columns, fmt="csv", chunk_rows=500):
+    """
+    Построчная сериализация выгрузки в CSV или NDJSON.
+    Строки накапливаются в небольшой буфер и отдаются порциями, поэтому
+    расход памяти не зависит от размера таблицы.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer) if fmt == "csv" else None
+    if writer:
+        writer.writerow(columns)
+    pending = 0
+    for row in rows:
+        values = [_export_value(v) for v in row]
+        if writer:
+            writer.writerow(["" if v is None else v for v in values])
+        else:
+            buffer.write(json.dumps(dict(zip(columns, values)), ensure_ascii=False))
+            buffer.write("\n")
+        pending += 1
+        if pending >= chunk_rows:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+    tail = buffer.getvalue()
+    if tail:
+        yield tail.encode("utf-8")
+
+def iter_json_list(rows, columns, key="items", chunk_rows=500):
+    """
+    Потоковый JSON-ответ вида {"success": true, "<key>": [...]}.
+    Массив пишется порциями по мере чтения строк, без сборки всего списка в памяти.
+    """
+    buffer = io.StringIO()
+    buffer.write(f'{{"success": true, {json.dumps(key)}: [')
+    pending = 0
+    first = True
+    for row in rows:
+        if not first:
+            buffer.write(",")
+        first = False
+        buffer.write(json.dumps(row_to_dict(row, columns), ensure_ascii=False))
+        pending += 1
+        if pending >= chunk_rows:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+    buffer.write("]}")
+    yield buffer.getvalue().encode("utf-8")
+
+def gzip_stream(chunks, level=6):
+    """Сжать поток байтовых порций в формат gzip без буферизации всего файла"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
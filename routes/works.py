@@ -1,14 +1,29 @@
-from flask import Blueprint, request, jsonify, send_from_directory, current_app
+from flask import Blueprint, request, jsonify, current_app
 from models import db, Work
 from sqlalchemy import desc
 from errors import NotFoundError, ValidationError
 from schemas import WorksListQuerySchema, WorkSchema
 from marshmallow import ValidationError as MarshmallowValidationError
 from flask_caching import Cache
+from services.images import image_sets
+from routes.media import send_media
 import os
 
 works_bp = Blueprint("works", __name__)
 
+def work_image_relpath(path):
+    """Путь файла внутри каталога работ (с подкаталогами хранилища по хэшу)"""
+    for prefix in ('uploads/works/', 'static/works/'):
+        if path.startswith(prefix):
+            return path[len(prefix):]
+    return os.path.basename(path)
+
+def work_variant_url(path):
+    """URL копии изображения работы (отдается тем же маршрутом, что и исходник)"""
+    api_base_url = current_app.config.get('API_BASE_URL', 'http://localhost:5001')
+    api_version = current_app.config.get('API_VERSION', 'v1')
+    return f"{api_base_url}/api/{api_version}/works/image/{work_image_relpath(path)}"
+
 @works_bp.route("/works", methods=["GET"])
 def get_works():
     """
@@ -58,18 +73,19 @@ def get_works():
         api_base_url = current_app.config.get('API_BASE_URL', 'http://localhost:5001')
         api_version = current_app.config.get('API_VERSION', 'v1')
         
+        sets = image_sets([work.image.lstrip('/') for work in pagination.items], work_variant_url)
         works = []
         for work in pagination.items:
             # Формируем URL изображения
             if work.image.startswith('/'):
                 image_path = work.image.lstrip('/')
                 if image_path.startswith('uploads/works/') or image_path.startswith('static/works/'):
-                    filename = os.path.basename(image_path)
+                    filename = work_image_relpath(image_path)
                     image_url = f"{api_base_url}/api/{api_version}/works/image/{filename}"
                 else:
                     image_url = f"{api_base_url}{work.image}"
             elif work.image.startswith('static/'):
-                filename = os.path.basename(work.image)
+                filename = work_image_relpath(work.image)
                 image_url = f"{api_base_url}/api/{api_version}/works/image/{filename}"
             else:
                 image_url = f"{api_base_url}/api/{api_version}/works/image/{work.image}"
@@ -78,6 +94,7 @@ def get_works():
                 "id": work.id,
                 "title": work.title,
                 "image": image_url,
+                "image_set": sets.get(work.image.lstrip('/')),
                 "link": work.link,
                 "created_at": work.created_at.isoformat() if work.created_at else None
             })
@@ -100,7 +117,7 @@ def get_works():
     except Exception as e:
         raise ValidationError(f"Ошибка при получении работ: {str(e)}")
 
-@works_bp.route("/works/image/<filename>", methods=["GET"])
+@works_bp.route("/works/image/<path:filename>", methods=["GET"])
 def get_work_image(filename):
     """
     Получить изображение работы
@@ -115,25 +132,14 @@ def get_work_image(filename):
     responses:
       200:
         description: Изображение
+      206:
+        description: Часть изображения (Range)
+      304:
+        description: Изображение не изменилось
       404:
         description: Изображение не найдено
     """
-    try:
-        works_folder = current_app.config.get('WORKS_UPLOAD_FOLDER')
-        if not works_folder:
-            basedir = os.path.abspath(os.path.dirname(os.path.dirname(__file__)))
-            works_folder = os.path.join(basedir, "static", "works")
-        
-        # Проверяем, существует ли файл
-        file_path = os.path.join(works_folder, filename)
-        if not os.path.exists(file_path):
-            raise NotFoundError(f"Изображение не найдено: {filename}")
-        
-        return send_from_directory(works_folder, filename)
-    except NotFoundError as e:
-        raise
-    except Exception as e:
-        raise NotFoundError(f"Ошибка при получении изображения: {str(e)}")
+    return send_media("works", filename)
 
 @works_bp.route("/works/<int:work_id>", methods=["GET"])
 def get_work_by_id(work_id):
@@ -163,12 +169,12 @@ def get_work_by_id(work_id):
         if work.image.startswith('/'):
             image_path = work.image.lstrip('/')
             if image_path.startswith('uploads/works/') or image_path.startswith('static/works/'):
-                filename = os.path.basename(image_path)
+                filename = work_image_relpath(image_path)
                 image_url = f"{api_base_url}/api/{api_version}/works/image/{filename}"
             else:
                 image_url = f"{api_base_url}{work.image}"
         elif work.image.startswith('static/'):
-            filename = os.path.basename(work.image)
+            filename = work_image_relpath(work.image)
             image_url = f"{api_base_url}/api/{api_version}/works/image/{filename}"
         else:
             image_url = f"{api_base_url}/api/{api_version}/works/image/{work.image}"
@@ -178,6 +184,7 @@ def get_work_by_id(work_id):
             "id": work.id,
             "title": work.title,
             "image": image_url,
+            "image_set": image_sets([work.image.lstrip('/')], work_variant_url).get(work.image.lstrip('/')),
             "link": work.link,
             "created_at": work.created_at.isoformat() if work.created_at else None
         }
@@ -1,9 +1,10 @@
 """
 Схемы валидации данных с использованием Marshmallow
 """
-from marshmallow import Schema, fields, validate, ValidationError as MarshmallowValidationError
+from marshmallow import Schema, fields, validate, validates_schema, ValidationError as MarshmallowValidationError
 from marshmallow_sqlalchemy import SQLAlchemyAutoSchema
 from models import User, Product, Category, Order, OrderItem, Work, PasswordResetCode, Brand
+from services.images import image_set
 
 # ========== User Schemas ==========
 class UserSchema(SQLAlchemyAutoSchema):
@@ -12,6 +13,13 @@ class UserSchema(SQLAlchemyAutoSchema):
         load_instance = True
         exclude = ('password_hash',)
 
+class UserProfileSchema(UserSchema):
+    """Пользователь с копиями аватара для srcset (ответы auth)"""
+    avatar_set = fields.Method("get_avatar_set", dump_only=True)
+
+    def get_avatar_set(self, user):
+        return image_set(user.avatar) if user.avatar else None
+
 class UserRegisterSchema(Schema):
     first_name = fields.Str(required=True, validate=validate.Length(min=1, max=120))
     last_name = fields.Str(required=True, validate=validate.Length(min=1, max=120))
@@ -66,6 +74,27 @@ class ProductUpdateSchema(Schema):
     category_id = fields.Int(allow_none=True)
     brand_id = fields.Int(allow_none=True)
 
+class ProductBulkUpdateItemSchema(Schema):
+    id = fields.Int(required=True, validate=validate.Range(min=1))
+    price = fields.Float(validate=validate.Range(min=0))
+    stock = fields.Int(validate=validate.Range(min=0))
+
+    @validates_schema
+    def validate_changes(self, data, **kwargs):
+        if "price" not in data and "stock" not in data:
+            raise MarshmallowValidationError("Укажите price и/или stock")
+
+class ProductImportRowSchema(Schema):
+    """Строка CSV импорта товаров; category и brand - названия"""
+    sku = fields.Str(validate=validate.Length(max=64))
+    title = fields.Str(required=True, validate=validate.Length(min=1, max=200))
+    description = fields.Str()
+    price = fields.Float(required=True, validate=validate.Range(min=0))
+    stock = fields.Int(validate=validate.Range(min=0))
+    category = fields.Str()
+    brand = fields.Str()
+    image = fields.Str(validate=validate.Length(max=300))
+
 # ========== Category Schemas ==========
 class CategorySchema(SQLAlchemyAutoSchema):
     class Meta:
@@ -90,6 +119,51 @@ class OrderSchema(SQLAlchemyAutoSchema):
         load_instance = True
         include_relationships = True
 
+# Облегченные схемы заказа: только поля, нужные спискам и ответу оформления,
+# без вложенных полных UserSchema/ProductSchema
+class OrderItemBriefSchema(Schema):
+    id = fields.Int()
+    product_id = fields.Int()
+    title = fields.Function(lambda item: item.product.title if item.product else None)
+    price = fields.Float()
+    quantity = fields.Int()
+
+class OrderUserBriefSchema(Schema):
+    id = fields.Int()
+    email = fields.Str()
+    first_name = fields.Str()
+    last_name = fields.Str()
+
+class OrderSummarySchema(Schema):
+    id = fields.Int()
+    status = fields.Str()
+    total = fields.Float()
+    created_at = fields.DateTime()
+    user_id = fields.Int()
+    user = fields.Nested(OrderUserBriefSchema)
+    items = fields.Nested(OrderItemBriefSchema, many=True)
+
+class OrderDetailSchema(OrderSummarySchema):
+    class Meta:
+        exclude = ("user",)
+
+class OrderBulkFilterSchema(Schema):
+    status = fields.Str()
+    user_id = fields.Int(validate=validate.Range(min=1))
+    date_from = fields.DateTime()
+    date_to = fields.DateTime()
+
+class OrderBulkStatusSchema(Schema):
+    ids = fields.List(fields.Int(validate=validate.Range(min=1)), validate=validate.Length(min=1, max=5000))
+    filter = fields.Nested(OrderBulkFilterSchema)
+    status = fields.Str(required=True)
+    comment = fields.Str(allow_none=True)
+
+    @validates_schema
+    def validate_target(self, data, **kwargs):
+        if bool(data.get("ids")) == bool(data.get("filter")):
+            raise MarshmallowValidationError("Укажите либо ids, либо filter")
+
 # ========== Cart Schemas ==========
 class CartAddSchema(Schema):
     product_id = fields.Int(required=True, validate=validate.Range(min=1))
@@ -0,0 +1,133 @@
+"""
+Архивирование завершенных заказов (hot/cold)
+
+Доставленные и отмененные заказы старше ORDERS_ARCHIVE_AFTER_DAYS
+переносятся пачками вместе с позициями и историей в таблицы archived_*.
+Оперативные таблицы и их индексы остаются небольшими, а списки заказов
+читают архив только по запросу (include_archived).
+"""
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import insert, delete, select, literal, union_all, func, case, DateTime, Boolean
+from models import (
+    db, Order, OrderItem, OrderHistory,
+    ArchivedOrder, ArchivedOrderItem, ArchivedOrderHistory
+)
+
+ARCHIVABLE_STATUSES = ("delivered", "cancelled")
+
+def _copy(source, target, where, extra=None):
+    """INSERT INTO target SELECT ... FROM source WHERE where"""
+    names = [column.name for column in source.__table__.columns]
+    columns = [source.__table__.c[name] for name in names]
+    for name, value in (extra or {}).items():
+        names.append(name)
+        columns.append(value)
+    db.session.execute(insert(target).from_select(names, select(*columns).where(where)))
+
+def archive_orders_batch(border, batch_size, statuses=ARCHIVABLE_STATUSES):
+    """Перенести в архив одну пачку заказов; возвращает количество перенесенных"""
+    query = db.session.query(Order.id).filter(
+        Order.status.in_(statuses),
+        Order.created_at < border
+    ).order_by(Order.id).limit(batch_size)
+    if db.session.get_bind().dialect.name != "sqlite":
+        query = query.with_for_update(skip_locked=True)
+    ids = [row[0] for row in query]
+    if not ids:
+        db.session.rollback()
+        return 0
+
+    now = literal(datetime.utcnow(), DateTime)
+    _copy(Order, ArchivedOrder, Order.id.in_(ids), extra={"archived_at": now})
+    _copy(OrderItem, ArchivedOrderItem, OrderItem.order_id.in_(ids))
+    _copy(OrderHistory, ArchivedOrderHistory, OrderHistory.order_id.in_(ids))
+
+    db.session.execute(delete(OrderHistory).where(OrderHistory.order_id.in_(ids)))
+    db.session.execute(delete(OrderItem).where(OrderItem.order_id.in_(ids)))
+    db.session.execute(delete(Order).where(Order.id.in_(ids)))
+    db.session.commit()
+    return len(ids)
+
+def archive_orders(older_than_days=None, batch_size=None):
+    """Перенести в архив все подходящие заказы пачками (commit на каждую пачку)"""
+    config = current_app.config
+    if older_than_days is None:
+        older_than_days = config.get("ORDERS_ARCHIVE_AFTER_DAYS", 180)
+    if batch_size is None:
+        batch_size = config.get("ORDERS_ARCHIVE_BATCH_SIZE", 500)
+    border = datetime.utcnow() - timedelta(days=older_than_days)
+    total = 0
+    while True:
+        moved = archive_orders_batch(border, batch_size)
+        total += moved
+        if moved < batch_size:
+            return total
+
+def order_rows_query(include_archived=False, user_id=None, status=None):
+    """
+    Запрос строк заказов (id, user_id, status, total, created_at, archived)
+    по оперативной таблице и, при include_archived, по архиву (UNION ALL).
+    Возвращает (query, subquery) для сортировки и keyset-пагинации по колонкам subquery.
+    """
+    def rows_from(model, archived):
+        stmt = select(
+            model.id, model.user_id, model.status, model.total, model.created_at,
+            literal(archived, Boolean).label("archived")
+        )
+        if user_id is not None:
+            stmt = stmt.where(model.user_id == user_id)
+        if status:
+            stmt = stmt.where(model.status == status)
+        return stmt
+
+    stmt = rows_from(Order, False)
+    if include_archived:
+        stmt = union_all(stmt, rows_from(ArchivedOrder, True))
+    rows = stmt.subquery("order_rows")
+    return db.session.query(rows), rows
+
+def items_count_by_order(order_ids, include_archived=False):
+    """Количество позиций для списка заказов одним сгруппированным запросом на таблицу"""
+    if not order_ids:
+        return {}
+    models = [OrderItem, ArchivedOrderItem] if include_archived else [OrderItem]
+    counts = {}
+    for model in models:
+        counts.update(
+            db.session.query(model.order_id, func.count(model.id))
+            .filter(model.order_id.in_(order_ids))
+            .group_by(model.order_id)
+        )
+    return counts
+
+def order_totals_by_user(user_ids):
+    """
+    Количество заказов и сумма покупок (без отмененных) по пользователям,
+    включая архив: один сгруппированный запрос только по переданным id.
+    Возвращает {user_id: (orders_count, lifetime_spend)}.
+    """
+    if not user_ids:
+        return {}
+    def rows_from(model):
+        return select(model.user_id, model.total, model.status).where(model.user_id.in_(user_ids))
+    rows = union_all(rows_from(Order), rows_from(ArchivedOrder)).subquery("user_orders")
+    spend = func.sum(case((rows.c.status != "cancelled", rows.c.total), else_=0))
+    return {
+        user_id: (int(count), round(float(total or 0), 2))
+        for user_id, count, total in db.session.query(
+            rows.c.user_id, func.count(), spend
+        ).group_by(rows.c.user_id)
+    }
+
+@click.command("orders-archive")
+@click.option("--older-than-days", type=int, default=None, help="Возраст заказа в днях")
+@click.option("--batch-size", type=int, default=None, help="Размер пачки")
+@with_appcontext
+def orders_archive_command(older_than_days, batch_size):
+    """Перенести завершенные старые заказы в архив"""
+    moved = archive_orders(older_than_days=older_than_days, batch_size=batch_size)
+    click.echo(f"Перенесено в архив заказов: {moved}")
@@ -0,0 +1,237 @@
+"""
+Очередь оформления заказов для пиковой нагрузки
+
+При CHECKOUT_QUEUE_ENABLED запрос на оформление только сохраняет тикет
+(корзина + данные доставки) и сразу отвечает 202. Заказы создает пул
+воркеров (в API или в отдельном процессе `flask checkout-worker`). Остатки
+списываются условным UPDATE ... WHERE stock >= qty в place_order, поэтому
+одновременные заказы одного товара в разных потоках и процессах не уводят
+остаток в минус. Непредвиденная ошибка возвращает тикет в очередь, а после
+CHECKOUT_MAX_ATTEMPTS попыток тикет завершается с ошибкой; тикеты, зависшие
+в processing дольше CHECKOUT_STALE_AFTER секунд (воркер упал), снова
+ставятся в очередь. Результат можно получить через
+GET /orders/checkout/<ticket_id> или SSE-событие checkout.
+"""
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from uuid import uuid4
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from errors import APIError
+from models import db, CheckoutTicket
+from services.events import user_topic
+from services.runner import BackgroundRunner
+
+logger = logging.getLogger(__name__)
+
+def enqueue_checkout(user_id, cart, details):
+    """Сохранить тикет и передать его пулу воркеров (после commit)"""
+    ticket = CheckoutTicket(
+        id=uuid4().hex,
+        user_id=user_id,
+        cart=json.dumps({str(pid): qty for pid, qty in cart.items()}),
+        details=json.dumps(details, ensure_ascii=False),
+        status="queued"
+    )
+    db.session.add(ticket)
+    db.session.commit()
+    queue = getattr(current_app, "checkout_queue", None)
+    if queue is not None:
+        queue.submit(ticket.id)
+    return ticket
+
+class CheckoutQueue:
+    """Пул воркеров оформления заказов"""
+
+    def __init__(self, app, workers=4):
+        self.app = app
+        self.workers = workers
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self._inflight = set()
+
+    def submit(self, ticket_id):
+        """Поставить тикет в обработку; при workers=0 тикет ждет `flask checkout-worker`"""
+        if self.workers <= 0:
+            return False
+        with self._executor_lock:
+            if ticket_id in self._inflight:
+                return False
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="checkout")
+            self._inflight.add(ticket_id)
+        self._executor.submit(self._run, ticket_id)
+        return True
+
+    def _run(self, ticket_id):
+        try:
+            with self.app.app_context():
+                try:
+                    self.process(ticket_id)
+                except Exception:
+                    db.session.rollback()
+                    logger.exception("Ошибка обработки тикета оформления %s", ticket_id)
+        finally:
+            with self._executor_lock:
+                self._inflight.discard(ticket_id)
+
+    def process(self, ticket_id):
+        """
+        Обработать один тикет внутри контекста приложения.
+        Тикет захватывается атомарно (queued -> processing), поэтому повторная
+        постановка или несколько процессов-воркеров не создадут заказ дважды.
+        Итог записывается условным UPDATE по номеру попытки: если тикет за это
+        время вернули в очередь и захватил другой воркер, заказ этой попытки
+        откатывается.
+        """
+        from routes.orders import place_order
+
+        claimed = CheckoutTicket.query.filter_by(id=ticket_id, status="queued").update({
+            "status": "processing",
+            "attempts": CheckoutTicket.attempts + 1,
+            "updated_at": datetime.utcnow()
+        }, synchronize_session=False)
+        db.session.commit()
+        if not claimed:
+            return None
+
+        ticket = db.session.get(CheckoutTicket, ticket_id)
+        attempt = ticket.attempts
+        try:
+            cart = {int(pid): int(qty) for pid, qty in json.loads(ticket.cart).items()}
+            details = json.loads(ticket.details or "{}")
+            order = place_order(ticket.user_id, cart, details)
+            # Заказ и завершение тикета фиксируются одной транзакцией
+            finished = self._finish(ticket_id, attempt, status="completed", order_id=order.id)
+        except APIError as e:
+            db.session.rollback()
+            finished = self._finish(ticket_id, attempt, status="failed", error=e.message)
+        except Exception:
+            db.session.rollback()
+            logger.exception("Ошибка оформления заказа по тикету %s", ticket_id)
+            if attempt >= self.app.config.get("CHECKOUT_MAX_ATTEMPTS", 3):
+                finished = self._finish(
+                    ticket_id, attempt, status="failed", error="Не удалось оформить заказ, попробуйте еще раз"
+                )
+            else:
+                # Повторит следующий drain
+                self._finish(ticket_id, attempt, status="queued")
+                finished = False
+        else:
+            if not finished:
+                logger.warning("Тикет оформления %s уже обработан другой попыткой, заказ отменен", ticket_id)
+
+        ticket = db.session.get(CheckoutTicket, ticket_id)
+        if finished:
+            self._publish(ticket)
+        return ticket
+
+    def _finish(self, ticket_id, attempt, **values):
+        """
+        Записать итог попытки attempt, если тикет все еще за ней; иначе
+        откатить транзакцию (вместе с заказом). Возвращает True при записи.
+        """
+        updated = CheckoutTicket.query.filter_by(id=ticket_id, status="processing", attempts=attempt).update(
+            dict(values, updated_at=datetime.utcnow()), synchronize_session=False
+        )
+        if not updated:
+            db.session.rollback()
+            return False
+        db.session.commit()
+        return True
+
+    def _publish(self, ticket):
+        broker = getattr(self.app, "event_broker", None)
+        if broker is not None:
+            broker.publish([user_topic(ticket.user_id)], {
+                "event": "checkout",
+                "ticket_id": ticket.id,
+                "status": ticket.status,
+                "order_id": ticket.order_id,
+                "error": ticket.error
+            })
+
+    def requeue_stale(self, timeout=None):
+        """
+        Вернуть в очередь тикеты, зависшие в processing дольше timeout секунд;
+        исчерпавшие CHECKOUT_MAX_ATTEMPTS завершаются с ошибкой.
+        """
+        config = self.app.config
+        timeout = config.get("CHECKOUT_STALE_AFTER", 300) if timeout is None else timeout
+        max_attempts = config.get("CHECKOUT_MAX_ATTEMPTS", 3)
+        cutoff = datetime.utcnow() - timedelta(seconds=timeout)
+        stale = CheckoutTicket.query.filter(
+            CheckoutTicket.status == "processing", CheckoutTicket.updated_at < cutoff
+        )
+        failed_ids = [row[0] for row in stale.with_entities(CheckoutTicket.id)
+                      .filter(CheckoutTicket.attempts >= max_attempts)]
+        requeued = stale.filter(CheckoutTicket.attempts < max_attempts).update(
+            {"status": "queued", "updated_at": datetime.utcnow()}, synchronize_session=False
+        )
+        if failed_ids:
+            # Условие на status и updated_at - тикет мог завершиться после выборки
+            stale.filter(CheckoutTicket.id.in_(failed_ids)).update({
+                "status": "failed",
+                "error": "Не удалось оформить заказ, попробуйте еще раз",
+                "updated_at": datetime.utcnow()
+            }, synchronize_session=False)
+        db.session.commit()
+        for ticket_id in failed_ids:
+            ticket = db.session.get(CheckoutTicket, ticket_id)
+            if ticket is not None and ticket.status == "failed":
+                self._publish(ticket)
+        if requeued or failed_ids:
+            logger.warning("Зависшие тикеты оформления: в очередь %s, с ошибкой %s", requeued, len(failed_ids))
+        return requeued
+
+    def drain(self, limit=100):
+        """Поставить в обработку тикеты, ожидающие в БД (после рестарта или при workers=0 в API)"""
+        self.requeue_stale()
+        with self._executor_lock:
+            inflight = set(self._inflight)
+        query = db.session.query(CheckoutTicket.id).filter(CheckoutTicket.status == "queued")
+        if inflight:
+            query = query.filter(CheckoutTicket.id.notin_(inflight))
+        ids = [row[0] for row in query.order_by(CheckoutTicket.created_at).limit(limit)]
+        db.session.rollback()
+        for ticket_id in ids:
+            self.submit(ticket_id)
+        return len(ids)
+
+    def shutdown(self, wait=True):
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+
+class CheckoutSweeper(BackgroundRunner):
+    """Периодически ставит в обработку ожидающие и зависшие тикеты (workers > 0)"""
+
+    name = "checkout-sweeper"
+    interval_key = "CHECKOUT_SWEEP_INTERVAL"
+    default_interval = 30
+    error_message = "Ошибка проверки очереди оформления"
+
+    def run_once(self):
+        self.app.checkout_queue.drain()
+        return False
+
+@click.command("checkout-worker")
+@click.option("--workers", type=int, default=None, help="Количество потоков")
+@with_appcontext
+def checkout_worker_command(workers):
+    """Обрабатывать тикеты оформления из очереди в БД"""
+    app = current_app._get_current_object()
+    queue = CheckoutQueue(app, workers or app.config.get("CHECKOUT_WORKERS", 4))
+    interval = app.config.get("CHECKOUT_POLL_INTERVAL", 1)
+    click.echo(f"Воркер оформления запущен ({queue.workers} потоков)")
+    try:
+        while True:
+            queue.drain(limit=queue.workers * 10)
+            time.sleep(interval)
+    finally:
+        queue.shutdown()
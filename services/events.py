@@ -0,0 +1,177 @@
+"""
+Рассылка событий об изменении статусов заказов для Server-Sent Events
+
+События копятся в session.info и публикуются только после успешного
+commit (при откате отбрасываются). EventBroker раздает их подписчикам
+внутри процесса: у каждого SSE-соединения своя небольшая очередь, поэтому
+тысячи простаивающих соединений стоят лишь памяти под очереди. При
+EVENTS_REDIS_URL события идут через канал Redis: каждый воркер держит одно
+соединение-слушатель и раздает события своим подписчикам. После разрыва
+слушатель переподключается, а подписчики получают событие resync, чтобы
+перечитать состояние, пропущенное за время разрыва.
+"""
+import json
+import logging
+import queue
+import threading
+from collections import defaultdict
+from datetime import datetime
+
+from flask import current_app, has_app_context
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from models import db
+from services.runner import listen_redis
+
+logger = logging.getLogger(__name__)
+
+ADMIN_TOPIC = "admin"
+
+def user_topic(user_id):
+    return f"user:{user_id}"
+
+class Subscription:
+    """Очередь событий одного SSE-соединения"""
+
+    def __init__(self, topics, maxsize):
+        self.topics = tuple(topics)
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.overflowed = False
+
+    def put(self, item):
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            # Медленный клиент: не копим события, а просим его перечитать состояние
+            self.overflowed = True
+
+    def get(self, timeout):
+        """Следующее событие или None по таймауту (для heartbeat)"""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+class EventBroker:
+    """Pub/sub внутри процесса с опциональной синхронизацией через Redis"""
+
+    def __init__(self, redis_url=None, channel="order-events", queue_size=100):
+        self.channel = channel
+        self.queue_size = queue_size
+        self._lock = threading.Lock()
+        self._subscribers = defaultdict(set)
+        self._redis = None
+        self._listener = None
+        if redis_url:
+            import redis
+            self._redis = redis.Redis.from_url(redis_url)
+
+    def subscribe(self, topics):
+        subscription = Subscription(topics, self.queue_size)
+        with self._lock:
+            for topic in subscription.topics:
+                self._subscribers[topic].add(subscription)
+        if self._redis is not None:
+            self._ensure_listener()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            for topic in subscription.topics:
+                subscribers = self._subscribers.get(topic)
+                if subscribers is None:
+                    continue
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[topic]
+
+    def subscribers_count(self):
+        with self._lock:
+            return len({sub for subs in self._subscribers.values() for sub in subs})
+
+    def publish(self, topics, data):
+        """Опубликовать событие для тем topics"""
+        message = {"topics": list(topics), "data": data}
+        if self._redis is not None:
+            try:
+                self._redis.publish(self.channel, json.dumps(message, default=str))
+                return
+            except Exception:
+                logger.exception("Не удалось опубликовать событие в Redis, доставляем локально")
+        self._deliver(message)
+
+    def _deliver(self, message):
+        with self._lock:
+            targets = set()
+            for topic in message["topics"]:
+                targets.update(self._subscribers.get(topic, ()))
+        for subscription in targets:
+            subscription.put(message["data"])
+
+    def _ensure_listener(self):
+        with self._lock:
+            if self._listener is not None:
+                return
+            self._listener = threading.Thread(target=self._listen, name="events-redis-listener", daemon=True)
+            self._listener.start()
+
+    def _listen(self):
+        listen_redis(
+            self._redis, self.channel,
+            lambda data: self._deliver(json.loads(data)),
+            on_reconnect=self.resync
+        )
+
+    def resync(self):
+        """Попросить всех подписчиков перечитать состояние (события могли потеряться)"""
+        with self._lock:
+            targets = {sub for subs in self._subscribers.values() for sub in subs}
+        for subscription in targets:
+            subscription.put({"event": "resync"})
+
+def queue_order_event(order_id, user_id, status, comment=None, changed_by=None):
+    """Запомнить событие заказа до commit текущей транзакции"""
+    db.session.info.setdefault("order_events", []).append({
+        "order_id": order_id,
+        "user_id": user_id,
+        "status": status,
+        "comment": comment,
+        "changed_by": str(changed_by) if changed_by is not None else None,
+        "created_at": datetime.utcnow().isoformat()
+    })
+
+@event.listens_for(Session, "after_commit")
+def _publish_after_commit(session):
+    events = session.info.pop("order_events", None)
+    if not events or not has_app_context():
+        return
+    broker = getattr(current_app, "event_broker", None)
+    if broker is None:
+        return
+    for data in events:
+        topics = [ADMIN_TOPIC]
+        if data.get("user_id") is not None:
+            topics.append(user_topic(data["user_id"]))
+        broker.publish(topics, data)
+
+@event.listens_for(Session, "after_rollback")
+def _discard_after_rollback(session):
+    session.info.pop("order_events", None)
+
+def sse_stream(broker, subscription, heartbeat):
+    """Генератор SSE: события заказов (по умолчанию update_order_status) и heartbeat-комментарии"""
+    try:
+        yield "retry: 3000\n\n"
+        while True:
+            data = subscription.get(timeout=heartbeat)
+            if subscription.overflowed:
+                subscription.overflowed = False
+                yield "event: resync\ndata: {}\n\n"
+            if data is None:
+                yield ": ping\n\n"
+                continue
+            data = dict(data)
+            name = data.pop("event", "update_order_status")
+            yield f"event: {name}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+    finally:
+        broker.unsubscribe(subscription)
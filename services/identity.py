@@ -0,0 +1,88 @@
+"""
+Роль и версия пользователя в JWT и кэш идентичности
+
+При входе в токен добавляются claims role и ver (User.token_version).
+Проверки прав берут роль из токена, сверяя версию с коротко живущим кэшем
+в памяти процесса; БД читается только при промахе кэша. Смена роли или
+удаление пользователя увеличивают версию и сбрасывают запись кэша, поэтому
+старые токены перестают приниматься (в других воркерах - не позже чем через
+IDENTITY_CACHE_TTL секунд).
+"""
+import threading
+import time
+from collections import namedtuple
+
+from flask import current_app
+from flask_jwt_extended import get_jwt, get_jwt_identity
+from errors import UnauthorizedError
+from models import db, User
+
+Identity = namedtuple("Identity", ["user_id", "role", "version"])
+
+def identity_claims(user):
+    """Дополнительные claims access-токена пользователя"""
+    return {"role": user.role, "ver": user.token_version}
+
+class IdentityCache:
+    """TTL-кэш {user_id: (role, token_version)}"""
+
+    def __init__(self, ttl=30, maxsize=10000):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def get(self, user_id):
+        """(role, version) или None, если пользователя нет"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] > now:
+                return entry[1]
+        row = db.session.query(User.role, User.token_version).filter(User.id == user_id).first()
+        value = (row.role, row.token_version) if row else None
+        with self._lock:
+            if len(self._entries) >= self.maxsize:
+                self._evict(now)
+            self._entries[user_id] = (now + self.ttl, value)
+        return value
+
+    def _evict(self, now):
+        expired = [key for key, entry in self._entries.items() if entry[0] <= now]
+        for key in expired:
+            del self._entries[key]
+        if len(self._entries) >= self.maxsize:
+            self._entries.clear()
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+def current_identity():
+    """
+    Пользователь текущего запроса по JWT (без обращения к БД при попадании в кэш).
+    Возвращает Identity или None, если пользователь удален.
+    """
+    claims = get_jwt()
+    if claims.get("reset_password"):
+        raise UnauthorizedError("Токен сброса пароля не подходит для этого запроса")
+    user_id = int(get_jwt_identity())
+    cached = current_app.identity_cache.get(user_id)
+    if cached is None:
+        return None
+    role, version = cached
+    # Токены, выданные до появления claims, проверяются только по кэшу
+    if "ver" in claims and claims["ver"] != version:
+        raise UnauthorizedError("Токен устарел, войдите заново")
+    return Identity(user_id, role, version)
+
+def revoke_identity(user):
+    """
+    Сделать недействительными токены пользователя (смена роли).
+    После commit вызывающий код сбрасывает кэш: forget_identity(user.id).
+    """
+    user.token_version = (user.token_version or 1) + 1
+
+def forget_identity(user_id):
+    """Сбросить запись кэша идентичности (после commit изменений пользователя)"""
+    current_app.identity_cache.invalidate(user_id)
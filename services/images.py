@@ -0,0 +1,229 @@
+"""
+Уменьшенные копии изображений для srcset
+
+После сохранения загруженного файла (товар, работа, аватар) пайплайн в
+пуле процессов строит копии нескольких ширин в WebP и JPEG: ориентация из
+EXIF применяется к пикселям, а сами метаданные не сохраняются. Копии лежат
+рядом с исходным файлом (<имя>.w<ширина>.webp|jpg), поэтому отдаются теми же
+маршрутами, а их пути и размеры записываются в image_variant. API товаров,
+работ и пользователей возвращают готовые для srcset наборы; пока копии не
+готовы, клиент использует исходный файл.
+"""
+import json
+import logging
+import multiprocessing
+import os
+import threading
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from PIL import Image, ImageOps
+from models import db, ImageVariant, Product, Work, User
+from services.media import media_abspath
+
+logger = logging.getLogger(__name__)
+
+# Форматы копий: (формат в БД, формат Pillow, расширение файла)
+VARIANT_FORMATS = (("webp", "WEBP", "webp"), ("jpeg", "JPEG", "jpg"))
+
+def build_variants(source_path, widths, quality):
+    """
+    Построить копии файла source_path (выполняется в процессе пула).
+    Ширины больше исходной пропускаются; если исходник уже меньше всех
+    ширин, строится одна копия исходного размера.
+    Возвращает [{"format", "width", "height", "filename"}].
+    """
+    directory = os.path.dirname(source_path)
+    stem = os.path.splitext(os.path.basename(source_path))[0]
+    variants = []
+    with Image.open(source_path) as original:
+        image = ImageOps.exif_transpose(original)
+        image.load()
+    has_alpha = image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info)
+    image = image.convert("RGBA" if has_alpha else "RGB")
+    targets = sorted({w for w in widths if w < image.width}) or [image.width]
+    for width in targets:
+        height = max(round(image.height * width / image.width), 1)
+        resized = image if width == image.width else image.resize((width, height), Image.LANCZOS)
+        for fmt, pil_format, ext in VARIANT_FORMATS:
+            frame = resized
+            if pil_format == "JPEG" and has_alpha:
+                frame = Image.new("RGB", resized.size, (255, 255, 255))
+                frame.paste(resized, mask=resized.getchannel("A"))
+            filename = f"{stem}.w{width}.{ext}"
+            # exif не передается - метаданные (в том числе геолокация) не попадают в копию
+            frame.save(os.path.join(directory, filename), pil_format, quality=quality, optimize=True)
+            variants.append({"format": fmt, "width": width, "height": height, "filename": filename})
+    return variants
+
+def render_resized(source_path, target_path, width, height, pil_format, quality):
+    """
+    Уменьшить source_path, чтобы он поместился в width x height (любой
+    размер может быть None), и записать в target_path без EXIF.
+    Изображение не увеличивается. Выполняется в процессе пула.
+    """
+    with Image.open(source_path) as original:
+        image = ImageOps.exif_transpose(original)
+        image.load()
+    has_alpha = image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info)
+    image = image.convert("RGBA" if has_alpha else "RGB")
+    image.thumbnail((width or image.width, height or image.height), Image.LANCZOS)
+    if pil_format == "JPEG" and has_alpha:
+        frame = Image.new("RGB", image.size, (255, 255, 255))
+        frame.paste(image, mask=image.getchannel("A"))
+        image = frame
+    image.save(target_path, pil_format, quality=quality, optimize=True)
+    return image.size
+
+def record_variants(source, variants):
+    """Заменить записи о копиях source (внутри контекста приложения)"""
+    ImageVariant.query.filter_by(source=source).delete(synchronize_session=False)
+    directory = os.path.dirname(source)
+    for variant in variants:
+        db.session.add(ImageVariant(
+            source=source,
+            format=variant["format"],
+            width=variant["width"],
+            height=variant["height"],
+            path=os.path.join(directory, variant["filename"])
+        ))
+    db.session.commit()
+
+class ImagePipeline:
+    """Построение копий в пуле процессов вне обработки запроса"""
+
+    def __init__(self, app):
+        self.app = app
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                # spawn: дочерние процессы не наследуют потоки и соединения приложения
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.app.config.get("IMAGE_WORKERS", 2),
+                    mp_context=multiprocessing.get_context("spawn")
+                )
+            return self._pool
+
+    def submit(self, source_path, source, widths=None):
+        """
+        Поставить построение копий файла source_path в очередь.
+        source - путь, под которым файл хранится в БД (static/products/...).
+        При IMAGE_WORKERS=0 копии строятся сразу.
+        """
+        config = self.app.config
+        widths = widths or config.get("IMAGE_VARIANT_WIDTHS", [320, 640, 1280])
+        quality = config.get("IMAGE_VARIANT_QUALITY", 80)
+        if config.get("IMAGE_WORKERS", 2) <= 0:
+            self._record(source, build_variants(source_path, widths, quality))
+            return None
+        future = self._get_pool().submit(build_variants, source_path, widths, quality)
+        future.add_done_callback(lambda done: self._finish(source, done))
+        return future
+
+    def run(self, fn, *args):
+        """Выполнить fn в пуле и дождаться результата (при IMAGE_WORKERS=0 - сразу)"""
+        if self.app.config.get("IMAGE_WORKERS", 2) <= 0:
+            return fn(*args)
+        return self._get_pool().submit(fn, *args).result()
+
+    def _finish(self, source, future):
+        try:
+            variants = future.result()
+        except Exception:
+            logger.exception("Не удалось построить копии изображения %s", source)
+            return
+        with self.app.app_context():
+            try:
+                self._record(source, variants)
+            except Exception:
+                db.session.rollback()
+                logger.exception("Не удалось сохранить копии изображения %s", source)
+
+    def _record(self, source, variants):
+        record_variants(source, variants)
+        if source.startswith("static/products/"):
+            # Закэшированные страницы каталога собраны без копий
+            from routes.catalog import invalidate_product_caches
+            invalidate_product_caches()
+
+def image_sets(sources, url_for_path=None):
+    """
+    Наборы копий для списка исходных путей одним запросом.
+    Возвращает {source: {"variants": [...], "srcset": {"webp": "...", "jpeg": "..."}}};
+    url_for_path превращает путь копии в URL (по умолчанию путь как есть).
+    """
+    sources = [source for source in dict.fromkeys(sources) if source]
+    if not sources:
+        return {}
+    url_for_path = url_for_path or (lambda path: path)
+    rows = ImageVariant.query.filter(ImageVariant.source.in_(sources)) \
+        .order_by(ImageVariant.source, ImageVariant.format, ImageVariant.width).all()
+    grouped = defaultdict(list)
+    for row in rows:
+        grouped[row.source].append(row)
+    result = {}
+    for source, variants in grouped.items():
+        srcset = defaultdict(list)
+        items = []
+        for row in variants:
+            url = url_for_path(row.path)
+            items.append({"url": url, "format": row.format, "width": row.width, "height": row.height})
+            srcset[row.format].append(f"{url} {row.width}w")
+        result[source] = {"variants": items, "srcset": {fmt: ", ".join(parts) for fmt, parts in srcset.items()}}
+    return result
+
+def image_set(source, url_for_path=None):
+    """Набор копий одного изображения или None"""
+    return image_sets([source], url_for_path).get(source)
+
+def _local_images():
+    """(путь в БД, абсолютный путь, ширины) для всех локальных изображений"""
+    config = current_app.config
+    widths = config.get("IMAGE_VARIANT_WIDTHS", [320, 640, 1280])
+    for image, images in db.session.query(Product.image, Product.images):
+        paths = [image]
+        try:
+            paths.extend(json.loads(images) if images else [])
+        except ValueError:
+            pass
+        for path in paths:
+            if path and path.startswith("static/"):
+                yield path, media_abspath(path), widths
+    for (image,) in db.session.query(Work.image):
+        if image and image.lstrip("/").startswith("static/"):
+            path = image.lstrip("/")
+            yield path, media_abspath(path), widths
+    avatar_widths = config.get("IMAGE_AVATAR_WIDTHS", [64, 128, 256])
+    for (avatar,) in db.session.query(User.avatar).filter(User.avatar.isnot(None)):
+        if avatar.startswith("static/"):
+            yield avatar, media_abspath(avatar), avatar_widths
+
+@click.command("images-variants")
+@click.option("--force", is_flag=True, help="Перестроить копии, даже если они уже есть")
+@with_appcontext
+def images_variants_command(force):
+    """Построить копии для уже загруженных изображений"""
+    done = set() if force else {source for (source,) in db.session.query(ImageVariant.source).distinct()}
+    pending = [
+        (source, path, widths) for source, path, widths in _local_images()
+        if source not in done and os.path.isfile(path)
+    ]
+    pending = list({source: (source, path, widths) for source, path, widths in pending}.values())
+    config = current_app.config
+    quality = config.get("IMAGE_VARIANT_QUALITY", 80)
+    workers = max(config.get("IMAGE_WORKERS", 2), 1)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = [(source, pool.submit(build_variants, path, widths, quality)) for source, path, widths in pending]
+        for source, future in futures:
+            try:
+                record_variants(source, future.result())
+            except Exception as e:
+                db.session.rollback()
+                click.echo(f"{source}: {e}")
+    click.echo(f"Обработано изображений: {len(pending)}")
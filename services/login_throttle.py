@@ -0,0 +1,80 @@
+"""
+Ограничение попыток входа
+
+Неудачные попытки считаются отдельно по email и по IP в общем кэше
+приложения (при Redis-кэше - общие для всех воркеров). После
+LOGIN_THROTTLE_EMAIL_FREE_ATTEMPTS (или LOGIN_THROTTLE_IP_FREE_ATTEMPTS)
+неудач ключ блокируется, и срок блокировки удваивается с каждой следующей
+неудачей до LOGIN_THROTTLE_MAX_DELAY. Заблокированная попытка отклоняется
+до поиска пользователя и проверки хэша, поэтому перебор не нагружает
+пул хэширования паролей.
+
+Счетчик неудач увеличивается атомарно (inc хранилища кэша, в Redis - INCRBY) и
+живет LOGIN_THROTTLE_WINDOW секунд с первой неудачи, а срок блокировки
+хранится в отдельном ключе, поэтому одновременные неудачные попытки не
+теряют друг друга.
+"""
+import hashlib
+import time
+from math import ceil
+
+from flask import current_app
+from errors import TooManyRequestsError
+from services.outbox import backoff_delay
+
+def _keys(email, ip):
+    digest = hashlib.sha1(email.strip().lower().encode()).hexdigest()
+    return (
+        (f"email:{digest}", "LOGIN_THROTTLE_EMAIL_FREE_ATTEMPTS", 5),
+        (f"ip:{ip}", "LOGIN_THROTTLE_IP_FREE_ATTEMPTS", 20),
+    )
+
+def check_login_allowed(email, ip):
+    """Выбросить TooManyRequestsError, если email или IP сейчас заблокированы"""
+    cache = current_app.cache
+    now = time.time()
+    retry_after = 0
+    for key, _, _ in _keys(email, ip):
+        locked_until = cache.get(f"login_lock:{key}")
+        if locked_until and locked_until > now:
+            retry_after = max(retry_after, locked_until - now)
+    if retry_after:
+        raise TooManyRequestsError(
+            "Слишком много неудачных попыток входа. Повторите позже",
+            retry_after=ceil(retry_after)
+        )
+
+def record_login_failure(email, ip):
+    """Учесть неудачную попытку и при необходимости продлить блокировку"""
+    config = current_app.config
+    cache = current_app.cache
+    backend = cache.cache  # inc есть только у хранилища, не у обертки Flask-Caching
+    now = time.time()
+    window = config.get("LOGIN_THROTTLE_WINDOW", 3600)
+    for key, free_setting, free_default in _keys(email, ip):
+        fail_key, lock_key = f"login_fail:{key}", f"login_lock:{key}"
+        # Срок жизни задает первая неудача окна; inc его не продлевает
+        backend.add(fail_key, 0, timeout=window)
+        failures = backend.inc(fail_key)
+        if failures is None:
+            continue
+        over = failures - config.get(free_setting, free_default)
+        if over < 0:
+            continue
+        delay = backoff_delay(
+            over + 1,
+            config.get("LOGIN_THROTTLE_BASE_DELAY", 2),
+            config.get("LOGIN_THROTTLE_MAX_DELAY", 900)
+        )
+        # Параллельная неудача могла уже записать более позднюю блокировку
+        if now + delay > (cache.get(lock_key) or 0):
+            cache.set(lock_key, now + delay, timeout=int(delay) + 1)
+
+def reset_login_failures(email):
+    """
+    Сбросить счетчик email после успешного входа.
+    Счетчик IP не сбрасывается: иначе перебор чужих аккаунтов можно
+    перемежать входами в свой.
+    """
+    key = _keys(email, "")[0][0]
+    current_app.cache.delete_many(f"login_fail:{key}", f"login_lock:{key}")
@@ -0,0 +1,217 @@
+"""
+Очередь исходящих писем
+
+Запрос только добавляет письмо в таблицу outbound_email (в своей
+транзакции), а фоновый отправитель забирает письма пачками и отправляет их
+через одно SMTP-соединение, которое переиспользуется между пачками. Ошибки
+доставки повторяются с экспоненциальной задержкой, статус и последняя
+ошибка сохраняются в строке письма. Тело письма с секретом (sensitive,
+например код восстановления) стирается, как только письмо отправлено или
+окончательно не доставлено, а сама строка удаляется через
+MAIL_SENSITIVE_RETENTION_MINUTES.
+"""
+import logging
+import smtplib
+import socket
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from models import db, OutboundEmail
+from services.outbox import backoff_delay
+from services.runner import BackgroundRunner
+
+logger = logging.getLogger(__name__)
+
+# Ошибки SMTP, после которых повтор не поможет (адрес отклонен сервером)
+PERMANENT_ERRORS = (smtplib.SMTPRecipientsRefused,)
+# Ошибки, после которых соединение непригодно и открывается заново
+CONNECTION_ERRORS = (smtplib.SMTPServerDisconnected, ConnectionError, socket.timeout)
+
+def enqueue_email(recipient, subject, body, sensitive=False):
+    """
+    Поставить письмо в очередь (commit выполняет вызывающий код).
+    sensitive=True - тело содержит секрет и не хранится после отправки.
+    """
+    email = OutboundEmail(recipient=recipient, subject=subject, body=body, sensitive=sensitive)
+    db.session.add(email)
+    return email
+
+class MailDispatcher(BackgroundRunner):
+    """Пакетная отправка писем из очереди через переиспользуемое SMTP-соединение"""
+
+    name = "mail-dispatcher"
+    interval_key = "MAIL_POLL_INTERVAL"
+    default_interval = 2
+    error_message = "Ошибка отправителя писем"
+
+    def __init__(self, app):
+        super().__init__(app)
+        self._smtp = None
+
+    def _connect(self, config):
+        host, port, timeout = config["MAIL_SERVER"], config.get("MAIL_PORT", 25), config.get("MAIL_TIMEOUT", 10)
+        if config.get("MAIL_USE_SSL"):
+            smtp = smtplib.SMTP_SSL(host, port, timeout=timeout)
+        else:
+            smtp = smtplib.SMTP(host, port, timeout=timeout)
+            if config.get("MAIL_USE_TLS"):
+                smtp.starttls()
+        if config.get("MAIL_USERNAME"):
+            smtp.login(config["MAIL_USERNAME"], config.get("MAIL_PASSWORD") or "")
+        return smtp
+
+    def _connection(self, config):
+        """Открытое соединение: переиспользуем, если сервер отвечает на NOOP"""
+        if self._smtp is not None:
+            try:
+                if self._smtp.noop()[0] == 250:
+                    return self._smtp
+            except (smtplib.SMTPException, OSError):
+                pass
+            self.close()
+        self._smtp = self._connect(config)
+        return self._smtp
+
+    def close(self):
+        if self._smtp is None:
+            return
+        try:
+            self._smtp.quit()
+        except Exception:
+            # Сервер уже не отвечает - просто закрываем сокет
+            try:
+                self._smtp.close()
+            except Exception:
+                pass
+        self._smtp = None
+
+    def _message(self, email, sender):
+        message = EmailMessage()
+        message["From"] = sender
+        message["To"] = email.recipient
+        message["Subject"] = email.subject
+        message.set_content(email.body)
+        return message
+
+    def _retry(self, email, error, config, now):
+        email.attempts = (email.attempts or 0) + 1
+        email.last_error = error[:1000]
+        if email.attempts >= config.get("MAIL_MAX_ATTEMPTS", 8):
+            email.status = "failed"
+        else:
+            delay = backoff_delay(
+                email.attempts,
+                config.get("MAIL_BACKOFF_BASE", 10),
+                config.get("MAIL_BACKOFF_MAX", 3600)
+            )
+            email.next_attempt_at = now + timedelta(seconds=delay)
+
+    def send_batch(self):
+        """
+        Отправить одну пачку готовых писем.
+        Должен вызываться внутри контекста приложения.
+        Возвращает количество отправленных писем.
+        """
+        config = current_app.config
+        if not config.get("MAIL_SERVER"):
+            return 0
+
+        now = datetime.utcnow()
+        query = OutboundEmail.query.filter(
+            OutboundEmail.status == "pending",
+            OutboundEmail.next_attempt_at <= now
+        ).order_by(OutboundEmail.id).limit(config.get("MAIL_BATCH_SIZE", 50))
+        # Несколько отправителей не должны забирать одни и те же письма
+        if db.engine.dialect.name != "sqlite":
+            query = query.with_for_update(skip_locked=True)
+        emails = query.all()
+        if not emails:
+            db.session.rollback()
+            self.close()  # нет писем - не держим соединение открытым
+            return 0
+
+        try:
+            smtp = self._connection(config)
+        except (smtplib.SMTPException, OSError) as exc:
+            logger.warning("Нет соединения с SMTP-сервером: %s", exc)
+            for email in emails:
+                self._retry(email, f"connect: {exc}", config, now)
+            db.session.commit()
+            return 0
+
+        sender = config.get("MAIL_DEFAULT_SENDER")
+        sent = 0
+        for email in emails:
+            try:
+                smtp.send_message(self._message(email, sender))
+            except PERMANENT_ERRORS as exc:
+                email.attempts = (email.attempts or 0) + 1
+                email.status = "failed"
+                email.last_error = str(exc)[:1000]
+            except CONNECTION_ERRORS as exc:
+                # Соединение потеряно: остальные письма пачки - в следующий раз
+                self._retry(email, str(exc), config, now)
+                self.close()
+                break
+            except (smtplib.SMTPException, OSError) as exc:
+                # Сервер отклонил это письмо, соединение остается рабочим
+                self._retry(email, str(exc), config, now)
+            else:
+                email.status = "sent"
+                email.sent_at = datetime.utcnow()
+                email.last_error = None
+                sent += 1
+        for email in emails:
+            if email.sensitive and email.status != "pending":
+                email.body = ""
+        db.session.commit()
+        return sent
+
+    def purge_sent(self):
+        """
+        Удалить отправленные письма старше MAIL_RETENTION_DAYS и письма с
+        секретом старше MAIL_SENSITIVE_RETENTION_MINUTES (в любом статусе:
+        неотправленный код к этому времени уже истек)
+        """
+        config = current_app.config
+        now = datetime.utcnow()
+        border = now - timedelta(days=config.get("MAIL_RETENTION_DAYS", 7))
+        deleted = OutboundEmail.query.filter(
+            OutboundEmail.status == "sent",
+            OutboundEmail.sent_at < border
+        ).delete(synchronize_session=False)
+        sensitive_border = now - timedelta(minutes=config.get("MAIL_SENSITIVE_RETENTION_MINUTES", 60))
+        deleted += OutboundEmail.query.filter(
+            OutboundEmail.sensitive.is_(True),
+            OutboundEmail.created_at < sensitive_border
+        ).delete(synchronize_session=False)
+        db.session.commit()
+        return deleted
+
+    def run_once(self):
+        """Отправить пачку; полная пачка - сразу следующая, иначе очистка и ожидание"""
+        batch_size = self.app.config.get("MAIL_BATCH_SIZE", 50)
+        sent = self.send_batch()
+        if sent < batch_size:
+            self.purge_sent()
+        return sent >= batch_size
+
+    def on_exit(self):
+        self.close()
+
+@click.command("mail-dispatch")
+@click.option("--once", is_flag=True, help="Отправить одну пачку и выйти")
+@with_appcontext
+def mail_dispatch_command(once):
+    """Запустить отправителя писем из очереди"""
+    dispatcher = MailDispatcher(current_app._get_current_object())
+    if once:
+        try:
+            click.echo(f"Отправлено писем: {dispatcher.send_batch()}")
+        finally:
+            dispatcher.close()
+        return
+    dispatcher.run_forever()
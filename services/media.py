@@ -0,0 +1,276 @@
+"""
+Хранилище загруженных файлов по хэшу содержимого
+
+Загрузка записывается во временный файл с одновременным подсчетом SHA-256 и
+переносится в static/<вид>/ab/cd/<sha256>.<ext> (два уровня каталогов по
+первым байтам хэша, чтобы в одном каталоге не было десятков тысяч файлов).
+Если файл с таким хэшем уже есть, новая копия не сохраняется: одно и то же
+фото ткани для нескольких расцветок хранится один раз. Содержимое по такому
+пути никогда не меняется, поэтому его можно кэшировать как immutable.
+
+Каждая ссылка на файл из товара, работы или аватара учитывается в
+media_blob.ref_count: маршруты вызывают retain_media/release_media в той же
+транзакции, что и изменение ссылки. Файлы без ссылок (и их копии для srcset)
+удаляет команда media-gc не раньше MEDIA_GC_GRACE_SECONDS после последнего
+изменения, чтобы не удалить файл, который параллельная загрузка только что
+нашла по хэшу. Перед удалением счетчики сверяются с фактическими ссылками.
+Счетчик увеличивается одним upsert, а сверка и удаление - условными
+UPDATE/DELETE: строка, которую параллельная транзакция успела изменить,
+пропускается до следующего запуска, и файл удаляется, только если удалена
+его строка.
+"""
+import hashlib
+import json
+import os
+import re
+import tempfile
+import time
+from collections import Counter, namedtuple
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import delete, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from models import db, MediaBlob, ImageVariant, Product, Work, User
+
+CHUNK_SIZE = 64 * 1024
+
+# Имя файла в хранилище: <sha256>.<ext>
+CONTENT_NAME = re.compile(r"^[0-9a-f]{64}\.[a-z0-9]+$")
+
+StoredMedia = namedtuple("StoredMedia", "stored path created")
+
+_UPSERT_DIALECTS = {"sqlite": sqlite, "postgresql": postgresql}
+
+# Виды загрузок: каталог в БД -> ключ настроек с каталогом на диске
+MEDIA_FOLDERS = {"avatars": "UPLOAD_FOLDER", "products": "PRODUCTS_UPLOAD_FOLDER", "works": "WORKS_UPLOAD_FOLDER"}
+
+def upload_folder(kind):
+    """Каталог загрузок вида kind (avatars, products, works)"""
+    folder = current_app.config.get(MEDIA_FOLDERS[kind])
+    if not folder:
+        folder = os.path.join(os.path.dirname(current_app.config['UPLOAD_FOLDER']), kind)
+    return folder
+
+def media_abspath(stored):
+    """Путь на диске для пути из БД (static/<вид>/...)"""
+    parts = stored.lstrip("/").split("/")
+    if len(parts) > 2 and parts[0] == "static" and parts[1] in MEDIA_FOLDERS:
+        return os.path.join(upload_folder(parts[1]), *parts[2:])
+    return os.path.join(current_app.root_path, stored)
+
+def content_relpath(digest, ext):
+    """Путь файла внутри каталога вида: ab/cd/<sha256>.<ext>"""
+    return "/".join((digest[:2], digest[2:4], f"{digest}.{ext}"))
+
+def is_content_addressed(path):
+    """Имя файла - хэш содержимого (его можно кэшировать навсегда)"""
+    return bool(CONTENT_NAME.match(os.path.basename(path or "")))
+
+def store_stream(stream, folder, prefix, ext):
+    """
+    Сохранить поток в каталог folder по хэшу содержимого.
+    prefix - путь каталога в БД (static/products), ext - расширение без точки.
+    Возвращает StoredMedia(stored, path, created); created=False, если такой
+    файл уже был сохранен раньше.
+    """
+    os.makedirs(folder, exist_ok=True)
+    digest = hashlib.sha256()
+    fd, tmp_path = tempfile.mkstemp(dir=folder, prefix=".upload-")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            for chunk in iter(lambda: stream.read(CHUNK_SIZE), b""):
+                digest.update(chunk)
+                out.write(chunk)
+        relpath = content_relpath(digest.hexdigest(), ext.lower())
+        path = os.path.join(folder, *relpath.split("/"))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        created = not os.path.exists(path)
+        if created:
+            # Атомарная замена: параллельная загрузка того же файла запишет те же байты
+            os.replace(tmp_path, path)
+        else:
+            # Найденный по хэшу файл снова используется - media-gc отсчитывает срок заново
+            os.utime(path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return StoredMedia(f"{prefix}/{relpath}", path, created)
+
+def store_file(source, folder, prefix):
+    """Сохранить локальный файл source по хэшу содержимого"""
+    ext = source.rsplit(".", 1)[-1] if "." in os.path.basename(source) else "bin"
+    with open(source, "rb") as f:
+        return store_stream(f, folder, prefix, ext)
+
+def _blob_values(stored, ref_count):
+    absolute = media_abspath(stored)
+    return {
+        "path": stored,
+        "sha256": os.path.basename(stored).split(".", 1)[0],
+        "size": os.path.getsize(absolute) if os.path.exists(absolute) else 0,
+        "ref_count": ref_count
+    }
+
+def retain_media(stored):
+    """Учесть новую ссылку на файл (без commit, в транзакции вызывающего)"""
+    if not is_content_addressed(stored):
+        return
+    now = datetime.utcnow()
+    dialect = _UPSERT_DIALECTS.get(db.session.get_bind().dialect.name)
+    if dialect is not None:
+        stmt = dialect.insert(MediaBlob).values(**_blob_values(stored, 1), updated_at=now)
+        db.session.execute(stmt.on_conflict_do_update(
+            index_elements=["path"],
+            set_={"ref_count": MediaBlob.ref_count + 1, "updated_at": now}
+        ))
+        return
+    increment = (
+        update(MediaBlob)
+        .where(MediaBlob.path == stored)
+        .values(ref_count=MediaBlob.ref_count + 1, updated_at=now)
+    )
+    if db.session.execute(increment).rowcount:
+        return
+    try:
+        # Параллельная транзакция могла создать строку после UPDATE
+        with db.session.begin_nested():
+            db.session.execute(MediaBlob.__table__.insert().values(**_blob_values(stored, 1), updated_at=now))
+    except IntegrityError:
+        db.session.execute(increment)
+
+def _insert_missing_blob(stored, ref_count):
+    """Создать строку для файла со ссылками, но без записи (если ее еще нет)"""
+    values = _blob_values(stored, ref_count)
+    dialect = _UPSERT_DIALECTS.get(db.session.get_bind().dialect.name)
+    if dialect is not None:
+        db.session.execute(dialect.insert(MediaBlob).values(**values).on_conflict_do_nothing(index_elements=["path"]))
+        return
+    try:
+        with db.session.begin_nested():
+            db.session.execute(MediaBlob.__table__.insert().values(**values))
+    except IntegrityError:
+        pass
+
+def release_media(*paths):
+    """Снять ссылки на файлы (без commit); файл удалит media-gc"""
+    for stored in paths:
+        if not is_content_addressed(stored):
+            continue
+        db.session.execute(
+            update(MediaBlob)
+            .where(MediaBlob.path == stored, MediaBlob.ref_count > 0)
+            .values(ref_count=MediaBlob.ref_count - 1, updated_at=datetime.utcnow())
+        )
+
+def product_media(image, images):
+    """Пути файлов товара: основное изображение и галерея (JSON)"""
+    paths = [image] if image else []
+    try:
+        paths.extend(json.loads(images) if images else [])
+    except ValueError:
+        pass
+    return [path for path in paths if path]
+
+def count_references():
+    """Фактическое число ссылок на каждый файл хранилища"""
+    references = Counter()
+    for image, images in db.session.query(Product.image, Product.images):
+        references.update(path for path in product_media(image, images) if is_content_addressed(path))
+    for (image,) in db.session.query(Work.image):
+        if is_content_addressed(image):
+            references[image.lstrip("/")] += 1
+    for (avatar,) in db.session.query(User.avatar).filter(User.avatar.isnot(None)):
+        if is_content_addressed(avatar):
+            references[avatar] += 1
+    return references
+
+def _remove_with_variants(path):
+    """Удалить файл хранилища и его копии для srcset (<sha256>.w<ширина>.<ext>)"""
+    directory = os.path.dirname(path)
+    stem = os.path.basename(path).split(".", 1)[0]
+    removed = 0
+    if os.path.isdir(directory):
+        for name in os.listdir(directory):
+            if name == os.path.basename(path) or name.startswith(f"{stem}.w"):
+                os.remove(os.path.join(directory, name))
+                removed += 1
+    return removed
+
+def collect_media(grace_seconds=None):
+    """
+    Удалить файлы без ссылок: сверить ref_count с фактическими ссылками,
+    удалить файлы с нулевым счетчиком старше grace_seconds, а также файлы
+    на диске без записи в media_blob (оборванные загрузки).
+    Возвращает число удаленных файлов хранилища.
+    """
+    config = current_app.config
+    if grace_seconds is None:
+        grace_seconds = config.get("MEDIA_GC_GRACE_SECONDS", 3600)
+    cutoff = datetime.utcnow() - timedelta(seconds=grace_seconds)
+
+    # Сверка: счетчик меняется, только если с момента чтения его никто не изменил
+    counts = dict(db.session.query(MediaBlob.path, MediaBlob.ref_count))
+    references = count_references()
+    for stored, count in references.items():
+        if stored not in counts:
+            _insert_missing_blob(stored, count)
+    for stored, observed in counts.items():
+        count = references.get(stored, 0)
+        if observed != count:
+            db.session.execute(
+                update(MediaBlob)
+                .where(MediaBlob.path == stored, MediaBlob.ref_count == observed)
+                .values(ref_count=count, updated_at=datetime.utcnow())
+            )
+    db.session.commit()
+
+    removed = 0
+    orphans = db.session.query(MediaBlob.id, MediaBlob.path).filter(
+        MediaBlob.ref_count == 0, MediaBlob.updated_at < cutoff
+    ).all()
+    for blob_id, stored in orphans:
+        # Файл удаляется, только если строку удалили мы: параллельная ссылка ее сохранит
+        deleted = db.session.execute(
+            delete(MediaBlob)
+            .where(MediaBlob.id == blob_id, MediaBlob.ref_count == 0, MediaBlob.updated_at < cutoff)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if deleted != 1:
+            db.session.rollback()
+            continue
+        ImageVariant.query.filter_by(source=stored).delete(synchronize_session=False)
+        db.session.commit()
+        _remove_with_variants(media_abspath(stored))
+        removed += 1
+
+    # Файлы без записи: загрузка сохранила файл, но транзакция не завершилась
+    known = {row[0] for row in db.session.query(MediaBlob.path)}
+    threshold = time.time() - grace_seconds
+    for kind in MEDIA_FOLDERS:
+        prefix, folder = f"static/{kind}", upload_folder(kind)
+        if not os.path.isdir(folder):
+            continue
+        for directory, _, names in os.walk(folder):
+            for name in names:
+                path = os.path.join(directory, name)
+                if not CONTENT_NAME.match(name) or os.path.getmtime(path) > threshold:
+                    continue
+                stored = prefix + "/" + os.path.relpath(path, folder).replace(os.sep, "/")
+                if stored not in known and not db.session.query(MediaBlob.id).filter_by(path=stored).first():
+                    _remove_with_variants(path)
+                    ImageVariant.query.filter_by(source=stored).delete(synchronize_session=False)
+                    removed += 1
+    db.session.commit()
+    return removed
+
+@click.command("media-gc")
+@click.option("--grace-seconds", type=int, default=None, help="Не удалять файлы, измененные позже этого срока")
+@with_appcontext
+def media_gc_command(grace_seconds):
+    """Удалить загруженные файлы, на которые больше нет ссылок"""
+    removed = collect_media(grace_seconds)
+    click.echo(f"Удалено файлов: {removed}")
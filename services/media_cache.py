@@ -0,0 +1,151 @@
+"""
+Дисковый LRU-кэш изображений, уменьшенных по запросу
+
+Копия строится из исходного файла при первом запросе /media/<путь>?w=&h=&fmt=
+и записывается в MEDIA_RESIZE_CACHE_DIR (атомарно: временный файл и
+os.replace), следующие запросы отдают готовый файл. Время последнего
+использования - mtime файла: попадание в кэш обновляет его не чаще раза в
+минуту, а при превышении MEDIA_RESIZE_CACHE_BYTES удаляются давно не
+использованные копии, пока размер не опустится до 90% лимита.
+
+Одновременные запросы одной копии в процессе объединяются: строит первый,
+остальные ждут его результат. Между процессами копия может быть построена
+дважды, но запись атомарна, поэтому файл в кэше всегда целый.
+"""
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+# Как часто (в секундах) обновлять mtime копии при попадании
+TOUCH_INTERVAL = 60
+
+def cache_key(*parts):
+    """Ключ копии: SHA-256 от пути источника, его версии и параметров"""
+    return hashlib.sha256("\0".join(str(part) for part in parts).encode()).hexdigest()
+
+class DiskLRU:
+    """Ограниченный по размеру каталог файлов с вытеснением по mtime"""
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._size = None  # оценка размера; пересчитывается при вытеснении
+        self._inflight = {}
+
+    def path(self, key, ext):
+        """Путь копии: ab/<key>.<ext>"""
+        return os.path.join(self.directory, key[:2], f"{key}.{ext}")
+
+    def get(self, key, ext):
+        """Путь готовой копии или None"""
+        path = self.path(key, ext)
+        try:
+            mtime = os.stat(path).st_mtime
+        except FileNotFoundError:
+            return None
+        now = time.time()
+        if now - mtime > TOUCH_INTERVAL:
+            try:
+                os.utime(path, (now, now))
+            except OSError:
+                pass
+        return path
+
+    def get_or_create(self, key, ext, render):
+        """
+        Путь копии; при промахе ее строит render(tmp_path) - один вызов на
+        ключ в процессе, одновременные запросы ждут его результат.
+        """
+        path = self.get(key, ext)
+        if path is not None:
+            return path
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+        if not leader:
+            return future.result()
+        try:
+            path = self.get(key, ext) or self._create(key, ext, render)
+            future.set_result(path)
+            return path
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def _create(self, key, ext, render):
+        path = self.path(key, ext)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".render-", suffix=f".{ext}")
+        os.close(fd)
+        try:
+            render(tmp_path)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self._added(os.path.getsize(path))
+        return path
+
+    def _added(self, size):
+        with self._lock:
+            if self._size is None:
+                self._size = self.usage()
+            else:
+                self._size += size
+            over = self._size > self.max_bytes
+        if over:
+            self.evict()
+
+    def usage(self):
+        """Суммарный размер копий на диске"""
+        total = 0
+        for directory, _, names in os.walk(self.directory):
+            for name in names:
+                try:
+                    total += os.path.getsize(os.path.join(directory, name))
+                except OSError:
+                    pass
+        return total
+
+    def evict(self, target=None):
+        """Удалять давно не использованные копии, пока размер больше target (90% лимита)"""
+        target = int(self.max_bytes * 0.9) if target is None else target
+        entries = []
+        for directory, _, names in os.walk(self.directory):
+            for name in names:
+                if name.startswith("."):
+                    continue
+                path = os.path.join(directory, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, path in sorted(entries):
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+                removed += 1
+            except OSError:
+                pass
+        with self._lock:
+            self._size = total
+        if removed:
+            logger.info("Кэш изображений: удалено копий %s, размер %s байт", removed, total)
+        return removed
@@ -0,0 +1,162 @@
+"""
+Transactional outbox для событий заказов
+
+События записываются в таблицу outbox_event в той же транзакции, что и
+изменение заказа, поэтому не теряются и не публикуются для откаченных
+изменений. Диспетчер в фоне пачками доставляет их на вебхуки из
+OUTBOX_WEBHOOKS. Семантика at-least-once: получатель должен быть
+идемпотентен по id события.
+"""
+import json
+import logging
+from datetime import datetime, timedelta
+
+import click
+import requests
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import insert
+from models import db, OutboxEvent
+from services.runner import BackgroundRunner
+
+logger = logging.getLogger(__name__)
+
+def enqueue_event(event_type, aggregate_id, data):
+    """Добавить событие в outbox (commit выполняет вызывающий код)"""
+    event = OutboxEvent(
+        event_type=event_type,
+        aggregate_id=aggregate_id,
+        payload=json.dumps(data, ensure_ascii=False, default=str)
+    )
+    db.session.add(event)
+    return event
+
+def enqueue_events(event_type, items):
+    """Массово добавить события [(aggregate_id, data), ...] одним INSERT"""
+    if not items:
+        return
+    db.session.execute(insert(OutboxEvent), [
+        {
+            "event_type": event_type,
+            "aggregate_id": aggregate_id,
+            "payload": json.dumps(data, ensure_ascii=False, default=str)
+        }
+        for aggregate_id, data in items
+    ])
+
+def backoff_delay(attempts, base, maximum):
+    """Экспоненциальная задержка перед повторной попыткой, в секундах"""
+    return min(maximum, base * (2 ** max(attempts - 1, 0)))
+
+class OutboxDispatcher(BackgroundRunner):
+    """Пакетная доставка событий из outbox на вебхуки"""
+
+    name = "outbox-dispatcher"
+    interval_key = "OUTBOX_POLL_INTERVAL"
+    default_interval = 2
+    error_message = "Ошибка диспетчера outbox"
+
+    def __init__(self, app):
+        super().__init__(app)
+        self.http = requests.Session()  # переиспользуем соединения между пачками
+
+    def dispatch_batch(self):
+        """
+        Доставить одну пачку готовых к отправке событий.
+        Должен вызываться внутри контекста приложения.
+        Возвращает количество доставленных событий.
+        """
+        config = current_app.config
+        webhooks = config.get("OUTBOX_WEBHOOKS") or []
+        if not webhooks:
+            return 0
+
+        now = datetime.utcnow()
+        query = OutboxEvent.query.filter(
+            OutboxEvent.status == "pending",
+            OutboxEvent.next_attempt_at <= now
+        ).order_by(OutboxEvent.id).limit(config.get("OUTBOX_BATCH_SIZE", 100))
+        # Несколько диспетчеров не должны забирать одни и те же строки
+        if db.engine.dialect.name != "sqlite":
+            query = query.with_for_update(skip_locked=True)
+        events = query.all()
+        if not events:
+            db.session.rollback()
+            return 0
+
+        body = {
+            "events": [
+                {
+                    "id": event.id,
+                    "type": event.event_type,
+                    "aggregate_id": event.aggregate_id,
+                    "created_at": event.created_at.isoformat() if event.created_at else None,
+                    "data": json.loads(event.payload)
+                }
+                for event in events
+            ]
+        }
+
+        error = None
+        for url in webhooks:
+            try:
+                response = self.http.post(url, json=body, timeout=config.get("OUTBOX_WEBHOOK_TIMEOUT", 5))
+                response.raise_for_status()
+            except requests.RequestException as exc:
+                error = f"{url}: {exc}"
+                break
+
+        if error is None:
+            for event in events:
+                event.status = "delivered"
+                event.delivered_at = now
+                event.last_error = None
+            db.session.commit()
+            return len(events)
+
+        logger.warning("Не удалось доставить %d событий outbox: %s", len(events), error)
+        max_attempts = config.get("OUTBOX_MAX_ATTEMPTS", 10)
+        for event in events:
+            event.attempts = (event.attempts or 0) + 1
+            event.last_error = error[:1000]
+            if event.attempts >= max_attempts:
+                event.status = "failed"
+            else:
+                delay = backoff_delay(
+                    event.attempts,
+                    config.get("OUTBOX_BACKOFF_BASE", 5),
+                    config.get("OUTBOX_BACKOFF_MAX", 3600)
+                )
+                event.next_attempt_at = now + timedelta(seconds=delay)
+        db.session.commit()
+        return 0
+
+    def purge_delivered(self):
+        """Удалить доставленные события старше OUTBOX_RETENTION_DAYS"""
+        days = current_app.config.get("OUTBOX_RETENTION_DAYS", 7)
+        border = datetime.utcnow() - timedelta(days=days)
+        deleted = OutboxEvent.query.filter(
+            OutboxEvent.status == "delivered",
+            OutboxEvent.delivered_at < border
+        ).delete(synchronize_session=False)
+        db.session.commit()
+        return deleted
+
+    def run_once(self):
+        """Отправить пачку; полная пачка - сразу следующая, иначе очистка и ожидание"""
+        batch_size = self.app.config.get("OUTBOX_BATCH_SIZE", 100)
+        delivered = self.dispatch_batch()
+        if delivered < batch_size:
+            self.purge_delivered()
+        return delivered >= batch_size
+
+@click.command("outbox-dispatch")
+@click.option("--once", is_flag=True, help="Отправить одну пачку и выйти")
+@with_appcontext
+def outbox_dispatch_command(once):
+    """Запустить диспетчер outbox-событий"""
+    dispatcher = OutboxDispatcher(current_app._get_current_object())
+    if once:
+        click.echo(f"Доставлено событий: {dispatcher.dispatch_batch()}")
+        return
+    dispatcher.run_forever()
@@ -0,0 +1,105 @@
+"""
+Хэширование паролей в отдельном пуле процессов
+
+PBKDF2/scrypt намеренно дорогие по CPU. Чтобы всплеск входов не занимал
+потоки, обслуживающие каталог, хэширование выполняется в пуле из
+PASSWORD_HASH_WORKERS процессов (один пул на процесс приложения). Очередь
+ограничена PASSWORD_HASH_MAX_PENDING задачами: если место не освободилось
+за PASSWORD_HASH_QUEUE_TIMEOUT секунд, запрос получает 503. Алгоритм и
+стоимость задаются PASSWORD_HASH_METHOD в формате werkzeug; хэши со
+старыми параметрами пересчитываются при успешном входе.
+"""
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from flask import current_app, has_app_context
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, generate_password_hash, check_password_hash
+from errors import ServiceUnavailableError
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_METHOD = "pbkdf2:sha256:600000"
+
+# Параметры, которые werkzeug подставляет, если они не указаны в методе
+SCRYPT_DEFAULTS = (2 ** 15, 8, 1)  # n, r, p
+
+_pool = None
+_slots = None
+_pool_lock = threading.Lock()
+
+def _hash(password, method):
+    return generate_password_hash(password, method=method)
+
+def _verify(pwhash, password):
+    return check_password_hash(pwhash, password)
+
+def _config(name, default):
+    return current_app.config.get(name, default) if has_app_context() else default
+
+def _get_pool(workers, max_pending):
+    global _pool, _slots
+    with _pool_lock:
+        if _pool is None:
+            # spawn: дочерние процессы не наследуют потоки и соединения приложения
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+            _slots = threading.BoundedSemaphore(max_pending)
+        return _pool, _slots
+
+def _reset_pool():
+    global _pool
+    with _pool_lock:
+        _pool = None
+
+def _run(fn, *args):
+    """Выполнить fn в пуле процессов с ограничением очереди (или в текущем потоке при workers=0)"""
+    workers = _config("PASSWORD_HASH_WORKERS", 0)
+    if workers <= 0:
+        return fn(*args)
+    pool, slots = _get_pool(workers, _config("PASSWORD_HASH_MAX_PENDING", 32))
+    if not slots.acquire(timeout=_config("PASSWORD_HASH_QUEUE_TIMEOUT", 5)):
+        raise ServiceUnavailableError("Сервер перегружен, повторите попытку позже")
+    try:
+        return pool.submit(fn, *args).result()
+    except BrokenProcessPool:
+        logger.exception("Пул хэширования паролей упал, пересоздаем")
+        _reset_pool()
+        return fn(*args)
+    finally:
+        slots.release()
+
+def hash_method():
+    """Текущий алгоритм и стоимость хэширования (формат werkzeug)"""
+    return _config("PASSWORD_HASH_METHOD", DEFAULT_METHOD)
+
+def hash_password(password):
+    return _run(_hash, password, hash_method())
+
+def verify_password(pwhash, password):
+    if not pwhash:
+        return False
+    return _run(_verify, pwhash, password)
+
+def parse_method(method):
+    """
+    Алгоритм и параметры метода werkzeug с подставленными значениями по
+    умолчанию: "pbkdf2" -> ("pbkdf2", "sha256", 600000),
+    "scrypt:16384" -> ("scrypt", 16384, 8, 1)
+    """
+    name, *args = method.split(":")
+    if name == "pbkdf2":
+        return name, args[0] if args else "sha256", int(args[1]) if len(args) > 1 else DEFAULT_PBKDF2_ITERATIONS
+    if name == "scrypt":
+        return (name, *(int(value) for value in args), *SCRYPT_DEFAULTS[len(args):])
+    return (name, *args)
+
+def needs_rehash(pwhash):
+    """Хэш создан с другими параметрами, чем PASSWORD_HASH_METHOD"""
+    if not pwhash:
+        return False
+    try:
+        return parse_method(pwhash.split("$", 1)[0]) != parse_method(hash_method())
+    except ValueError:
+        return True  # нечитаемые параметры - пересчитать хэш
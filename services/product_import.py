@@ -0,0 +1,325 @@
+"""
+Массовый импорт товаров из CSV поставщика
+
+CSV читается потоково и сохраняется пачками: для каждой пачки существующие
+товары ищутся одним запросом по артикулу (sku) или, если артикула нет, по
+названию, затем новые товары добавляются одним INSERT, а найденные
+обновляются одним executemany UPDATE. Категории и бренды сопоставляются по
+названию через словари в памяти. Изображения из локального каталога
+проверяются и сохраняются в static/products по хэшу содержимого параллельно
+в пуле потоков (одинаковые файлы хранятся один раз), а копии для srcset
+строятся пайплайном изображений.
+Ошибки собираются построчно и не прерывают импорт.
+"""
+import csv
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from marshmallow import ValidationError as MarshmallowValidationError
+from PIL import Image
+from sqlalchemy import insert, update
+from models import db, Product, Category, Brand, ProductImportJob
+from schemas import ProductImportRowSchema
+from routes.catalog import invalidate_product_caches
+from routes.utils import queue_image_variants
+from services.media import store_file, retain_media, release_media
+
+logger = logging.getLogger(__name__)
+
+# Поля товара, которые импорт переносит из строки CSV
+IMPORT_FIELDS = ("sku", "title", "description", "price", "stock", "category_id", "brand_id", "image")
+
+def read_csv_rows(stream):
+    """
+    Построчно читать CSV (текстовый поток с поддержкой seek) как словари.
+    Разделитель (запятая, точка с запятой или табуляция) определяется по началу файла.
+    Возвращает генератор (номер строки, словарь).
+    """
+    sample = stream.read(4096)
+    stream.seek(0)
+    try:
+        dialect = csv.Sniffer().sniff(sample, delimiters=",;\t")
+    except csv.Error:
+        dialect = csv.excel
+    reader = csv.DictReader(stream, dialect=dialect)
+    for row in reader:
+        yield reader.line_num, {
+            (key or "").strip().lower(): (value or "").strip()
+            for key, value in row.items()
+            if key is not None
+        }
+
+class ProductImporter:
+    """Пакетный upsert товаров с параллельной обработкой изображений"""
+
+    def __init__(self, images_dir=None, batch_size=500, workers=4, upload_folder=None,
+                 allowed_extensions=None, max_errors=1000, progress=None):
+        self.images_dir = os.path.realpath(images_dir) if images_dir else None
+        self.batch_size = batch_size
+        self.workers = workers
+        self.upload_folder = upload_folder
+        self.allowed_extensions = allowed_extensions or {"png", "jpg", "jpeg", "gif", "webp"}
+        self.max_errors = max_errors
+        self.progress = progress
+        self.schema = ProductImportRowSchema()
+        self.report = {"processed": 0, "created": 0, "updated": 0, "failed": 0, "errors": []}
+        self._stored_images = {}
+        self._images_lock = threading.Lock()
+
+    def run(self, rows):
+        """Импортировать строки (номер, словарь); возвращает отчет"""
+        self.categories = {name.lower(): cid for cid, name in db.session.query(Category.id, Category.name)}
+        self.brands = {name.lower(): bid for bid, name in db.session.query(Brand.id, Brand.name)}
+        with ThreadPoolExecutor(max_workers=max(self.workers, 1), thread_name_prefix="import-image") as executor:
+            self.executor = executor
+            batch = []
+            for line, raw in rows:
+                item = self._parse(line, raw)
+                if item is not None:
+                    batch.append(item)
+                if len(batch) >= self.batch_size:
+                    self._flush(batch)
+                    batch = []
+            if batch:
+                self._flush(batch)
+        return self.report
+
+    def _error(self, line, errors):
+        self.report["failed"] += 1
+        if len(self.report["errors"]) < self.max_errors:
+            self.report["errors"].append({"row": line, "errors": errors})
+
+    def _parse(self, line, raw):
+        """Проверить строку и сопоставить категорию/бренд; None - строка с ошибкой"""
+        self.report["processed"] += 1
+        values = {key: value for key, value in raw.items() if key in self.schema.fields and value != ""}
+        try:
+            data = self.schema.load(values)
+        except MarshmallowValidationError as err:
+            self._error(line, err.messages)
+            return None
+
+        category = data.pop("category", None)
+        if category is not None:
+            data["category_id"] = self.categories.get(category.lower())
+            if data["category_id"] is None:
+                self._error(line, {"category": [f"Неизвестная категория: {category}"]})
+                return None
+        brand = data.pop("brand", None)
+        if brand is not None:
+            data["brand_id"] = self.brands.get(brand.lower())
+            if data["brand_id"] is None:
+                self._error(line, {"brand": [f"Неизвестный бренд: {brand}"]})
+                return None
+        return line, data
+
+    def _store_image(self, name):
+        """Проверить изображение из images_dir и скопировать в каталог товаров"""
+        with self._images_lock:
+            if name in self._stored_images:
+                return self._stored_images[name]._replace(created=False)
+        if not self.images_dir:
+            raise ValueError("Каталог изображений не задан")
+        source = os.path.realpath(os.path.join(self.images_dir, name))
+        if not source.startswith(self.images_dir + os.sep) or not os.path.isfile(source):
+            raise ValueError(f"Изображение не найдено: {name}")
+        ext = source.rsplit(".", 1)[-1].lower() if "." in source else ""
+        if ext not in self.allowed_extensions:
+            raise ValueError(f"Недопустимое расширение файла изображения: {name}")
+        with Image.open(source) as img:
+            img.verify()
+        media = store_file(source, self.upload_folder, "static/products")
+        with self._images_lock:
+            self._stored_images[name] = media
+        return media
+
+    def _attach_images(self, items):
+        """Параллельно обработать изображения пачки; строки с ошибкой импортируются без изображения"""
+        pending = [(line, data) for line, data in items if data.get("image")]
+        futures = [(line, data, self.executor.submit(self._store_image, data["image"])) for line, data in pending]
+        for line, data, future in futures:
+            try:
+                media = future.result()
+                data["image"] = media.stored
+                # Одинаковые файлы под разными именами сохраняются один раз
+                if media.created:
+                    queue_image_variants(media.path, media.stored)
+            except Exception as e:
+                data.pop("image")
+                if len(self.report["errors"]) < self.max_errors:
+                    self.report["errors"].append({"row": line, "errors": {"image": [str(e)]}})
+
+    def _count_image_references(self, new_rows, changed_rows):
+        """Учесть ссылки на изображения пачки: новые добавляются, замененные снимаются"""
+        replaced = [values for values in changed_rows if "image" in values]
+        if replaced:
+            previous = dict(
+                db.session.query(Product.id, Product.image)
+                .filter(Product.id.in_([values["id"] for values in replaced]))
+            )
+            release_media(*[previous.get(values["id"]) for values in replaced])
+        for values in new_rows + replaced:
+            if values.get("image"):
+                retain_media(values["image"])
+
+    def _flush(self, items):
+        """Сохранить пачку: поиск существующих, INSERT новых, UPDATE найденных, commit"""
+        # Повторы ключа внутри пачки: побеждает последняя строка
+        by_key = {}
+        for line, data in items:
+            key = ("sku", data["sku"]) if data.get("sku") else ("title", data["title"])
+            by_key[key] = (line, data)
+        items = list(by_key.values())
+        self._attach_images(items)
+
+        skus = [data["sku"] for _, data in items if data.get("sku")]
+        titles = [data["title"] for _, data in items if not data.get("sku")]
+        existing_by_sku = dict(db.session.query(Product.sku, Product.id).filter(Product.sku.in_(skus))) if skus else {}
+        existing_by_title = dict(
+            db.session.query(Product.title, Product.id).filter(Product.title.in_(titles), Product.sku.is_(None))
+        ) if titles else {}
+
+        new_rows, changed_rows = [], []
+        for _, data in items:
+            values = {field: data[field] for field in IMPORT_FIELDS if field in data}
+            product_id = existing_by_sku.get(data["sku"]) if data.get("sku") else existing_by_title.get(data["title"])
+            if product_id is None:
+                values.setdefault("stock", 0)
+                values.setdefault("description", "")
+                new_rows.append(values)
+            else:
+                values["id"] = product_id
+                values["updated_at"] = datetime.utcnow()
+                changed_rows.append(values)
+
+        try:
+            self._count_image_references(new_rows, changed_rows)
+            if new_rows:
+                db.session.execute(insert(Product), new_rows)
+            if changed_rows:
+                db.session.execute(update(Product), changed_rows)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.exception("Ошибка сохранения пачки импорта")
+            for line, _ in items:
+                self._error(line, {"_batch": [f"Ошибка сохранения пачки: {e}"]})
+        else:
+            self.report["created"] += len(new_rows)
+            self.report["updated"] += len(changed_rows)
+            # Обновленные товары могли быть закэшированы в карточке и списках каталога
+            invalidate_product_caches([values["id"] for values in changed_rows])
+        if self.progress:
+            self.progress(self.report)
+
+def importer_from_config(progress=None, images_dir=None, batch_size=None):
+    """ProductImporter с настройками приложения"""
+    config = current_app.config
+    return ProductImporter(
+        images_dir=images_dir or config.get("PRODUCT_IMPORT_IMAGES_DIR"),
+        batch_size=batch_size or config.get("PRODUCT_IMPORT_BATCH_SIZE", 500),
+        workers=config.get("PRODUCT_IMPORT_IMAGE_WORKERS", 4),
+        upload_folder=config.get("PRODUCTS_UPLOAD_FOLDER"),
+        allowed_extensions=config.get("ALLOWED_EXTENSIONS"),
+        max_errors=config.get("PRODUCT_IMPORT_MAX_ERRORS", 1000),
+        progress=progress
+    )
+
+def _finish_catalog_import():
+    """Сбросить кэш справочников после импорта"""
+    cache = current_app.cache
+    cache.delete("categories_list")
+    cache.delete("brands_list")
+
+def run_import_job(job_id, path):
+    """Выполнить задачу импорта из файла path внутри контекста приложения"""
+    job = db.session.get(ProductImportJob, job_id)
+    job.status = "running"
+    db.session.commit()
+
+    def progress(report):
+        ProductImportJob.query.filter_by(id=job_id).update({
+            "processed_rows": report["processed"],
+            "created_count": report["created"],
+            "updated_count": report["updated"],
+            "failed_count": report["failed"]
+        }, synchronize_session=False)
+        db.session.commit()
+
+    importer = importer_from_config(progress=progress)
+    try:
+        with open(path, encoding="utf-8-sig", newline="") as f:
+            report = importer.run(read_csv_rows(f))
+        status = "completed"
+    except Exception as e:
+        db.session.rollback()
+        logger.exception("Ошибка импорта товаров %s", job_id)
+        report = importer.report
+        report["errors"].append({"row": None, "errors": {"_file": [str(e)]}})
+        status = "failed"
+    finally:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    job = db.session.get(ProductImportJob, job_id)
+    job.status = status
+    job.processed_rows = report["processed"]
+    job.created_count = report["created"]
+    job.updated_count = report["updated"]
+    job.failed_count = report["failed"]
+    job.errors = json.dumps(report["errors"], ensure_ascii=False)
+    job.finished_at = datetime.utcnow()
+    db.session.commit()
+    _finish_catalog_import()
+    return job
+
+class ProductImportRunner:
+    """Фоновое выполнение задач импорта (по одной за раз)"""
+
+    def __init__(self, app):
+        self.app = app
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def submit(self, job_id, path):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="product-import")
+        return self._executor.submit(self._run, job_id, path)
+
+    def _run(self, job_id, path):
+        with self.app.app_context():
+            try:
+                return run_import_job(job_id, path)
+            except Exception:
+                db.session.rollback()
+                logger.exception("Ошибка задачи импорта %s", job_id)
+
+@click.command("products-import")
+@click.argument("csv_path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--images-dir", type=click.Path(exists=True, file_okay=False), default=None,
+              help="Каталог с изображениями из колонки image")
+@click.option("--batch-size", type=int, default=None, help="Размер пачки")
+@with_appcontext
+def products_import_command(csv_path, images_dir, batch_size):
+    """Импортировать товары из CSV (upsert по sku или названию)"""
+    def progress(report):
+        click.echo(f"Обработано: {report['processed']}, создано: {report['created']}, "
+                   f"обновлено: {report['updated']}, ошибок: {report['failed']}")
+
+    importer = importer_from_config(progress=progress, images_dir=images_dir, batch_size=batch_size)
+    with open(csv_path, encoding="utf-8-sig", newline="") as f:
+        report = importer.run(read_csv_rows(f))
+    _finish_catalog_import()
+    for error in report["errors"]:
+        click.echo(f"Строка {error['row']}: {json.dumps(error['errors'], ensure_ascii=False)}")
+    progress(report)
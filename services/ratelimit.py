@@ -0,0 +1,241 @@
+"""
+Общее хранилище лимитов запросов для нескольких воркеров
+
+Flask-Limiter с memory:// считает запросы в каждом процессе отдельно, и
+фактический лимит оказывается в N раз больше настроенного. Лимиты
+используют стратегию sliding-window-counter (взвешенная сумма текущего и
+предыдущего окна), а счетчики хранятся в общем хранилище:
+
+- redis://host:port - встроенное хранилище limits: проверка и списание
+  выполняются одним Lua-скриптом за один запрос к Redis;
+- sqlite:///путь/к/файлу.db - хранилище для одного сервера без Redis
+  (регистрируется этим модулем): проверка и списание - одна транзакция
+  BEGIN IMMEDIATE в общем файле БД в режиме WAL.
+
+Кроме лимитов на число запросов действует общий для всех маршрутов бюджет
+RATELIMIT_COST_BUDGET: каждый запрос списывает свою стоимость. Маршрут
+объявляет ее декоратором request_cost (число или функция от запроса), а
+если запросы к маршруту в среднем дольше работают с БД, стоимость
+поднимается по измеренному времени (RATELIMIT_COST_DB_MS_PER_UNIT мс на
+единицу). Так дорогие поиски и хэширование паролей расходуют бюджет
+быстрее, а обычный просмотр каталога почти не ограничивается.
+"""
+import os
+import sqlite3
+import threading
+import time
+from math import ceil, floor
+
+from flask import current_app, g, has_request_context, request
+from limits.storage import Storage, SlidingWindowCounterSupport
+from limits.storage.base import TimestampedSlidingWindow
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Как часто (в секундах) процесс удаляет истекшие счетчики из файла
+PURGE_INTERVAL = 60
+
+# Стоимость запросов в единицах бюджета RATELIMIT_COST_BUDGET
+SEARCH_COST = 10  # текстовый поиск и глубокие страницы каталога (промах кэша)
+CHECKOUT_COST = 20  # оформление заказа
+PASSWORD_HASH_COST = 50  # маршруты, вычисляющие хэш пароля
+RESIZE_COST = 10  # построение уменьшенной копии изображения (промах кэша)
+DEEP_PAGE = 5  # страницы каталога дальше этой редко попадают в кэш
+
+class SQLiteStorage(Storage, SlidingWindowCounterSupport, TimestampedSlidingWindow):
+    """Счетчики limits в общем файле SQLite (sqlite:///path)"""
+
+    STORAGE_SCHEME = ["sqlite"]
+
+    def __init__(self, uri, wrap_exceptions=False, timeout=5, **options):
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+        path = uri.split("://", 1)[1]
+        if path.startswith("/"):
+            path = path[1:]  # sqlite:///rel.db -> rel.db, sqlite:////abs.db -> /abs.db
+        if not path:
+            raise ValueError("Не указан путь к файлу БД лимитов")
+        self.path = path
+        self.timeout = float(timeout)
+        self._local = threading.local()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._init_schema()
+
+    @property
+    def base_exceptions(self):
+        return sqlite3.Error
+
+    def _connection(self):
+        """Соединение текущего потока (после fork открывается заново)"""
+        local = self._local
+        if getattr(local, "pid", None) != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            local.connection = connection
+            local.pid = os.getpid()
+            local.next_purge = 0
+        return local.connection
+
+    def _init_schema(self):
+        connection = self._connection()
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS rate_limit ("
+            "key TEXT PRIMARY KEY, count INTEGER NOT NULL, expires_at REAL NOT NULL)"
+        )
+        connection.execute("CREATE INDEX IF NOT EXISTS idx_rate_limit_expires ON rate_limit (expires_at)")
+
+    def _transaction(self, callback):
+        """Выполнить callback(connection, now) в одной транзакции с блокировкой записи"""
+        connection = self._connection()
+        now = time.time()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            result = callback(connection, now)
+            if now >= self._local.next_purge:
+                connection.execute("DELETE FROM rate_limit WHERE expires_at <= ?", (now,))
+                self._local.next_purge = now + PURGE_INTERVAL
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        return result
+
+    @staticmethod
+    def _count(connection, key, now):
+        row = connection.execute(
+            "SELECT count FROM rate_limit WHERE key = ? AND expires_at > ?", (key, now)
+        ).fetchone()
+        return row[0] if row else 0
+
+    @staticmethod
+    def _incr(connection, key, expiry, amount, now):
+        """Увеличить счетчик; истекший счетчик начинается заново с новым сроком"""
+        return connection.execute(
+            "INSERT INTO rate_limit (key, count, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET "
+            "count = CASE WHEN expires_at <= ? THEN excluded.count ELSE count + excluded.count END, "
+            "expires_at = CASE WHEN expires_at <= ? THEN excluded.expires_at ELSE expires_at END "
+            "RETURNING count",
+            (key, amount, now + expiry, now, now)
+        ).fetchone()[0]
+
+    def incr(self, key, expiry, amount=1):
+        return self._transaction(lambda connection, now: self._incr(connection, key, expiry, amount, now))
+
+    def get(self, key):
+        return self._count(self._connection(), key, time.time())
+
+    def get_expiry(self, key):
+        row = self._connection().execute(
+            "SELECT expires_at FROM rate_limit WHERE key = ?", (key,)
+        ).fetchone()
+        return row[0] if row else time.time()
+
+    def check(self):
+        try:
+            self._connection().execute("SELECT 1")
+            return True
+        except sqlite3.Error:
+            return False
+
+    def reset(self):
+        return self._transaction(
+            lambda connection, now: connection.execute("DELETE FROM rate_limit").rowcount
+        )
+
+    def clear(self, key):
+        self._connection().execute("DELETE FROM rate_limit WHERE key = ?", (key,))
+
+    def _window(self, connection, key, expiry, now):
+        """(previous_count, previous_ttl, current_count, current_ttl, current_key)"""
+        previous_key, current_key = self.sliding_window_keys(key, expiry, now)
+        previous_count = self._count(connection, previous_key, now)
+        current_count = self._count(connection, current_key, now)
+        previous_ttl = (1 - (((now - expiry) / expiry) % 1)) * expiry if previous_count else 0.0
+        current_ttl = (1 - ((now / expiry) % 1)) * expiry + expiry
+        return previous_count, previous_ttl, current_count, current_ttl, current_key
+
+    def acquire_sliding_window_entry(self, key, limit, expiry, amount=1):
+        if amount > limit:
+            return False
+
+        def acquire(connection, now):
+            previous_count, previous_ttl, current_count, _, current_key = self._window(connection, key, expiry, now)
+            weighted = previous_count * previous_ttl / expiry + current_count
+            if floor(weighted) + amount > limit:
+                return False
+            # Счетчик окна живет два окна: следующее окно читает его как предыдущее
+            self._incr(connection, current_key, 2 * expiry, amount, now)
+            return True
+
+        return self._transaction(acquire)
+
+    def get_sliding_window(self, key, expiry):
+        return self._window(self._connection(), key, expiry, time.time())[:4]
+
+    def clear_sliding_window(self, key, expiry):
+        previous_key, current_key = self.sliding_window_keys(key, expiry, time.time())
+        self._connection().execute(
+            "DELETE FROM rate_limit WHERE key IN (?, ?)", (previous_key, current_key)
+        )
+
+def request_cost(cost):
+    """Декоратор маршрута: стоимость запроса (число или функция без аргументов)"""
+    def decorator(view):
+        view.request_cost = cost
+        return view
+    return decorator
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _query_started(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context():
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _query_finished(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get("query_started")
+    if started and has_request_context():
+        g.db_time_ms = g.get("db_time_ms", 0.0) + (time.perf_counter() - started.pop()) * 1000
+
+class RequestCosts:
+    """Стоимость запроса: объявленная маршрутом или по среднему времени БД (EWMA)"""
+
+    def __init__(self, app, smoothing=0.2):
+        self.ms_per_unit = app.config.get("RATELIMIT_COST_DB_MS_PER_UNIT", 50)
+        self.max_cost = app.config.get("RATELIMIT_COST_MAX", 100)
+        self.smoothing = smoothing
+        self._db_ms = {}
+        self._lock = threading.Lock()
+        if self.ms_per_unit:
+            app.after_request(self._record)
+
+    def declared(self, endpoint):
+        view = current_app.view_functions.get(endpoint)
+        cost = getattr(view, "request_cost", 1)
+        return cost() if callable(cost) else cost
+
+    def measured(self, endpoint):
+        if not self.ms_per_unit:
+            return 0
+        return ceil(self._db_ms.get(endpoint, 0.0) / self.ms_per_unit)
+
+    def observe(self, endpoint, db_ms):
+        """Учесть время БД очередного запроса к маршруту"""
+        with self._lock:
+            previous = self._db_ms.get(endpoint)
+            self._db_ms[endpoint] = db_ms if previous is None else \
+                previous + self.smoothing * (db_ms - previous)
+
+    def __call__(self):
+        """Стоимость текущего запроса (application_limits_cost для Flask-Limiter)"""
+        endpoint = request.endpoint
+        if endpoint is None:
+            return 1
+        cost = max(self.declared(endpoint), self.measured(endpoint), 1)
+        return min(cost, self.max_cost)
+
+    def _record(self, response):
+        if request.endpoint is not None:
+            self.observe(request.endpoint, g.pop("db_time_ms", 0.0))
+        return response
@@ -0,0 +1,103 @@
+"""
+Коды восстановления пароля
+
+Код хранится не в открытом виде, а как HMAC-SHA256 (ключ SECRET_KEY) от
+email и кода: проверка - один поиск по составному индексу
+(code_hash, used, expires_at) без перебора строк пользователя. При выдаче
+нового кода прежние коды этого email удаляются, а истекшие и использованные
+коды периодически удаляются пачками, поэтому таблица и ее индексы остаются
+небольшими при любом объеме запросов на восстановление.
+"""
+import hashlib
+import hmac
+import secrets
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import or_
+from models import db, PasswordResetCode
+from services.runner import BackgroundRunner
+
+def generate_reset_code():
+    """Генерирует 6-значный код восстановления"""
+    return str(100000 + secrets.randbelow(900000))
+
+def hash_reset_code(email, code):
+    """HMAC кода, привязанный к email (hex, 64 символа)"""
+    key = current_app.config["SECRET_KEY"].encode()
+    message = f"{email.strip().lower()}:{code.strip()}".encode()
+    return hmac.new(key, message, hashlib.sha256).hexdigest()
+
+def issue_reset_code(email):
+    """
+    Выдать новый код для email (commit выполняет вызывающий код).
+    Прежние коды этого email удаляются. Возвращает код в открытом виде.
+    """
+    PasswordResetCode.query.filter_by(email=email).delete(synchronize_session=False)
+    code = generate_reset_code()
+    ttl = current_app.config.get("RESET_CODE_TTL_MINUTES", 15)
+    db.session.add(PasswordResetCode(
+        email=email,
+        code_hash=hash_reset_code(email, code),
+        expires_at=datetime.utcnow() + timedelta(minutes=ttl)
+    ))
+    return code
+
+def find_active_code(email, code):
+    """Действующий (не использованный и не истекший) код или None"""
+    code_hash = hash_reset_code(email, code)
+    reset_code = PasswordResetCode.query.filter(
+        PasswordResetCode.code_hash == code_hash,
+        PasswordResetCode.used.is_(False),
+        PasswordResetCode.expires_at > datetime.utcnow()
+    ).first()
+    if reset_code is None or not hmac.compare_digest(reset_code.code_hash, code_hash):
+        return None
+    return reset_code
+
+def purge_reset_codes_batch(batch_size, now=None):
+    """Удалить одну пачку истекших или использованных кодов; возвращает количество"""
+    now = now or datetime.utcnow()
+    ids = [row[0] for row in db.session.query(PasswordResetCode.id).filter(
+        or_(PasswordResetCode.expires_at <= now, PasswordResetCode.used.is_(True))
+    ).order_by(PasswordResetCode.id).limit(batch_size)]
+    if not ids:
+        db.session.rollback()
+        return 0
+    PasswordResetCode.query.filter(PasswordResetCode.id.in_(ids)).delete(synchronize_session=False)
+    db.session.commit()
+    return len(ids)
+
+def purge_reset_codes(batch_size=None):
+    """Удалить все истекшие и использованные коды пачками (commit на каждую пачку)"""
+    if batch_size is None:
+        batch_size = current_app.config.get("RESET_CODE_SWEEP_BATCH_SIZE", 1000)
+    now = datetime.utcnow()
+    total = 0
+    while True:
+        deleted = purge_reset_codes_batch(batch_size, now)
+        total += deleted
+        if deleted < batch_size:
+            return total
+
+class ResetCodeSweeper(BackgroundRunner):
+    """Периодическая очистка кодов в фоновом потоке"""
+
+    name = "reset-code-sweeper"
+    interval_key = "RESET_CODE_SWEEP_INTERVAL"
+    default_interval = 300
+    error_message = "Ошибка очистки кодов восстановления"
+
+    def run_once(self):
+        purge_reset_codes()
+        return False
+
+@click.command("reset-codes-purge")
+@click.option("--batch-size", type=int, default=None, help="Размер пачки")
+@with_appcontext
+def reset_codes_purge_command(batch_size):
+    """Удалить истекшие и использованные коды восстановления пароля"""
+    deleted = purge_reset_codes(batch_size=batch_size)
+    click.echo(f"Удалено кодов: {deleted}")
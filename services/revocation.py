@@ -0,0 +1,256 @@
+"""
+Отзыв JWT: denylist по jti
+
+Отозванные jti хранятся в памяти процесса: фильтр Блума отвечает "точно не
+отозван" за несколько хэшей, а положительные ответы подтверждаются точным
+словарем {jti: exp}. Записи удаляются по истечении срока токена, после чего
+фильтр перестраивается. Отзыв делится между воркерами через общее хранилище:
+
+- TOKEN_DENYLIST_REDIS_URL - ключ с EXAT = exp токена и рассылка остальным
+  воркерам через pub/sub; полная сверка (SCAN) - в фоновом потоке;
+- TOKEN_DENYLIST_SQLITE_PATH - общий файл SQLite для воркеров одного
+  сервера без Redis: фоновый поток раз в TOKEN_DENYLIST_POLL_INTERVAL
+  секунд подтягивает новые строки (id > последнего прочитанного).
+
+Проверка токена в запросе не обращается к хранилищу. Фоновые потоки
+запускаются при первом обращении в каждом процессе (после fork воркера
+gunicorn с --preload потоки мастера не наследуются), слушатель pub/sub
+переподключается к Redis с задержкой и после разрыва сверяется через SCAN.
+Без хранилища denylist действует в пределах одного процесса.
+"""
+import hashlib
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+
+from services.runner import listen_redis
+
+logger = logging.getLogger(__name__)
+
+class BloomFilter:
+    """Фильтр Блума на bytearray (double hashing по blake2b)"""
+
+    def __init__(self, capacity, error_rate=0.001):
+        self.capacity = max(int(capacity), 1)
+        self.size = max(int(-self.capacity * math.log(error_rate) / (math.log(2) ** 2)), 8)
+        self.hashes = max(int(round(self.size / self.capacity * math.log(2))), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, key):
+        for pos in self._positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, key):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+class TokenDenylist:
+    """Denylist отозванных jti с автоматическим истечением записей"""
+
+    def __init__(self, redis_url=None, sqlite_path=None, capacity=100000, error_rate=0.001,
+                 sweep_interval=60, poll_interval=1, key_prefix="denylist:", channel="token-revocations"):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.sweep_interval = sweep_interval
+        self.poll_interval = poll_interval
+        self.key_prefix = key_prefix
+        self.channel = channel
+        self._lock = threading.Lock()
+        self._exact = {}
+        self._bloom = BloomFilter(capacity, error_rate)
+        self._next_sweep = time.time() + sweep_interval
+        self._redis = None
+        self._listener = None
+        self._sqlite_path = sqlite_path
+        self._local = threading.local()
+        self._last_id = 0
+        self._stop = threading.Event()
+        self._maintainer = None
+        self._threads_pid = None
+        if redis_url:
+            import redis
+            self._redis = redis.Redis.from_url(redis_url)
+            self._sync_from_redis()
+        if sqlite_path:
+            os.makedirs(os.path.dirname(os.path.abspath(sqlite_path)), exist_ok=True)
+            connection = self._sqlite()
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS token_denylist ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, jti TEXT NOT NULL UNIQUE, exp REAL NOT NULL)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS idx_token_denylist_exp ON token_denylist (exp)")
+            self._poll_sqlite()
+
+    @property
+    def shared(self):
+        """Отзывы делятся между воркерами через Redis или SQLite"""
+        return self._redis is not None or bool(self._sqlite_path)
+
+    def _ensure_threads(self):
+        """Запустить фоновые потоки в текущем процессе (один раз на pid)"""
+        pid = os.getpid()
+        if self._threads_pid == pid or not self.shared:
+            return
+        with self._lock:
+            if self._threads_pid == pid:
+                return
+            self._threads_pid = pid
+            self._stop = threading.Event()
+            # Сверка с хранилищем и очистка - вне запросов
+            self._maintainer = threading.Thread(target=self._maintain, name="denylist-maintainer", daemon=True)
+            self._maintainer.start()
+            if self._redis is not None:
+                self._listener = threading.Thread(target=self._listen, name="denylist-redis-listener", daemon=True)
+                self._listener.start()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._exact)
+
+    def _add_local(self, jti, exp):
+        with self._lock:
+            self._exact[jti] = exp
+            if len(self._exact) > self._bloom.capacity:
+                self._rebuild(capacity=self._bloom.capacity * 2)
+            else:
+                self._bloom.add(jti)
+
+    def _rebuild(self, capacity=None):
+        """Перестроить фильтр по точному словарю (вызывается под блокировкой)"""
+        bloom = BloomFilter(max(capacity or self.capacity, len(self._exact)), self.error_rate)
+        for jti in self._exact:
+            bloom.add(jti)
+        self._bloom = bloom
+
+    def revoke(self, jti, exp):
+        """Отозвать токен jti до момента exp (unix time)"""
+        self._ensure_threads()
+        self._add_local(jti, exp)
+        if self._sqlite_path:
+            try:
+                self._sqlite().execute(
+                    "INSERT OR IGNORE INTO token_denylist (jti, exp) VALUES (?, ?)", (jti, float(exp))
+                )
+            except sqlite3.Error:
+                logger.exception("Не удалось записать отзыв токена в SQLite")
+        if self._redis is None:
+            return
+        try:
+            pipe = self._redis.pipeline()
+            pipe.set(self.key_prefix + jti, 1, exat=int(exp))
+            pipe.publish(self.channel, f"{jti}:{int(exp)}")
+            pipe.execute()
+        except Exception:
+            logger.exception("Не удалось записать отзыв токена в Redis")
+
+    def is_revoked(self, jti):
+        self._ensure_threads()
+        now = time.time()
+        if not self.shared and now >= self._next_sweep:
+            self.sweep(now)
+        # Быстрый путь: отсутствие в фильтре Блума означает, что токен не отозван
+        if jti not in self._bloom:
+            return False
+        exp = self._exact.get(jti)
+        return exp is not None and exp > now
+
+    def sweep(self, now=None):
+        """Удалить истекшие записи и перестроить фильтр"""
+        now = now or time.time()
+        self._next_sweep = now + self.sweep_interval
+        if self._redis is not None:
+            self._sync_from_redis()
+        if self._sqlite_path:
+            try:
+                self._sqlite().execute("DELETE FROM token_denylist WHERE exp <= ?", (now,))
+            except sqlite3.Error:
+                logger.exception("Не удалось очистить denylist в SQLite")
+        with self._lock:
+            expired = [jti for jti, exp in self._exact.items() if exp <= now]
+            for jti in expired:
+                del self._exact[jti]
+            if expired:
+                self._rebuild()
+
+    def _maintain(self):
+        interval = min(self.poll_interval, self.sweep_interval) if self._sqlite_path else self.sweep_interval
+        stop = self._stop
+        # Первая сверка сразу: воркер мог быть создан fork намного позже __init__
+        first = True
+        while True:
+            try:
+                if self._sqlite_path:
+                    self._poll_sqlite()
+                if first or time.time() >= self._next_sweep:
+                    first = False
+                    self.sweep()
+            except Exception:
+                logger.exception("Ошибка фоновой синхронизации denylist")
+            if stop.wait(interval):
+                return
+
+    def close(self):
+        """Остановить фоновую синхронизацию"""
+        self._stop.set()
+        if self._maintainer is not None and self._threads_pid == os.getpid():
+            self._maintainer.join()
+
+    def _sqlite(self):
+        """Соединение с файлом denylist для текущего потока (после fork - новое)"""
+        local = self._local
+        if getattr(local, "pid", None) != os.getpid():
+            connection = sqlite3.connect(self._sqlite_path, timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            local.connection = connection
+            local.pid = os.getpid()
+        return local.connection
+
+    def _poll_sqlite(self):
+        """Подтянуть отзывы, записанные другими воркерами после последнего чтения"""
+        try:
+            rows = self._sqlite().execute(
+                "SELECT id, jti, exp FROM token_denylist WHERE id > ? AND exp > ? ORDER BY id",
+                (self._last_id, time.time())
+            ).fetchall()
+        except sqlite3.Error:
+            logger.exception("Не удалось прочитать denylist из SQLite")
+            return
+        for row_id, jti, exp in rows:
+            if jti not in self._exact:
+                self._add_local(jti, exp)
+            self._last_id = row_id
+
+    def _sync_from_redis(self):
+        """Подтянуть отзывы из Redis (старт и страховка от пропущенных сообщений pub/sub)"""
+        try:
+            keys = list(self._redis.scan_iter(match=self.key_prefix + "*", count=1000))
+            if not keys:
+                return
+            pipe = self._redis.pipeline()
+            for key in keys:
+                pipe.ttl(key)
+            now = time.time()
+            for key, ttl in zip(keys, pipe.execute()):
+                if ttl and ttl > 0:
+                    jti = key.decode()[len(self.key_prefix):]
+                    if jti not in self._exact:
+                        self._add_local(jti, now + ttl)
+        except Exception:
+            logger.exception("Не удалось синхронизировать denylist из Redis")
+
+    def _listen(self):
+        # После разрыва сообщения pub/sub потеряны - сверяемся с ключами Redis
+        listen_redis(self._redis, self.channel, self._on_message,
+                     on_reconnect=self._sync_from_redis, stop=self._stop)
+
+    def _on_message(self, data):
+        jti, exp = data.decode().rsplit(":", 1)
+        self._add_local(jti, int(exp))
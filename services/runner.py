@@ -0,0 +1,110 @@
+"""
+Фоновые потоки приложения (диспетчер outbox, отправитель писем, очистка кодов)
+
+BackgroundRunner повторяет run_once в контексте приложения, пока не вызван
+stop(): ошибка итерации откатывает сессию и пишется в лог, не останавливая
+поток. Если run_once вернул True (например, обработана полная пачка),
+следующая итерация начинается сразу, иначе поток ждет interval секунд.
+
+listen_redis - цикл подписчика Redis pub/sub для потоков-слушателей: при
+разрыве соединения он переподключается с экспоненциальной задержкой.
+"""
+import logging
+import threading
+import time
+
+from models import db
+
+logger = logging.getLogger(__name__)
+
+class BackgroundRunner:
+    """Периодическая задача в фоновом потоке"""
+
+    name = "background-runner"  # имя потока
+    interval_key = None  # ключ настроек с периодом опроса
+    default_interval = 60
+    error_message = "Ошибка фоновой задачи"
+
+    def __init__(self, app):
+        self.app = app
+        self._stop = threading.Event()
+        self._thread = None
+        self.logger = logging.getLogger(type(self).__module__)
+
+    @property
+    def interval(self):
+        if self.interval_key is None:
+            return self.default_interval
+        return self.app.config.get(self.interval_key, self.default_interval)
+
+    def run_once(self):
+        """Одна итерация внутри контекста приложения; True - сразу следующая"""
+        raise NotImplementedError
+
+    def on_exit(self):
+        """Освободить ресурсы после остановки цикла"""
+
+    def run_forever(self):
+        """Цикл: выполняет run_once, пока не вызван stop()"""
+        try:
+            while not self._stop.is_set():
+                busy = False
+                with self.app.app_context():
+                    try:
+                        busy = self.run_once()
+                    except Exception:
+                        db.session.rollback()
+                        self.logger.exception(self.error_message)
+                if not busy:
+                    self._stop.wait(self.interval)
+        finally:
+            self.on_exit()
+
+    def start(self):
+        """Запустить цикл в фоновом потоке"""
+        self._thread = threading.Thread(target=self.run_forever, name=self.name, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+def listen_redis(client, channel, handle, on_reconnect=None, stop=None, base_delay=0.5, max_delay=30):
+    """
+    Слушать канал Redis channel, пока не установлен stop (threading.Event).
+    handle(data) вызывается для каждого сообщения; on_reconnect() - после
+    восстановления соединения: сообщения за время разрыва потеряны.
+    """
+    from services.outbox import backoff_delay
+
+    failures = 0
+    while stop is None or not stop.is_set():
+        pubsub = client.pubsub(ignore_subscribe_messages=True)
+        try:
+            pubsub.subscribe(channel)
+            if failures and on_reconnect is not None:
+                logger.info("Подписка на канал Redis %s восстановлена", channel)
+                on_reconnect()
+            failures = 0
+            for item in pubsub.listen():
+                try:
+                    handle(item["data"])
+                except Exception:
+                    logger.exception("Некорректное сообщение из канала Redis %s", channel)
+                if stop is not None and stop.is_set():
+                    return
+        except Exception as exc:
+            logger.warning("Соединение с Redis (канал %s) потеряно: %s", channel, exc)
+        finally:
+            try:
+                pubsub.close()
+            except Exception:
+                pass
+        failures += 1
+        delay = backoff_delay(failures, base_delay, max_delay)
+        if stop is not None:
+            stop.wait(delay)
+        else:
+            time.sleep(delay)
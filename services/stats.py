@@ -0,0 +1,104 @@
+"""
+Инкрементально поддерживаемые агрегаты продаж для статистики админки
+
+Счетчики обновляются в той же транзакции, что и создание заказа или смена
+статуса, поэтому /admin/stats читает небольшую таблицу по дням вместо
+полного сканирования заказов. Команда `flask stats-rebuild` пересчитывает
+агрегаты с нуля (первичное заполнение или после ручных правок в БД).
+"""
+from collections import defaultdict
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import func, insert, select, union_all
+from sqlalchemy.dialects import postgresql, sqlite
+from models import db, Order, OrderItem, ArchivedOrder, ArchivedOrderItem, SalesDailyStat, ProductDailyStat
+
+_UPSERT_DIALECTS = {"sqlite": sqlite, "postgresql": postgresql}
+
+def _increment(model, keys, deltas):
+    """Атомарно прибавить deltas к строке агрегата (создать строку при отсутствии)"""
+    dialect = _UPSERT_DIALECTS.get(db.session.get_bind().dialect.name)
+    if dialect is not None:
+        stmt = dialect.insert(model).values(**keys, **deltas)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=list(keys),
+            set_={name: getattr(model, name) + stmt.excluded[name] for name in deltas}
+        )
+        db.session.execute(stmt)
+        return
+    updated = model.query.filter_by(**keys).update(
+        {getattr(model, name): getattr(model, name) + value for name, value in deltas.items()},
+        synchronize_session=False
+    )
+    if not updated:
+        db.session.add(model(**keys, **deltas))
+
+def record_order_created(order, items):
+    """Учесть новый заказ; items - список (product_id, quantity, price)"""
+    day = order.created_at.date()
+    _increment(SalesDailyStat, {"day": day, "status": order.status},
+               {"orders_count": 1, "revenue": order.total})
+    per_product = defaultdict(lambda: [0, 0.0])
+    for product_id, quantity, price in items:
+        per_product[product_id][0] += quantity
+        per_product[product_id][1] += quantity * price
+    for product_id, (units, revenue) in sorted(per_product.items()):
+        _increment(ProductDailyStat, {"day": day, "product_id": product_id},
+                   {"units": units, "revenue": round(revenue, 2)})
+
+def record_status_change(order, old_status, new_status):
+    """Перенести заказ из корзины старого статуса в новый"""
+    record_status_changes([(order.created_at, order.total, old_status)], new_status)
+
+def record_status_changes(rows, new_status):
+    """Массовый вариант: rows - список (created_at, total, old_status)"""
+    buckets = defaultdict(lambda: [0, 0.0])
+    for created_at, total, old_status in rows:
+        if old_status == new_status:
+            continue
+        day = created_at.date()
+        buckets[(day, old_status)][0] -= 1
+        buckets[(day, old_status)][1] -= total
+        buckets[(day, new_status)][0] += 1
+        buckets[(day, new_status)][1] += total
+    for (day, status), (count, revenue) in sorted(buckets.items()):
+        _increment(SalesDailyStat, {"day": day, "status": status},
+                   {"orders_count": count, "revenue": round(revenue, 2)})
+
+def rebuild_rollups():
+    """Пересчитать агрегаты по таблицам заказов (оперативным и архивным)"""
+    SalesDailyStat.query.delete(synchronize_session=False)
+    ProductDailyStat.query.delete(synchronize_session=False)
+
+    orders = union_all(*(
+        select(func.date(model.created_at).label("day"), func.coalesce(model.status, "created").label("status"),
+               model.id, model.total)
+        for model in (Order, ArchivedOrder)
+    )).subquery("orders")
+    db.session.execute(insert(SalesDailyStat).from_select(
+        ["day", "status", "orders_count", "revenue"],
+        select(orders.c.day, orders.c.status, func.count(orders.c.id), func.sum(orders.c.total))
+        .group_by(orders.c.day, orders.c.status)
+    ))
+
+    items = union_all(*(
+        select(func.date(order_model.created_at).label("day"), item_model.product_id,
+               item_model.quantity, item_model.price)
+        .join(order_model, order_model.id == item_model.order_id)
+        for order_model, item_model in ((Order, OrderItem), (ArchivedOrder, ArchivedOrderItem))
+    )).subquery("items")
+    db.session.execute(insert(ProductDailyStat).from_select(
+        ["day", "product_id", "units", "revenue"],
+        select(items.c.day, items.c.product_id, func.sum(items.c.quantity),
+               func.sum(items.c.quantity * items.c.price))
+        .group_by(items.c.day, items.c.product_id)
+    ))
+    db.session.commit()
+
+@click.command("stats-rebuild")
+@with_appcontext
+def stats_rebuild_command():
+    """Пересчитать агрегаты продаж с нуля"""
+    rebuild_rollups()
+    click.echo(f"Агрегаты пересчитаны: {SalesDailyStat.query.count()} строк по дням")
@@ -94,3 +94,386 @@ def test_regular_user_cannot_access_admin(auth_headers, client):
     
     assert response.status_code == 403
 
+
+def test_list_all_orders_cursor_pagination(admin_headers, client, app):
+    """Тест keyset-пагинации заказов в админке с фильтром по статусу"""
+    from datetime import datetime
+    from models import User, Order
+    
+    with app.app_context():
+        admin = User.query.filter_by(email='admin@example.com').first()
+        same_time = datetime(2026, 1, 1)
+        for status in ['pending', 'pending', 'pending', 'paid']:
+            db.session.add(Order(user_id=admin.id, total=1.0, status=status, created_at=same_time))
+        db.session.commit()
+    
+    first = client.get('/api/v1/admin/orders',
+        headers=admin_headers,
+        query_string={'status': 'pending', 'limit': 2, 'cursor': ''}).get_json()
+    assert len(first['orders']) == 2
+    assert first['next_cursor']
+    
+    second = client.get('/api/v1/admin/orders',
+        headers=admin_headers,
+        query_string={'status': 'pending', 'limit': 2, 'cursor': first['next_cursor']}).get_json()
+    assert len(second['orders']) == 1
+    assert second['next_cursor'] is None
+    ids = {o['id'] for o in first['orders']} | {o['id'] for o in second['orders']}
+    assert len(ids) == 3
+    
+    # limit=0 и отрицательный limit приводятся к одной записи на страницу
+    for limit in (0, -5):
+        response = client.get('/api/v1/admin/orders',
+            headers=admin_headers,
+            query_string={'status': 'pending', 'limit': limit, 'cursor': ''})
+        assert response.status_code == 200
+        assert len(response.get_json()['orders']) == 1
+
+def test_export_orders_csv(admin_headers, client, app):
+    """Тест потоковой выгрузки заказов в CSV с фильтром по дате"""
+    import csv
+    import io
+    from datetime import datetime
+    from models import User, Order, OrderItem
+    
+    with app.app_context():
+        admin = User.query.filter_by(email='admin@example.com').first()
+        product = Product(title='Export Product', price=5.0, stock=10)
+        db.session.add(product)
+        db.session.flush()
+        old = Order(user_id=admin.id, total=5.0, status='paid', created_at=datetime(2025, 1, 1))
+        new = Order(user_id=admin.id, total=10.0, status='paid', created_at=datetime(2026, 3, 1))
+        db.session.add_all([old, new])
+        db.session.flush()
+        db.session.add(OrderItem(order_id=new.id, product_id=product.id, quantity=2, price=5.0))
+        db.session.commit()
+        new_id = new.id
+    
+    response = client.get('/api/v1/admin/export/orders',
+        headers=admin_headers,
+        query_string={'date_from': '2026-01-01', 'date_to': '2026-03-01'})
+    
+    assert response.status_code == 200
+    assert response.mimetype == 'text/csv'
+    rows = list(csv.DictReader(io.StringIO(response.get_data(as_text=True))))
+    assert len(rows) == 1
+    assert int(rows[0]['order_id']) == new_id
+    assert rows[0]['product_title'] == 'Export Product'
+    assert rows[0]['user_email'] == 'admin@example.com'
+
+def test_export_users_ndjson_gzip(admin_headers, client):
+    """Тест выгрузки пользователей в NDJSON со сжатием gzip"""
+    import gzip
+    import json
+    
+    response = client.get('/api/v1/admin/export/users',
+        headers=admin_headers,
+        query_string={'format': 'ndjson', 'gzip': 'true'})
+    
+    assert response.status_code == 200
+    assert response.mimetype == 'application/gzip'
+    lines = gzip.decompress(response.get_data()).decode('utf-8').splitlines()
+    users = [json.loads(line) for line in lines]
+    assert [u['email'] for u in users] == ['admin@example.com']
+    assert 'password_hash' not in users[0]
+
+def test_export_unknown_entity(admin_headers, client):
+    """Тест выгрузки неизвестной сущности"""
+    response = client.get('/api/v1/admin/export/payments', headers=admin_headers)
+    assert response.status_code == 404
+
+def test_bulk_update_order_status(admin_headers, client, app):
+    """Тест массового обновления статуса с отчетом по недопустимым переходам"""
+    from models import User, Order, OrderHistory, OutboxEvent
+    
+    with app.app_context():
+        admin = User.query.filter_by(email='admin@example.com').first()
+        orders = [Order(user_id=admin.id, total=1.0, status=s) for s in ['paid', 'pending', 'delivered']]
+        db.session.add_all(orders)
+        db.session.commit()
+        paid_id, pending_id, delivered_id = [o.id for o in orders]
+    
+    response = client.put('/api/v1/admin/orders/status',
+        headers=admin_headers,
+        json={'ids': [paid_id, pending_id, delivered_id, 999], 'status': 'shipped'})
+    
+    assert response.status_code == 200
+    data = response.get_json()
+    assert sorted(data['updated_ids']) == sorted([paid_id, pending_id])
+    errors = {item['id']: item for item in data['failed']}
+    assert errors[delivered_id]['status'] == 'delivered'
+    assert errors[999]['error'] == 'Заказ не найден'
+    
+    with app.app_context():
+        assert db.session.get(Order, paid_id).status == 'shipped'
+        assert db.session.get(Order, delivered_id).status == 'delivered'
+        assert OrderHistory.query.filter_by(status='shipped').count() == 2
+        assert OutboxEvent.query.count() == 2
+
+def test_bulk_update_order_status_by_filter(admin_headers, client, app):
+    """Тест массового обновления статуса по фильтру"""
+    from models import User, Order
+    
+    with app.app_context():
+        admin = User.query.filter_by(email='admin@example.com').first()
+        db.session.add_all([Order(user_id=admin.id, total=1.0, status=s) for s in ['paid', 'paid', 'pending']])
+        db.session.commit()
+    
+    response = client.put('/api/v1/admin/orders/status',
+        headers=admin_headers,
+        json={'filter': {'status': 'paid'}, 'status': 'processing'})
+    
+    assert response.status_code == 200
+    assert response.get_json()['updated'] == 2
+    
+    # Нужно указать либо ids, либо filter
+    response = client.put('/api/v1/admin/orders/status',
+        headers=admin_headers,
+        json={'status': 'processing'})
+    assert response.status_code == 400
+
+def test_stats_read_incremental_rollups(admin_headers, client, app):
+    """Тест статистики: агрегаты пересчитываются и обновляются при смене статуса"""
+    from datetime import datetime
+    from models import User, Order, OrderItem
+    from services.stats import rebuild_rollups
+    
+    with app.app_context():
+        admin = User.query.filter_by(email='admin@example.com').first()
+        product = Product(title='Stats Product', price=10.0, stock=100)
+        db.session.add(product)
+        db.session.flush()
+        order = Order(user_id=admin.id, total=30.0, status='pending', created_at=datetime(2026, 2, 1, 12))
+        db.session.add_all([order, Order(user_id=admin.id, total=5.0, status='paid', created_at=datetime(2026, 2, 2))])
+        db.session.flush()
+        db.session.add(OrderItem(order_id=order.id, product_id=product.id, quantity=3, price=10.0))
+        db.session.commit()
+        rebuild_rollups()
+        order_id, product_id = order.id, product.id
+    
+    stats = client.get('/api/v1/admin/stats', headers=admin_headers).get_json()['stats']
+    assert stats['total_orders'] == 2
+    assert stats['total_revenue'] == 35.0
+    assert stats['orders_by_status'] == {'pending': 1, 'paid': 1}
+    
+    client.put(f'/api/v1/admin/orders/{order_id}/status',
+        headers=admin_headers,
+        json={'status': 'paid'})
+    stats = client.get('/api/v1/admin/stats', headers=admin_headers).get_json()['stats']
+    assert stats['orders_by_status'] == {'paid': 2}
+    
+    series = client.get('/api/v1/admin/stats/timeseries',
+        headers=admin_headers,
+        query_string={'date_from': '2026-02-01', 'date_to': '2026-02-01'}).get_json()['series']
+    assert series == [{'date': '2026-02-01', 'orders': 1, 'revenue': 30.0, 'orders_by_status': {'paid': 1}}]
+    
+    product_series = client.get('/api/v1/admin/stats/timeseries',
+        headers=admin_headers,
+        query_string={'product_id': product_id}).get_json()['series']
+    assert product_series == [{'date': '2026-02-01', 'units': 3, 'revenue': 30.0}]
+
+def test_stats_rebuild_keeps_archived_orders(admin_headers, client, app):
+    """Тест статистики: пересчет после переноса в архив учитывает архивные заказы"""
+    from datetime import datetime
+    from models import User, Order, OrderItem, ArchivedOrder
+    from services.archive import archive_orders
+    from services.stats import rebuild_rollups
+    
+    with app.app_context():
+        admin = User.query.filter_by(email='admin@example.com').first()
+        product = Product(title='Archive Stats', price=10.0, stock=100)
+        db.session.add(product)
+        db.session.flush()
+        old = Order(user_id=admin.id, total=20.0, status='delivered', created_at=datetime(2020, 3, 1, 12))
+        db.session.add_all([old, Order(user_id=admin.id, total=5.0, status='pending')])
+        db.session.flush()
+        db.session.add(OrderItem(order_id=old.id, product_id=product.id, quantity=2, price=10.0))
+        db.session.commit()
+        product_id = product.id
+        archive_orders(older_than_days=30)
+        assert ArchivedOrder.query.count() == 1
+        rebuild_rollups()
+    
+    stats = client.get('/api/v1/admin/stats', headers=admin_headers).get_json()['stats']
+    assert stats['total_orders'] == 2
+    assert stats['total_revenue'] == 25.0
+    assert stats['orders_by_status'] == {'delivered': 1, 'pending': 1}
+    
+    product_series = client.get('/api/v1/admin/stats/timeseries',
+        headers=admin_headers,
+        query_string={'product_id': product_id}).get_json()['series']
+    assert product_series == [{'date': '2020-03-01', 'units': 2, 'revenue': 20.0}]
+
+def test_list_all_orders_lean_payload(admin_headers, client, app):
+    """Тест облегченной сериализации списка заказов"""
+    from models import User, Order, OrderItem
+    
+    with app.app_context():
+        admin = User.query.filter_by(email='admin@example.com').first()
+        product = Product(title='Lean Product', description='x' * 1000, price=7.5, stock=10)
+        db.session.add(product)
+        db.session.flush()
+        order = Order(user_id=admin.id, total=15.0, status='pending')
+        db.session.add(order)
+        db.session.flush()
+        db.session.add(OrderItem(order_id=order.id, product_id=product.id, quantity=2, price=7.5))
+        db.session.commit()
+    
+    data = client.get('/api/v1/admin/orders', headers=admin_headers).get_json()
+    order = data['orders'][0]
+    assert order['user'] == {'id': order['user_id'], 'email': 'admin@example.com',
+                             'first_name': 'Admin', 'last_name': 'User'}
+    assert order['items'][0]['title'] == 'Lean Product'
+    assert order['items'][0]['quantity'] == 2
+    assert 'product' not in order['items'][0]
+    assert 'password_hash' not in order['user']
+
+def test_list_all_orders_include_archived(admin_headers, client, app):
+    """Тест списка заказов админки с архивными заказами"""
+    from datetime import datetime
+    from models import User, Order
+    from services.archive import archive_orders
+    
+    with app.app_context():
+        admin = User.query.filter_by(email='admin@example.com').first()
+        db.session.add_all([
+            Order(user_id=admin.id, total=1.0, status='cancelled', created_at=datetime(2020, 1, 1)),
+            Order(user_id=admin.id, total=2.0, status='pending')
+        ])
+        db.session.commit()
+        archive_orders(older_than_days=30)
+    
+    hot = client.get('/api/v1/admin/orders', headers=admin_headers).get_json()
+    assert [o['status'] for o in hot['orders']] == ['pending']
+    
+    everything = client.get('/api/v1/admin/orders',
+        headers=admin_headers,
+        query_string={'include_archived': 'true'}).get_json()
+    assert [o['status'] for o in everything['orders']] == ['pending', 'cancelled']
+    assert everything['orders'][1]['user']['email'] == 'admin@example.com'
+    
+    export = client.get('/api/v1/admin/export/orders', headers=admin_headers)
+    assert export.get_data(as_text=True).count('\n') == 3
+
+def test_list_all_products_pagination_and_projection(admin_headers, client, app):
+    """Тест списка товаров в админке: курсор, фильтры, выбор колонок"""
+    with app.app_context():
+        for i in range(5):
+            db.session.add(Product(title=f'Шелк {i}', description='x' * 1000, price=10.0 + i, stock=i * 5))
+        db.session.add(Product(title='Лен', price=5.0, stock=100))
+        db.session.commit()
+    
+    response = client.get('/api/v1/admin/products', headers=admin_headers,
+        query_string={'q': 'Шелк', 'limit': 2, 'cursor': ''})
+    data = response.get_json()
+    assert response.status_code == 200
+    assert len(data['products']) == 2
+    assert 'description' not in data['products'][0]
+    seen = [p['id'] for p in data['products']]
+    while data['next_cursor']:
+        data = client.get('/api/v1/admin/products', headers=admin_headers,
+            query_string={'q': 'Шелк', 'limit': 2, 'cursor': data['next_cursor']}).get_json()
+        seen += [p['id'] for p in data['products']]
+    assert len(seen) == 5
+    assert seen == sorted(seen, reverse=True)
+    
+    data = client.get('/api/v1/admin/products', headers=admin_headers,
+        query_string={'low_stock': 'true', 'fields': 'title,stock'}).get_json()
+    assert data['total'] == 2
+    assert set(data['products'][0]) == {'id', 'title', 'stock'}
+    
+    response = client.get('/api/v1/admin/products', headers=admin_headers,
+        query_string={'fields': 'title,password_hash'})
+    assert response.status_code == 400
+
+def test_list_all_products_stream(admin_headers, client, app):
+    """Тест потоковой выдачи всех товаров одним JSON"""
+    with app.app_context():
+        for i in range(3):
+            db.session.add(Product(title=f'Товар {i}', price=1.0, stock=1))
+        db.session.commit()
+    
+    response = client.get('/api/v1/admin/products', headers=admin_headers,
+        query_string={'stream': 'true', 'fields': 'title,price'})
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data['success'] == True
+    assert [p['title'] for p in data['products']] == ['Товар 2', 'Товар 1', 'Товар 0']
+
+def test_list_all_users_with_order_totals(admin_headers, client, app):
+    """Тест списка пользователей: поиск по префиксу и агрегаты заказов"""
+    from models import User, Order, ArchivedOrder
+    
+    with app.app_context():
+        buyer = User(first_name='Ирина', last_name='Швец', email='irina@example.com', password_hash='x')
+        other = User(first_name='Олег', last_name='Портной', email='oleg@example.com', password_hash='x')
+        db.session.add_all([buyer, other])
+        db.session.flush()
+        db.session.add_all([
+            Order(user_id=buyer.id, total=100.0, status='paid'),
+            Order(user_id=buyer.id, total=50.0, status='cancelled'),
+            ArchivedOrder(id=9999, user_id=buyer.id, total=25.5, status='delivered'),
+        ])
+        db.session.commit()
+        buyer_id = buyer.id
+    
+    data = client.get('/api/v1/admin/users', headers=admin_headers,
+        query_string={'q': 'iri'}).get_json()
+    assert [u['id'] for u in data['users']] == [buyer_id]
+    assert data['users'][0]['orders_count'] == 3
+    assert data['users'][0]['lifetime_spend'] == 125.5
+    
+    data = client.get('/api/v1/admin/users', headers=admin_headers,
+        query_string={'limit': 1, 'cursor': ''}).get_json()
+    emails = [u['email'] for u in data['users']]
+    while data['next_cursor']:
+        data = client.get('/api/v1/admin/users', headers=admin_headers,
+            query_string={'limit': 1, 'cursor': data['next_cursor']}).get_json()
+        emails += [u['email'] for u in data['users']]
+    assert sorted(emails) == ['admin@example.com', 'irina@example.com', 'oleg@example.com']
+    
+    data = client.get(f'/api/v1/admin/users/{buyer_id}', headers=admin_headers).get_json()
+    assert data['user']['orders_count'] == 3
+
+def test_bulk_update_products(admin_headers, client, app):
+    """Тест массового обновления цен и остатков с точечным сбросом кэша"""
+    with app.app_context():
+        products = [Product(title=f'Ткань {i}', price=100.0, stock=10) for i in range(4)]
+        db.session.add_all(products)
+        db.session.commit()
+        ids = [p.id for p in products]
+    
+    # Прогреваем кэш карточки и списка
+    client.get(f'/api/v1/catalog/products/{ids[0]}')
+    listing = client.get('/api/v1/catalog/products').get_json()
+    assert listing['items'][-1]['price'] == 100.0
+    
+    response = client.patch('/api/v1/admin/products', headers=admin_headers, json=[
+        {'id': ids[0], 'price': 150.0},
+        {'id': ids[1], 'stock': 0},
+        {'id': ids[2], 'price': 90.5, 'stock': 3},
+        {'id': 999999, 'price': 1.0},
+    ])
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data['updated'] == 3
+    assert data['not_found'] == [999999]
+    
+    with app.app_context():
+        assert db.session.get(Product, ids[0]).price == 150.0
+        assert db.session.get(Product, ids[1]).stock == 0
+        assert db.session.get(Product, ids[2]).stock == 3
+        assert db.session.get(Product, ids[3]).price == 100.0
+    
+    detail = client.get(f'/api/v1/catalog/products/{ids[0]}').get_json()
+    assert detail['product']['price'] == 150.0
+    listing = client.get('/api/v1/catalog/products').get_json()
+    assert {p['id']: p['price'] for p in listing['items']}[ids[0]] == 150.0
+    
+    response = client.patch('/api/v1/admin/products', headers=admin_headers,
+        json=[{'id': ids[0], 'price': 1.0}, {'id': ids[1], 'price': -1}])
+    assert response.status_code == 400
+    assert [e['index'] for e in response.get_json()['errors']] == [1]
+    
+    response = client.patch('/api/v1/admin/products', headers=admin_headers, json=[{'id': ids[0]}])
+    assert response.status_code == 400
@@ -137,3 +137,276 @@ def test_update_profile(auth_headers, client):
     assert data['success'] == True
     assert data['user']['first_name'] == 'Updated'
     assert data['user']['last_name'] == 'Name'
+
+def test_login_token_has_role_claims(admin_headers, client, app):
+    """Тест: роль и версия пользователя в claims access-токена"""
+    from flask_jwt_extended import decode_token
+    
+    token = admin_headers['Authorization'].split()[1]
+    with app.app_context():
+        claims = decode_token(token)
+    assert claims['role'] == 'admin'
+    assert claims['ver'] == 1
+
+def test_identity_cache_avoids_db(app):
+    """Тест: повторная проверка идентичности берется из кэша без запросов к БД"""
+    from sqlalchemy import event
+    from services.identity import IdentityCache
+    
+    with app.app_context():
+        user = User(first_name='C', last_name='C', email='cache@example.com', password_hash='x', role='admin')
+        db.session.add(user)
+        db.session.commit()
+        user_id = user.id
+        
+        statements = []
+        listener = lambda *args: statements.append(args[2])
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        try:
+            cache = IdentityCache(ttl=60)
+            assert cache.get(user_id) == ('admin', 1)
+            assert cache.get(user_id) == ('admin', 1)
+            assert len(statements) == 1
+            cache.invalidate(user_id)
+            assert cache.get(user_id) == ('admin', 1)
+            assert len(statements) == 2
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listener)
+
+def test_role_change_revokes_tokens(admin_headers, client, app):
+    """Тест: после снятия роли администратора старый токен не принимается"""
+    with app.app_context():
+        other = User(first_name='Second', last_name='Admin', email='second@example.com', role='admin')
+        other.set_password('secondpass123')
+        db.session.add(other)
+        db.session.commit()
+        other_id = other.id
+    
+    token = client.post('/api/v1/auth/login',
+        json={'email': 'second@example.com', 'password': 'secondpass123'}).get_json()['access_token']
+    other_headers = {'Authorization': f'Bearer {token}'}
+    assert client.get('/api/v1/admin/stats', headers=other_headers).status_code == 200
+    
+    response = client.put(f'/api/v1/admin/users/{other_id}', headers=admin_headers, json={'role': 'user'})
+    assert response.status_code == 200
+    
+    assert client.get('/api/v1/admin/stats', headers=other_headers).status_code == 401
+
+def test_login_rehashes_outdated_password(client, app):
+    """Тест: хэш со старыми параметрами пересчитывается при входе"""
+    from werkzeug.security import generate_password_hash
+    
+    with app.app_context():
+        user = User(first_name='Old', last_name='Hash', email='oldhash@example.com',
+                    password_hash=generate_password_hash('oldpass123', method='pbkdf2:sha256:1000'))
+        db.session.add(user)
+        db.session.commit()
+    
+    response = client.post('/api/v1/auth/login',
+        json={'email': 'oldhash@example.com', 'password': 'oldpass123'})
+    assert response.status_code == 200
+    
+    with app.app_context():
+        user = User.query.filter_by(email='oldhash@example.com').first()
+        assert user.password_hash.startswith(app.config['PASSWORD_HASH_METHOD'] + '$')
+        assert user.check_password('oldpass123')
+
+def test_needs_rehash_fills_default_parameters(app):
+    """Тест: параметры по умолчанию не считаются отличием от PASSWORD_HASH_METHOD"""
+    from services.passwords import needs_rehash
+    
+    app.config['PASSWORD_HASH_METHOD'] = 'pbkdf2'
+    assert not needs_rehash('pbkdf2:sha256:600000$salt$hash')
+    assert needs_rehash('pbkdf2:sha256:1000$salt$hash')
+    assert needs_rehash('scrypt:32768:8:1$salt$hash')
+    app.config['PASSWORD_HASH_METHOD'] = 'scrypt:32768'
+    assert not needs_rehash('scrypt:32768:8:1$salt$hash')
+    assert needs_rehash('scrypt:16384:8:1$salt$hash')
+    assert needs_rehash('garbage:x:y$salt$hash') and needs_rehash('scrypt:abc$salt$hash')
+
+def test_password_hashing_back_pressure(app, monkeypatch):
+    """Тест: при переполненной очереди хэширования - 503"""
+    import threading
+    from errors import ServiceUnavailableError
+    from services import passwords
+    
+    app.config['PASSWORD_HASH_QUEUE_TIMEOUT'] = 0.01
+    slots = threading.BoundedSemaphore(1)
+    slots.acquire()
+    monkeypatch.setattr(passwords, '_get_pool', lambda workers, max_pending: (None, slots))
+    with app.app_context():
+        with pytest.raises(ServiceUnavailableError):
+            passwords.hash_password('secret')
+
+def test_logout_revokes_tokens(client, auth_headers):
+    """Тест: после выхода access- и refresh-токены не принимаются"""
+    response = client.post('/api/v1/auth/login',
+        json={'email': 'test@example.com', 'password': 'testpass123'})
+    tokens = response.get_json()
+    access = {'Authorization': f"Bearer {tokens['access_token']}"}
+    refresh = {'Authorization': f"Bearer {tokens['refresh_token']}"}
+    
+    response = client.post('/api/v1/auth/refresh', headers=refresh)
+    assert response.status_code == 200
+    new_access = {'Authorization': f"Bearer {response.get_json()['access_token']}"}
+    assert client.get('/api/v1/auth/me', headers=new_access).status_code == 200
+    
+    response = client.post('/api/v1/auth/logout', headers=access,
+        json={'refresh_token': tokens['refresh_token']})
+    assert response.status_code == 200
+    assert client.get('/api/v1/auth/me', headers=access).status_code == 401
+    assert client.post('/api/v1/auth/refresh', headers=refresh).status_code == 401
+    # Другие сессии пользователя продолжают работать
+    assert client.get('/api/v1/auth/me', headers=auth_headers).status_code == 200
+
+def test_token_denylist_expiry():
+    """Тест denylist: нет ложноотрицательных ответов, записи истекают"""
+    import time
+    from services.revocation import TokenDenylist
+    
+    denylist = TokenDenylist(capacity=100)
+    now = time.time()
+    for i in range(300):
+        denylist.revoke(f'jti-{i}', now + 3600)
+    denylist.revoke('short', now + 0.05)
+    assert all(denylist.is_revoked(f'jti-{i}') for i in range(300))
+    assert not denylist.is_revoked('never-revoked')
+    
+    time.sleep(0.1)
+    assert not denylist.is_revoked('short')
+    denylist.sweep()
+    assert len(denylist) == 300
+    assert denylist.is_revoked('jti-0')
+
+def test_token_denylist_shared_sqlite(tmp_path):
+    """Тест denylist: отзыв в одном воркере виден другому через общий файл SQLite"""
+    import time
+    from services.revocation import TokenDenylist
+    
+    path = str(tmp_path / 'denylist.db')
+    first = TokenDenylist(sqlite_path=path, capacity=100, poll_interval=0.05)
+    second = TokenDenylist(sqlite_path=path, capacity=100, poll_interval=0.05)
+    try:
+        first.revoke('shared', time.time() + 3600)
+        deadline = time.time() + 5
+        while not second.is_revoked('shared') and time.time() < deadline:
+            time.sleep(0.02)
+        assert second.is_revoked('shared')
+        # Новый воркер читает отзывы при старте
+        third = TokenDenylist(sqlite_path=path, capacity=100)
+        assert third.is_revoked('shared')
+        third.close()
+    finally:
+        first.close()
+        second.close()
+
+def test_token_denylist_threads_start_per_process(tmp_path, monkeypatch):
+    """Тест denylist: фоновые потоки запускаются при первом обращении в каждом процессе"""
+    import time
+    import services.revocation as revocation
+    
+    path = str(tmp_path / 'denylist.db')
+    denylist = revocation.TokenDenylist(sqlite_path=path, capacity=100, poll_interval=0.05)
+    assert denylist._maintainer is None
+    
+    try:
+        denylist.is_revoked('nothing')
+        parent, parent_stop = denylist._maintainer, denylist._stop
+        assert parent.is_alive()
+        
+        # После fork pid другой, а потоки мастера в воркер не переходят
+        monkeypatch.setattr(revocation.os, 'getpid', lambda: -1)
+        revocation.TokenDenylist(sqlite_path=path, capacity=100).revoke('late', time.time() + 3600)
+        denylist.is_revoked('late')
+        assert denylist._maintainer is not parent
+        assert denylist._maintainer.is_alive()
+        
+        deadline = time.time() + 5
+        while not denylist.is_revoked('late') and time.time() < deadline:
+            time.sleep(0.02)
+        assert denylist.is_revoked('late')
+    finally:
+        denylist.close()
+        parent_stop.set()
+    
+    parent.join(timeout=1)
+    assert not parent.is_alive()
+
+
+def test_password_reset_with_hashed_code(auth_headers, client, app):
+    """Тест восстановления пароля: код хранится только в виде HMAC"""
+    import re
+    from models import OutboundEmail, PasswordResetCode
+    
+    client.post('/api/v1/auth/forgot-password', json={'email': 'test@example.com'})
+    client.post('/api/v1/auth/resend-code', json={'email': 'test@example.com'})
+    # Повторная отправка заменяет прежний код
+    assert PasswordResetCode.query.count() == 1
+    body = OutboundEmail.query.order_by(OutboundEmail.id.desc()).first().body
+    code = re.search(r'\d{6}', body).group()
+    assert PasswordResetCode.query.one().code_hash != code
+    
+    response = client.post('/api/v1/auth/verify-code', json={'email': 'test@example.com', 'code': code})
+    assert response.status_code == 200
+    wrong = '000000' if code != '000000' else '111111'
+    response = client.post('/api/v1/auth/verify-code', json={'email': 'test@example.com', 'code': wrong})
+    assert response.status_code == 401
+    
+    response = client.post('/api/v1/auth/reset-password', json={
+        'email': 'test@example.com', 'code': code, 'new_password': 'newpass123'
+    })
+    assert response.status_code == 200
+    response = client.post('/api/v1/auth/login', json={'email': 'test@example.com', 'password': 'newpass123'})
+    assert response.status_code == 200
+    # Использованный код повторно не принимается
+    response = client.post('/api/v1/auth/verify-code', json={'email': 'test@example.com', 'code': code})
+    assert response.status_code == 401
+
+def test_reset_codes_purge(app):
+    """Тест очистки кодов: истекшие и использованные удаляются пачками"""
+    from datetime import datetime, timedelta
+    from models import PasswordResetCode
+    from services.reset_codes import purge_reset_codes, issue_reset_code
+    
+    past = datetime.utcnow() - timedelta(minutes=1)
+    for i in range(7):
+        db.session.add(PasswordResetCode(email=f'old{i}@example.com', code_hash=f'{i:064d}', expires_at=past))
+    db.session.add(PasswordResetCode(
+        email='used@example.com', code_hash='u' * 64,
+        expires_at=datetime.utcnow() + timedelta(minutes=5), used=True
+    ))
+    issue_reset_code('active@example.com')
+    db.session.commit()
+    
+    assert purge_reset_codes(batch_size=3) == 8
+    assert [c.email for c in PasswordResetCode.query.all()] == ['active@example.com']
+
+def test_login_lockout_skips_password_check(auth_headers, client, app, monkeypatch):
+    """Тест блокировки входа: после лимита неудач пароль не проверяется"""
+    import time
+    app.config.update(
+        LOGIN_THROTTLE_EMAIL_FREE_ATTEMPTS=2,
+        LOGIN_THROTTLE_IP_FREE_ATTEMPTS=4,
+        LOGIN_THROTTLE_BASE_DELAY=0.2
+    )
+    checks = []
+    original = User.check_password
+    monkeypatch.setattr(User, 'check_password', lambda self, password: checks.append(1) or original(self, password))
+    
+    def login(email, password):
+        return client.post('/api/v1/auth/login', json={'email': email, 'password': password})
+    
+    assert login('test@example.com', 'wrong-pass').status_code == 401
+    assert login('test@example.com', 'wrong-pass').status_code == 401
+    response = login('test@example.com', 'testpass123')
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == '1'
+    assert len(checks) == 2
+    
+    # Неудачи по разным email с одного IP блокируют IP
+    assert login('other1@example.com', 'wrong-pass').status_code == 401
+    assert login('other2@example.com', 'wrong-pass').status_code == 401
+    assert login('other3@example.com', 'whatever1').status_code == 429
+    
+    time.sleep(0.5)
+    assert login('test@example.com', 'testpass123').status_code == 200
@@ -0,0 +1,78 @@
+"""
+Тесты для копий изображений (srcset)
+"""
+import io
+import os
+import time
+import pytest
+from PIL import Image
+from models import db, ImageVariant
+from services.images import build_variants, image_set
+
+def _jpeg_with_exif(size=(1600, 1200), orientation=6):
+    exif = Image.Exif()
+    exif[0x0112] = orientation  # Orientation: повернуть на 90 градусов
+    exif[0x010F] = "Camera"  # Make
+    buffer = io.BytesIO()
+    Image.new("RGB", size, "green").save(buffer, "JPEG", exif=exif)
+    buffer.seek(0)
+    return buffer
+
+@pytest.fixture
+def upload_folder(app, tmp_path):
+    folder = tmp_path / "products"
+    folder.mkdir()
+    app.config['PRODUCTS_UPLOAD_FOLDER'] = str(folder)
+    return folder
+
+def test_build_variants_strips_exif(tmp_path):
+    """Копии строятся по ширинам меньше исходной, с учетом поворота и без EXIF"""
+    source = tmp_path / "photo.jpg"
+    source.write_bytes(_jpeg_with_exif().getvalue())
+
+    variants = build_variants(str(source), [320, 640, 1280], 80)
+
+    # После поворота исходник 1200x1600: ширина 1280 пропускается
+    assert sorted({(v['width'], v['height']) for v in variants}) == [(320, 427), (640, 853)]
+    assert {v['format'] for v in variants} == {'webp', 'jpeg'}
+    for variant in variants:
+        with Image.open(tmp_path / variant['filename']) as image:
+            assert image.size == (variant['width'], variant['height'])
+            assert not image.getexif()
+
+def test_product_upload_returns_srcset(admin_headers, client, app, upload_folder):
+    """Загрузка изображения товара дает наборы копий в каталоге"""
+    app.config['IMAGE_WORKERS'] = 0
+    response = client.post('/api/v1/admin/products', headers=admin_headers, data={
+        'title': 'Шелк', 'price': '1200', 'stock': '3',
+        'image': (_jpeg_with_exif(size=(800, 600), orientation=1), 'silk.jpg')
+    }, content_type='multipart/form-data')
+    assert response.status_code == 201
+    product_id = response.get_json()['product']['id']
+
+    detail = client.get(f'/api/v1/catalog/products/{product_id}').get_json()['product']
+    image_set_data = detail['image_sets'][detail['image']]
+    assert [v['width'] for v in image_set_data['variants'] if v['format'] == 'webp'] == [320, 640]
+    assert image_set_data['srcset']['webp'].endswith('.w640.webp 640w')
+
+    items = client.get('/api/v1/catalog/products').get_json()['items']
+    assert items[0]['image_set']['srcset']['jpeg'].count('w,') == 1
+    stored = [name for _, _, names in os.walk(upload_folder) for name in names]
+    assert len(stored) == 5  # исходник + 2 ширины x 2 формата
+
+def test_variants_built_in_process_pool(app, tmp_path):
+    """Пайплайн строит копии в пуле процессов и записывает их после завершения"""
+    app.config['IMAGE_WORKERS'] = 1
+    source = tmp_path / "work.jpg"
+    source.write_bytes(_jpeg_with_exif(size=(700, 700), orientation=1).getvalue())
+
+    future = app.image_pipeline.submit(str(source), 'static/works/work.jpg', [320])
+    future.result(timeout=60)
+    for _ in range(100):
+        db.session.expire_all()
+        if ImageVariant.query.count() == 2:
+            break
+        time.sleep(0.05)
+    result = image_set('static/works/work.jpg')
+    assert {v['format'] for v in result['variants']} == {'webp', 'jpeg'}
+    assert result['variants'][0]['url'] == 'static/works/work.w320.jpg'
@@ -0,0 +1,189 @@
+"""
+Тесты для очереди исходящих писем
+"""
+import re
+import socket
+import socketserver
+import threading
+import pytest
+from models import db, User, OutboundEmail, PasswordResetCode
+from services.mailer import MailDispatcher
+from services.reset_codes import hash_reset_code
+
+@pytest.fixture
+def smtp_sink():
+    """Минимальный локальный SMTP-сервер, собирающий письма"""
+    received = []
+    sessions = []
+
+    class Handler(socketserver.StreamRequestHandler):
+        def reply(self, line):
+            self.wfile.write(line.encode() + b"\r\n")
+
+        def handle(self):
+            sessions.append(self.client_address)
+            self.reply("220 sink ready")
+            while True:
+                line = self.rfile.readline()
+                if not line:
+                    return
+                command = line.decode().strip().upper()
+                if command.startswith(("EHLO", "HELO")):
+                    self.reply("250 sink")
+                elif command == "DATA":
+                    self.reply("354 end with .")
+                    data = []
+                    while True:
+                        chunk = self.rfile.readline()
+                        if chunk in (b".\r\n", b".\n", b""):
+                            break
+                        data.append(chunk)
+                    received.append(b"".join(data).decode())
+                    self.reply("250 queued")
+                elif command == "QUIT":
+                    self.reply("221 bye")
+                    return
+                else:  # MAIL, RCPT, NOOP, RSET
+                    self.reply("250 ok")
+
+    server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server.server_address[1], received, sessions
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture
+def mail_config(app):
+    def configure(port):
+        app.config.update(
+            MAIL_SERVER='127.0.0.1',
+            MAIL_PORT=port,
+            MAIL_USE_TLS=False,
+            MAIL_USE_SSL=False,
+            MAIL_USERNAME=None,
+            MAIL_DEFAULT_SENDER='shop@example.com',
+            MAIL_TIMEOUT=5
+        )
+    return configure
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def test_forgot_password_enqueues_email(client, app):
+    """Запрос кода только ставит письмо в очередь вместе с кодом"""
+    user = User(first_name='Mail', last_name='User', email='mail@example.com')
+    user.set_password('password123')
+    db.session.add(user)
+    db.session.commit()
+
+    response = client.post('/api/auth/forgot-password', json={'email': 'mail@example.com'})
+    assert response.status_code == 200
+
+    email = OutboundEmail.query.one()
+    reset_code = PasswordResetCode.query.filter_by(email='mail@example.com').one()
+    assert email.recipient == 'mail@example.com'
+    assert email.status == 'pending'
+    code = re.search(r'\d{6}', email.body).group()
+    assert reset_code.code_hash == hash_reset_code('mail@example.com', code)
+
+def test_send_batch_reuses_connection(app, smtp_sink, mail_config):
+    """Пачки уходят через одно SMTP-соединение и помечаются отправленными"""
+    port, received, sessions = smtp_sink
+    mail_config(port)
+    for i in range(3):
+        db.session.add(OutboundEmail(recipient=f'user{i}@example.com', subject='Тест', body=f'Письмо {i}'))
+    db.session.commit()
+
+    dispatcher = MailDispatcher(app)
+    app.config['MAIL_BATCH_SIZE'] = 2
+    try:
+        assert dispatcher.send_batch() == 2
+        assert dispatcher.send_batch() == 1
+    finally:
+        dispatcher.close()
+
+    assert len(received) == 3
+    assert len(sessions) == 1
+    assert OutboundEmail.query.filter_by(status='sent').count() == 3
+
+def test_send_batch_retries_with_backoff(app, mail_config):
+    """Недоступный сервер откладывает письмо с экспоненциальной задержкой"""
+    mail_config(_free_port())
+    db.session.add(OutboundEmail(recipient='retry@example.com', subject='Тест', body='Текст'))
+    db.session.commit()
+
+    dispatcher = MailDispatcher(app)
+    assert dispatcher.send_batch() == 0
+    email = OutboundEmail.query.one()
+    assert email.status == 'pending'
+    assert email.attempts == 1
+    assert email.last_error.startswith('connect:')
+    assert email.next_attempt_at > email.created_at
+
+    # Следующая попытка еще не наступила
+    assert dispatcher.send_batch() == 0
+    assert OutboundEmail.query.one().attempts == 1
+
+def test_send_batch_reconnects_only_on_connection_loss(app, mail_config, monkeypatch):
+    """Отказ по одному письму не рвет пачку; разрыв соединения закрывает его"""
+    import smtplib
+    mail_config(_free_port())
+    for name in ('rejected', 'ok', 'dropped', 'later'):
+        db.session.add(OutboundEmail(recipient=f'{name}@example.com', subject='Тест', body='Текст'))
+    db.session.commit()
+
+    class FakeSMTP:
+        closed = False
+
+        def send_message(self, message):
+            if message['To'] == 'rejected@example.com':
+                raise smtplib.SMTPDataError(554, b'rejected')
+            if message['To'] == 'dropped@example.com':
+                raise smtplib.SMTPServerDisconnected('gone')
+
+        def quit(self):
+            raise smtplib.SMTPServerDisconnected('gone')
+
+        def close(self):
+            self.closed = True
+
+    smtp = FakeSMTP()
+    dispatcher = MailDispatcher(app)
+    monkeypatch.setattr(dispatcher, '_connection', lambda config: setattr(dispatcher, '_smtp', smtp) or smtp)
+    assert dispatcher.send_batch() == 1
+
+    status = {e.recipient.split('@')[0]: (e.status, e.attempts) for e in OutboundEmail.query}
+    assert status['ok'] == ('sent', 0)
+    assert status['rejected'] == ('pending', 1)
+    assert status['dropped'] == ('pending', 1)
+    assert status['later'] == ('pending', 0)
+    assert smtp.closed and dispatcher._smtp is None
+
+def test_reset_code_erased_after_sending(client, app, smtp_sink, mail_config):
+    """Тело письма с кодом стирается после отправки, строка удаляется по сроку"""
+    from datetime import datetime, timedelta
+    port, received, _ = smtp_sink
+    mail_config(port)
+    user = User(first_name='Mail', last_name='User', email='erase@example.com')
+    user.set_password('password123')
+    db.session.add(user)
+    db.session.commit()
+    client.post('/api/auth/forgot-password', json={'email': 'erase@example.com'})
+
+    dispatcher = MailDispatcher(app)
+    try:
+        assert dispatcher.send_batch() == 1
+    finally:
+        dispatcher.close()
+    assert re.search(r'\d{6}', received[0])
+    email = OutboundEmail.query.one()
+    assert email.sensitive and email.status == 'sent' and email.body == ''
+
+    email.created_at = datetime.utcnow() - timedelta(hours=2)
+    db.session.commit()
+    assert dispatcher.purge_sent() == 1
+    assert OutboundEmail.query.count() == 0
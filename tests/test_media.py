@@ -0,0 +1,231 @@
+"""
+Тесты для хранилища загрузок по хэшу содержимого и отдачи файлов
+"""
+import io
+import os
+import threading
+import time
+import pytest
+from PIL import Image
+from models import db, MediaBlob, Product
+from services.media import collect_media, retain_media, store_stream
+from services.media_cache import DiskLRU
+
+def _png(color="red"):
+    buffer = io.BytesIO()
+    Image.new("RGB", (40, 30), color).save(buffer, "PNG")
+    buffer.seek(0)
+    return buffer
+
+def _jpeg(width, height):
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, height), "purple").save(buffer, "JPEG")
+    return buffer.getvalue()
+
+def _files(folder):
+    return sorted(os.path.relpath(os.path.join(d, n), folder) for d, _, names in os.walk(folder) for n in names)
+
+@pytest.fixture
+def upload_folder(app, tmp_path):
+    folder = tmp_path / "products"
+    app.config['PRODUCTS_UPLOAD_FOLDER'] = str(folder)
+    app.config['IMAGE_WORKERS'] = 0
+    return folder
+
+def _create_product(client, headers, title, image):
+    response = client.post('/api/v1/admin/products', headers=headers, data={
+        'title': title, 'price': '500', 'image': (image, f'{title}.png')
+    }, content_type='multipart/form-data')
+    assert response.status_code == 201
+    return response.get_json()['product']
+
+def test_same_upload_stored_once(admin_headers, client, app, upload_folder):
+    """Одинаковые файлы под разными именами хранятся один раз в шардированном каталоге"""
+    first = _create_product(client, admin_headers, 'red', _png())
+    second = _create_product(client, admin_headers, 'ruby', _png())
+
+    assert first['image'] == second['image']
+    shard, name = first['image'].split('/', 2)[2].rsplit('/', 1)
+    assert len(shard.split('/')) == 2 and name.startswith(shard.replace('/', ''))
+    assert [f for f in _files(upload_folder) if '.w' not in f] == [os.path.join(*first['image'].split('/')[2:])]
+    assert db.session.query(MediaBlob.ref_count).filter_by(path=first['image']).scalar() == 2
+
+def test_deleted_products_release_files(admin_headers, client, app, upload_folder):
+    """Удаление товаров снимает ссылки, media-gc удаляет файл вместе с копиями"""
+    products = [_create_product(client, admin_headers, title, _png("blue")) for title in ('a', 'b')]
+    path = products[0]['image']
+    assert client.delete(f"/api/v1/admin/products/{products[0]['id']}", headers=admin_headers).status_code == 200
+
+    assert collect_media(grace_seconds=0) == 0  # вторая ссылка еще есть
+    assert db.session.query(MediaBlob.ref_count).filter_by(path=path).scalar() == 1
+
+    assert client.delete(f"/api/v1/admin/products/{products[1]['id']}", headers=admin_headers).status_code == 200
+    assert collect_media(grace_seconds=3600) == 0  # срок ожидания еще не прошел
+    assert collect_media(grace_seconds=0) == 1
+    assert _files(upload_folder) == []
+    assert MediaBlob.query.count() == 0
+
+def test_gc_recounts_references_and_removes_stray_files(app, upload_folder):
+    """Счетчики сверяются со ссылками; файлы без записи удаляются после срока ожидания"""
+    kept = store_stream(_png("green"), str(upload_folder), "static/products", "png")
+    stray = store_stream(_png("white"), str(upload_folder), "static/products", "png")
+    db.session.add(Product(title='Ситец', price=100, image=kept.stored))
+    db.session.commit()
+
+    assert collect_media(grace_seconds=0) == 1
+    assert os.path.exists(kept.path) and not os.path.exists(stray.path)
+    assert db.session.query(MediaBlob.ref_count).filter_by(path=kept.stored).scalar() == 1
+
+def test_gc_skips_blob_referenced_concurrently(app, upload_folder, monkeypatch):
+    """Ссылка, добавленная во время сборки, сохраняет файл; retain_media - один upsert"""
+    from datetime import datetime, timedelta
+    import services.media
+    media = store_stream(_png("yellow"), str(upload_folder), "static/products", "png")
+    retain_media(media.stored)
+    retain_media(media.stored)
+    db.session.commit()
+    assert db.session.query(MediaBlob.ref_count).filter_by(path=media.stored).scalar() == 2
+    MediaBlob.query.update({'ref_count': 0, 'updated_at': datetime.utcnow() - timedelta(days=1)})
+    db.session.commit()
+
+    count_references = services.media.count_references
+
+    def racing_references():
+        references = count_references()
+        db.session.add(Product(title='Сатин', price=100, image=media.stored))
+        retain_media(media.stored)
+        db.session.commit()
+        return references
+
+    monkeypatch.setattr(services.media, 'count_references', racing_references)
+    assert collect_media(grace_seconds=0) == 0
+    assert os.path.exists(media.path)
+    assert db.session.query(MediaBlob.ref_count).filter_by(path=media.stored).scalar() == 1
+
+def test_content_addressed_work_image_is_immutable(client, app, tmp_path):
+    """Изображение работы по хэшу отдается с долгим immutable-кэшированием"""
+    app.config['WORKS_UPLOAD_FOLDER'] = str(tmp_path)
+    media = store_stream(_png(), str(tmp_path), "static/works", "png")
+    relpath = media.stored.split('/', 2)[2]
+
+    response = client.get(f'/api/v1/works/image/{relpath}')
+    assert response.status_code == 200
+    assert response.cache_control.max_age == 31536000
+    assert response.cache_control.immutable
+
+@pytest.fixture
+def served(app, tmp_path):
+    """Файл по хэшу и файл со старым именем в каталоге товаров"""
+    app.config['PRODUCTS_UPLOAD_FOLDER'] = str(tmp_path)
+    media = store_stream(_png(), str(tmp_path), "static/products", "png")
+    (tmp_path / "legacy_photo.png").write_bytes(_png("blue").getvalue())
+    return media
+
+def test_media_conditional_and_range(client, served):
+    """Сильный ETag, 304 по If-None-Match и 206 по Range"""
+    response = client.get(f'/{served.stored}')
+    assert response.status_code == 200
+    etag = os.path.basename(served.path).split('.')[0]
+    assert response.get_etag() == (etag, False)
+    assert response.cache_control.immutable and response.accept_ranges == 'bytes'
+
+    assert client.get(f'/{served.stored}', headers={'If-None-Match': f'"{etag}"'}).status_code == 304
+    partial = client.get(f'/{served.stored}', headers={'Range': 'bytes=0-9'})
+    assert partial.status_code == 206 and partial.data == response.data[:10]
+
+    legacy = client.get('/static/products/legacy_photo.png')
+    assert legacy.cache_control.max_age == 86400 and not legacy.cache_control.immutable
+    assert legacy.get_etag()[1] is False
+    assert client.get('/static/products/../products/legacy_photo.png').status_code == 404
+
+def test_media_offloaded_to_proxy(client, app, served):
+    """При MEDIA_OFFLOAD тело файла отдает прокси"""
+    app.config['MEDIA_OFFLOAD'] = 'x-accel-redirect'
+    response = client.get(f'/{served.stored}')
+    relpath = served.stored.split('/', 2)[2]
+    assert response.headers['X-Accel-Redirect'] == f'/protected-media/products/{relpath}'
+    assert response.data == b'' and response.mimetype == 'image/png'
+    assert response.cache_control.max_age == 31536000
+    etag = response.headers['ETag']
+    assert client.get(f'/{served.stored}', headers={'If-None-Match': etag}).status_code == 304
+
+    app.config['MEDIA_OFFLOAD'] = 'x-sendfile'
+    response = client.get(f'/{served.stored}')
+    assert response.headers['X-Sendfile'] == served.path
+
+@pytest.fixture
+def media_cache(app, tmp_path):
+    app.config['IMAGE_WORKERS'] = 0
+    app.media_cache = DiskLRU(str(tmp_path / "cache"), 10 * 1024 * 1024)
+    return app.media_cache
+
+def test_resized_media_cached_on_disk(client, app, served, media_cache, monkeypatch):
+    """Копия строится при первом запросе и дальше отдается из кэша"""
+    big = store_stream(io.BytesIO(_jpeg(800, 600)), app.config['PRODUCTS_UPLOAD_FOLDER'], "static/products", "jpg")
+    calls = []
+    run = app.image_pipeline.run
+    monkeypatch.setattr(app.image_pipeline, "run", lambda *args: calls.append(args) or run(*args))
+
+    url = f'/media/{big.stored}?w=320&fmt=webp'
+    response = client.get(url)
+    assert response.status_code == 200 and response.mimetype == 'image/webp'
+    assert Image.open(io.BytesIO(response.data)).size == (320, 240)
+    assert response.cache_control.immutable
+    assert client.get(url, headers={'If-None-Match': response.headers['ETag']}).status_code == 304
+    assert client.get(url).data == response.data
+    assert len(calls) == 1
+
+    # Без параметров - исходный файл; картинка не увеличивается
+    assert client.get(f'/media/{big.stored}').data == open(big.path, 'rb').read()
+    assert Image.open(io.BytesIO(client.get(f'/media/{big.stored}?w=1920').data)).size == (800, 600)
+
+def test_resized_media_whitelist(client, served, media_cache):
+    """Размеры и форматы вне списка отклоняются без обработки"""
+    assert client.get(f'/media/{served.stored}?w=333').status_code == 400
+    assert client.get(f'/media/{served.stored}?h=abc').status_code == 400
+    assert client.get(f'/media/{served.stored}?w=320&fmt=gif').status_code == 400
+    assert client.get('/media/products/missing.png?w=320').status_code == 404
+    assert not os.path.exists(media_cache.directory)
+
+def test_resized_media_cost_and_failures(client, app, served, media_cache, monkeypatch):
+    """Построение копии списывает RESIZE_COST, готовая копия - 1; сбой построения - 500"""
+    from services.ratelimit import RESIZE_COST
+    url = f'/media/{served.stored}?w=320'
+    with app.test_request_context(url):
+        assert app.request_costs() == RESIZE_COST
+    assert client.get(url).status_code == 200
+    with app.test_request_context(url):
+        assert app.request_costs() == 1
+    with app.test_request_context(f'/media/{served.stored}'):
+        assert app.request_costs() == 1
+
+    def broken(*args):
+        raise OSError("no space left on device")
+    monkeypatch.setattr(app.image_pipeline, "run", broken)
+    assert client.get(f'/media/{served.stored}?w=640').status_code == 500
+
+def test_disk_lru_coalesces_and_evicts(tmp_path):
+    """Одновременные промахи строят копию один раз; старые копии вытесняются"""
+    cache = DiskLRU(str(tmp_path), 2500)
+    calls = []
+
+    def render(target):
+        calls.append(target)
+        time.sleep(0.2)
+        with open(target, "wb") as f:
+            f.write(b"x" * 1000)
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_create("a" * 64, "png", render))) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1 and len(set(results)) == 1
+
+    old = time.time() - 600
+    os.utime(results[0], (old, old))
+    cache.get_or_create("b" * 64, "png", render)
+    cache.get_or_create("c" * 64, "png", render)  # 3000 байт > 2500: вытесняется самая старая
+    assert cache.get("a" * 64, "png") is None
+    assert cache.get("c" * 64, "png") is not None
@@ -106,3 +106,299 @@ def test_update_order_status(auth_headers, client, sample_product_for_order):
     assert data['success'] == True
     assert data['status'] == 'paid'
 
+
+def test_my_orders_cursor_pagination(auth_headers, client, app):
+    """Тест keyset-пагинации списка заказов"""
+    from datetime import datetime, timedelta
+    from models import User
+    
+    with app.app_context():
+        user = User.query.filter_by(email='test@example.com').first()
+        base = datetime(2026, 1, 1)
+        for i in range(5):
+            db.session.add(Order(user_id=user.id, total=10.0 + i, status='pending',
+                                 created_at=base + timedelta(days=i)))
+        db.session.commit()
+    
+    seen = []
+    cursor = ''
+    while cursor is not None:
+        response = client.get('/api/v1/orders/my',
+            headers=auth_headers,
+            query_string={'limit': 2, 'cursor': cursor})
+        assert response.status_code == 200
+        data = response.get_json()
+        seen.extend(order['id'] for order in data['orders'])
+        cursor = data['next_cursor']
+    
+    assert len(seen) == 5
+    assert len(set(seen)) == 5
+    
+    response = client.get('/api/v1/orders/my',
+        headers=auth_headers,
+        query_string={'cursor': 'not-a-cursor'})
+    assert response.status_code == 400
+
+def test_order_events_stream(auth_headers, client, app):
+    """Тест SSE-потока: событие приходит после commit смены статуса"""
+    import json
+    from models import User
+    
+    with app.app_context():
+        user = User.query.filter_by(email='test@example.com').first()
+        order = Order(user_id=user.id, total=10.0, status='pending')
+        db.session.add(order)
+        db.session.commit()
+        order_id = order.id
+    
+    token = auth_headers['Authorization'].split()[1]
+    response = client.get('/api/v1/orders/events', query_string={'jwt': token}, buffered=False)
+    assert response.status_code == 200
+    assert response.mimetype == 'text/event-stream'
+    stream = iter(response.response)
+    assert next(stream).startswith(b'retry:')
+    
+    client.put(f'/api/v1/orders/{order_id}/status',
+        headers=auth_headers,
+        json={'status': 'paid'})
+    
+    chunk = next(stream).decode('utf-8')
+    assert chunk.startswith('event: update_order_status')
+    data = json.loads(chunk.split('data: ', 1)[1])
+    assert data['order_id'] == order_id
+    assert data['status'] == 'paid'
+    
+    response.close()
+    assert app.event_broker.subscribers_count() == 0
+
+def test_order_events_not_published_on_rollback(app):
+    """Тест: события откаченной транзакции не публикуются"""
+    from models import User
+    from routes.orders import add_order_history
+    from services.events import ADMIN_TOPIC
+    
+    user = User(first_name='Roll', last_name='Back', email='rollback@example.com', password_hash='x')
+    db.session.add(user)
+    db.session.flush()
+    order = Order(user_id=user.id, total=1.0, status='pending')
+    db.session.add(order)
+    db.session.commit()
+    
+    subscription = app.event_broker.subscribe([ADMIN_TOPIC])
+    add_order_history(order.id, 'paid')
+    db.session.rollback()
+    assert subscription.get(timeout=0.01) is None
+    
+    add_order_history(order.id, 'paid')
+    db.session.commit()
+    assert subscription.get(timeout=0.01)['status'] == 'paid'
+    app.event_broker.unsubscribe(subscription)
+
+def test_event_broker_reconnects_and_resyncs():
+    """Тест: слушатель Redis переподключается после разрыва и просит подписчиков перечитать состояние"""
+    import json
+    import threading
+    from services.events import EventBroker, ADMIN_TOPIC
+    
+    connections = []
+    
+    class FakePubSub:
+        def subscribe(self, channel):
+            connections.append(channel)
+        
+        def listen(self):
+            if len(connections) == 1:
+                raise ConnectionError("Connection reset by peer")
+            yield {"data": json.dumps({"topics": [ADMIN_TOPIC], "data": {"status": "paid"}})}
+            threading.Event().wait()  # соединение живо, новых сообщений нет
+        
+        def close(self):
+            pass
+    
+    class FakeRedis:
+        def pubsub(self, ignore_subscribe_messages=True):
+            return FakePubSub()
+    
+    broker = EventBroker()
+    broker._redis = FakeRedis()
+    subscription = broker.subscribe([ADMIN_TOPIC])
+    assert subscription.get(timeout=5) == {"event": "resync"}
+    assert subscription.get(timeout=5) == {"status": "paid"}
+    assert len(connections) == 2
+
+def test_archived_orders_are_read_on_request(auth_headers, client, app):
+    """Тест архивирования: старые завершенные заказы уходят в архив и читаются по запросу"""
+    from datetime import datetime, timedelta
+    from models import User, OrderItem, OrderHistory, ArchivedOrder
+    from services.archive import archive_orders
+    
+    with app.app_context():
+        user = User.query.filter_by(email='test@example.com').first()
+        product = Product(title='Archive Product', price=3.0, stock=10)
+        db.session.add(product)
+        old = datetime.utcnow() - timedelta(days=400)
+        archived = Order(user_id=user.id, total=6.0, status='delivered', created_at=old)
+        old_pending = Order(user_id=user.id, total=1.0, status='pending', created_at=old)
+        recent = Order(user_id=user.id, total=2.0, status='delivered')
+        db.session.add_all([archived, old_pending, recent])
+        db.session.flush()
+        db.session.add(OrderItem(order_id=archived.id, product_id=product.id, quantity=2, price=3.0))
+        db.session.add(OrderHistory(order_id=archived.id, status='delivered', changed_by='system'))
+        db.session.commit()
+        archived_id = archived.id
+        
+        assert archive_orders(older_than_days=180, batch_size=1) == 1
+        assert db.session.get(Order, archived_id) is None
+        assert db.session.get(ArchivedOrder, archived_id).items[0].quantity == 2
+    
+    hot = client.get('/api/v1/orders/my', headers=auth_headers).get_json()
+    assert archived_id not in [o['id'] for o in hot['orders']]
+    assert hot['total'] == 2
+    
+    everything = client.get('/api/v1/orders/my',
+        headers=auth_headers,
+        query_string={'include_archived': 'true', 'cursor': ''}).get_json()
+    by_id = {o['id']: o for o in everything['orders']}
+    assert len(by_id) == 3
+    assert by_id[archived_id]['archived'] is True
+    assert by_id[archived_id]['items_count'] == 1
+    
+    detail = client.get(f'/api/v1/orders/{archived_id}', headers=auth_headers)
+    assert detail.status_code == 200
+    assert detail.get_json()['history'][0]['status'] == 'delivered'
+
+def test_checkout_queue(auth_headers, client, app, sample_product_for_order):
+    """Тест очереди оформления: 202 с тикетом, заказ создает воркер"""
+    from services.events import user_topic
+    from models import User
+    
+    app.config['CHECKOUT_QUEUE_ENABLED'] = True
+    app.checkout_queue.workers = 0  # обрабатываем тикет вручную
+    
+    client.post('/api/v1/cart/add',
+        json={'product_id': sample_product_for_order, 'quantity': 3})
+    response = client.post('/api/v1/orders/create', headers=auth_headers, json={'phone': '+7 900 000-00-00'})
+    assert response.status_code == 202
+    ticket_id = response.get_json()['ticket_id']
+    assert response.headers['Location'].endswith(f'/orders/checkout/{ticket_id}')
+    
+    response = client.get(f'/api/v1/orders/checkout/{ticket_id}', headers=auth_headers)
+    assert response.get_json()['status'] == 'queued'
+    
+    with app.app_context():
+        user = User.query.filter_by(email='test@example.com').first()
+        subscription = app.event_broker.subscribe([user_topic(user.id)])
+        ticket = app.checkout_queue.process(ticket_id)
+        assert ticket.status == 'completed'
+        # Повторная обработка не создает второй заказ
+        assert app.checkout_queue.process(ticket_id) is None
+        assert Order.query.count() == 1
+        assert db.session.get(Product, sample_product_for_order).stock == 7
+    
+    events = []
+    while (data := subscription.get(timeout=0.01)) is not None:
+        events.append(data)
+    app.event_broker.unsubscribe(subscription)
+    assert any(e.get('event') == 'checkout' and e['ticket_id'] == ticket_id for e in events)
+    
+    data = client.get(f'/api/v1/orders/checkout/{ticket_id}', headers=auth_headers).get_json()
+    assert data['status'] == 'completed'
+    assert data['order']['id'] == data['order_id']
+
+def test_checkout_queue_failed_ticket(auth_headers, client, app, sample_product_for_order):
+    """Тест очереди оформления: товар закончился к моменту обработки"""
+    app.config['CHECKOUT_QUEUE_ENABLED'] = True
+    app.checkout_queue.workers = 0
+    
+    client.post('/api/v1/cart/add',
+        json={'product_id': sample_product_for_order, 'quantity': 1})
+    ticket_id = client.post('/api/v1/orders/create', headers=auth_headers, json={}).get_json()['ticket_id']
+    
+    with app.app_context():
+        db.session.get(Product, sample_product_for_order).stock = 0
+        db.session.commit()
+        ticket = app.checkout_queue.process(ticket_id)
+        assert ticket.status == 'failed'
+        assert ticket.error
+        assert Order.query.count() == 0
+
+def test_checkout_queue_retries_unexpected_errors(auth_headers, client, app, sample_product_for_order, monkeypatch):
+    """Непредвиденная ошибка возвращает тикет в очередь, после лимита попыток - failed"""
+    from datetime import datetime, timedelta
+    from models import CheckoutTicket
+    import routes.orders
+    
+    app.config['CHECKOUT_QUEUE_ENABLED'] = True
+    app.config['CHECKOUT_MAX_ATTEMPTS'] = 2
+    app.checkout_queue.workers = 0
+    
+    client.post('/api/v1/cart/add',
+        json={'product_id': sample_product_for_order, 'quantity': 1})
+    ticket_id = client.post('/api/v1/orders/create', headers=auth_headers, json={}).get_json()['ticket_id']
+    
+    def broken(*args, **kwargs):
+        raise RuntimeError("database is locked")
+    monkeypatch.setattr(routes.orders, 'place_order', broken)
+    
+    with app.app_context():
+        assert app.checkout_queue.process(ticket_id).status == 'queued'
+        ticket = app.checkout_queue.process(ticket_id)
+        assert ticket.status == 'failed' and ticket.attempts == 2
+        assert db.session.get(Product, sample_product_for_order).stock == 10
+        
+        # Тикет, зависший в processing, снова ставится в очередь
+        ticket.status = 'processing'
+        ticket.attempts = 1
+        ticket.updated_at = datetime.utcnow() - timedelta(hours=1)
+        db.session.commit()
+        assert app.checkout_queue.requeue_stale() == 1
+        assert db.session.get(CheckoutTicket, ticket_id).status == 'queued'
+
+def test_place_order_never_oversells(auth_headers, client, app, sample_product_for_order):
+    """Остаток списывается условным UPDATE: заказ по устаревшему остатку отклоняется"""
+    from sqlalchemy import update
+    from routes.orders import place_order
+    from models import User
+    from errors import ValidationError
+    
+    with app.app_context():
+        user = User.query.filter_by(email='test@example.com').first()
+        product = db.session.get(Product, sample_product_for_order)
+        assert product.stock == 10
+        # Параллельный заказ забрал остаток после того, как товар был прочитан
+        db.session.execute(update(Product).where(Product.id == sample_product_for_order)
+                           .values(stock=2).execution_options(synchronize_session=False))
+        with pytest.raises(ValidationError):
+            place_order(user.id, {sample_product_for_order: 6}, {})
+        db.session.rollback()
+        assert db.session.get(Product, sample_product_for_order).stock == 10
+        assert Order.query.count() == 0
+
+def test_checkout_stale_attempt_does_not_complete(auth_headers, client, app, sample_product_for_order, monkeypatch):
+    """Попытка, у которой тикет перехватил другой воркер, откатывает свой заказ"""
+    from models import CheckoutTicket
+    import routes.orders
+    
+    app.config['CHECKOUT_QUEUE_ENABLED'] = True
+    app.checkout_queue.workers = 0
+    
+    client.post('/api/v1/cart/add',
+        json={'product_id': sample_product_for_order, 'quantity': 2})
+    ticket_id = client.post('/api/v1/orders/create', headers=auth_headers, json={}).get_json()['ticket_id']
+    
+    place_order = routes.orders.place_order
+    
+    def slow_place_order(*args, **kwargs):
+        order = place_order(*args, **kwargs)
+        # Пока попытка работала, тикет вернули в очередь и захватили снова
+        CheckoutTicket.query.filter_by(id=ticket_id).update(
+            {'attempts': CheckoutTicket.attempts + 1}, synchronize_session=False
+        )
+        return order
+    monkeypatch.setattr(routes.orders, 'place_order', slow_place_order)
+    
+    with app.app_context():
+        ticket = app.checkout_queue.process(ticket_id)
+        assert ticket.status == 'processing' and ticket.order_id is None
+        assert Order.query.count() == 0
+        assert db.session.get(Product, sample_product_for_order).stock == 10
@@ -0,0 +1,120 @@
+"""
+Тесты для transactional outbox и диспетчера событий
+"""
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import pytest
+from models import db, User, Order, OutboxEvent
+from routes.orders import add_order_history
+from services.outbox import OutboxDispatcher, backoff_delay
+
+@pytest.fixture
+def stub_receiver():
+    """Локальный HTTP-приемник вебхуков"""
+    received = []
+    state = {"status": 200}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            received.append(json.loads(self.rfile.read(length)))
+            self.send_response(state["status"])
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}/events", received, state
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture
+def order_id(app):
+    """Создать заказ для событий"""
+    user = User(first_name='Out', last_name='Box', email='outbox@example.com')
+    user.set_password('password123')
+    db.session.add(user)
+    db.session.flush()
+    order = Order(user_id=user.id, total=10.0, status='pending')
+    db.session.add(order)
+    db.session.commit()
+    return order.id
+
+def test_history_writes_outbox_event_in_same_transaction(app, order_id):
+    """Событие появляется только вместе с записью истории"""
+    add_order_history(order_id, 'paid', changed_by='system')
+    db.session.rollback()
+    assert OutboxEvent.query.count() == 0
+
+    add_order_history(order_id, 'paid', changed_by='system')
+    db.session.commit()
+    event = OutboxEvent.query.one()
+    assert event.event_type == 'order.status_changed'
+    assert json.loads(event.payload)['status'] == 'paid'
+
+def test_dispatch_batch_delivers_events(app, order_id, stub_receiver):
+    """Диспетчер отправляет пачку событий и помечает их доставленными"""
+    url, received, _ = stub_receiver
+    app.config['OUTBOX_WEBHOOKS'] = [url]
+    add_order_history(order_id, 'paid')
+    add_order_history(order_id, 'shipped')
+    db.session.commit()
+
+    assert OutboxDispatcher(app).dispatch_batch() == 2
+    assert len(received) == 1
+    assert [e['data']['status'] for e in received[0]['events']] == ['paid', 'shipped']
+    assert OutboxEvent.query.filter_by(status='delivered').count() == 2
+
+def test_dispatch_batch_retries_with_backoff(app, order_id, stub_receiver):
+    """При ошибке получателя событие остается в очереди с отложенной попыткой"""
+    url, received, state = stub_receiver
+    state["status"] = 500
+    app.config['OUTBOX_WEBHOOKS'] = [url]
+    add_order_history(order_id, 'paid')
+    db.session.commit()
+
+    dispatcher = OutboxDispatcher(app)
+    assert dispatcher.dispatch_batch() == 0
+    event = OutboxEvent.query.one()
+    assert event.status == 'pending'
+    assert event.attempts == 1
+    assert event.next_attempt_at > event.created_at
+
+    # Следующая попытка еще не наступила
+    assert dispatcher.dispatch_batch() == 0
+    assert len(received) == 1
+
+def test_backoff_delay_is_capped():
+    """Задержка растет экспоненциально, но не выше максимума"""
+    assert backoff_delay(1, 5, 3600) == 5
+    assert backoff_delay(3, 5, 3600) == 20
+    assert backoff_delay(20, 5, 3600) == 3600
+
+def test_background_runner_survives_errors(app):
+    """Ошибка итерации не останавливает фоновый поток, stop() завершает цикл"""
+    from services.runner import BackgroundRunner
+    calls = []
+    done = threading.Event()
+
+    class Flaky(BackgroundRunner):
+        default_interval = 0.01
+
+        def run_once(self):
+            calls.append(1)
+            if len(calls) == 1:
+                raise RuntimeError("boom")
+            if len(calls) >= 3:
+                done.set()
+            return False
+
+        def on_exit(self):
+            calls.append("exit")
+
+    runner = Flaky(app).start()
+    assert done.wait(5)
+    runner.stop(timeout=5)
+    assert calls[-1] == "exit"
@@ -0,0 +1,84 @@
+"""
+Тесты для массового импорта товаров из CSV
+"""
+import io
+import os
+import time
+import pytest
+from PIL import Image
+from models import db, Product, Category, Brand
+from services.product_import import ProductImporter, read_csv_rows
+
+CSV_DATA = """sku;title;price;stock;category;brand;image
+S-1;Шелк армани;1200;10;Ткани;Италия;silk.png
+S-2;Лен;800;5;Ткани;;
+S-3;Хлопок;abc;5;;;
+S-4;Вискоза;500;1;Неизвестная;;
+;Бязь;150;100;;;missing.png
+S-1;Шелк армани (новый);1300;7;;;
+"""
+
+@pytest.fixture
+def catalog(app):
+    """Категория и бренд для сопоставления по названию"""
+    with app.app_context():
+        db.session.add(Category(name='Ткани'))
+        db.session.add(Brand(name='Италия', slug='italy'))
+        db.session.add(Product(sku='S-2', title='Лен старый', price=700.0, stock=1))
+        db.session.commit()
+
+@pytest.fixture
+def images_dir(tmp_path):
+    path = tmp_path / "images"
+    path.mkdir()
+    Image.new("RGB", (4, 4), "red").save(path / "silk.png")
+    return str(path)
+
+def test_import_upserts_in_batches(app, catalog, images_dir, tmp_path):
+    """Тест импорта: upsert по sku, ошибки по строкам, изображения"""
+    reports = []
+    with app.app_context():
+        importer = ProductImporter(
+            images_dir=images_dir, batch_size=2, workers=2,
+            upload_folder=str(tmp_path / "products"), progress=lambda r: reports.append(dict(r))
+        )
+        report = importer.run(read_csv_rows(io.StringIO(CSV_DATA)))
+        
+        assert report['processed'] == 6
+        assert report['failed'] == 2
+        assert {e['row'] for e in report['errors']} == {4, 5, 6}
+        assert len(reports) >= 2
+        
+        silk = Product.query.filter_by(sku='S-1').one()
+        assert silk.title == 'Шелк армани (новый)'
+        assert silk.price == 1300.0
+        assert silk.brand_id is not None
+        assert silk.image.startswith(os.path.join('static', 'products'))
+        assert os.listdir(tmp_path / "products")
+        
+        linen = Product.query.filter_by(sku='S-2').one()
+        assert linen.title == 'Лен' and linen.stock == 5
+        assert Product.query.filter_by(title='Бязь').one().image is None
+        assert report['updated'] >= 1
+
+def test_import_api_job_progress(admin_headers, client, app, catalog):
+    """Тест импорта через API: задача в фоне, прогресс по job_id"""
+    csv_bytes = "sku,title,price,stock\nA-1,Атлас,300,3\nA-2,,100,1\n".encode('utf-8')
+    response = client.post('/api/v1/admin/products/import', headers=admin_headers,
+        data={'file': (io.BytesIO(csv_bytes), 'supplier.csv')},
+        content_type='multipart/form-data')
+    assert response.status_code == 202
+    job_id = response.get_json()['job_id']
+    
+    for _ in range(100):
+        job = client.get(f'/api/v1/admin/products/import/{job_id}', headers=admin_headers).get_json()['job']
+        if job['status'] in ('completed', 'failed'):
+            break
+        time.sleep(0.05)
+    assert job['status'] == 'completed'
+    assert job['created'] == 1
+    assert job['failed'] == 1
+    assert job['errors'][0]['row'] == 3
+    
+    with app.app_context():
+        assert Product.query.filter_by(sku='A-1').one().stock == 3
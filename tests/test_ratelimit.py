@@ -0,0 +1,121 @@
+"""
+Тесты для общего хранилища лимитов запросов
+"""
+import multiprocessing
+import pytest
+from limits import parse
+from limits.storage import storage_from_string
+from limits.strategies import SlidingWindowCounterRateLimiter
+from services.ratelimit import SQLiteStorage
+
+def _hit_many(uri, limit, hits, results):
+    """Воркер: сколько запросов из hits пропустил общий лимит"""
+    limiter = SlidingWindowCounterRateLimiter(storage_from_string(uri))
+    item = parse(limit)
+    results.put(sum(limiter.hit(item, "client") for _ in range(hits)))
+
+@pytest.fixture
+def storage_uri(tmp_path):
+    return f"sqlite:///{tmp_path / 'ratelimit.db'}"
+
+def test_sqlite_storage_registered(storage_uri):
+    """Схема sqlite:// доступна Flask-Limiter через storage_from_string"""
+    assert isinstance(storage_from_string(storage_uri), SQLiteStorage)
+
+def test_limit_shared_between_storages(storage_uri):
+    """Два экземпляра (как два воркера) делят один счетчик"""
+    first = SlidingWindowCounterRateLimiter(storage_from_string(storage_uri))
+    second = SlidingWindowCounterRateLimiter(storage_from_string(storage_uri))
+    item = parse("5/minute")
+    assert all(first.hit(item, "ip") for _ in range(3))
+    assert all(second.hit(item, "ip") for _ in range(2))
+    assert not first.hit(item, "ip")
+    assert not second.hit(item, "ip")
+    # Другой клиент считается отдельно
+    assert second.hit(item, "other")
+    assert first.get_window_stats(item, "ip").remaining == 0
+
+def test_sliding_window_weights_previous_window(storage_uri, monkeypatch):
+    """Запросы прошлого окна учитываются пропорционально оставшейся доле"""
+    import services.ratelimit as ratelimit
+    clock = {"now": 6000.0}  # начало окна (кратно 60)
+    monkeypatch.setattr(ratelimit.time, "time", lambda: clock["now"])
+    storage = storage_from_string(storage_uri)
+
+    assert all(storage.acquire_sliding_window_entry("k", 10, 60) for _ in range(10))
+    assert not storage.acquire_sliding_window_entry("k", 10, 60)
+
+    # Середина следующего окна: прошлое окно весит 10 * 0.5 = 5
+    clock["now"] = 6090.0
+    assert sum(storage.acquire_sliding_window_entry("k", 10, 60) for _ in range(10)) == 5
+
+    # Через два окна счетчики истекли
+    clock["now"] = 6240.0
+    assert storage.get_sliding_window("k", 60)[:3] == (0, 0.0, 0)
+
+def test_limit_enforced_across_processes(storage_uri):
+    """Несколько процессов в сумме не превышают лимит"""
+    ctx = multiprocessing.get_context("spawn")
+    results = ctx.Queue()
+    workers = [ctx.Process(target=_hit_many, args=(storage_uri, "100/hour", 60, results)) for _ in range(4)]
+    for worker in workers:
+        worker.start()
+    allowed = sum(results.get(timeout=30) for _ in workers)
+    for worker in workers:
+        worker.join(timeout=30)
+    assert allowed == 100
+
+@pytest.fixture
+def budget_app(tmp_path, monkeypatch):
+    """Приложение с маленьким бюджетом стоимости запросов"""
+    from config import DevelopmentConfig
+    from app import create_app
+    from models import db
+    monkeypatch.setattr(DevelopmentConfig, "RATELIMIT_COST_BUDGET", "125 per hour")
+    monkeypatch.setattr(DevelopmentConfig, "SQLALCHEMY_DATABASE_URI", f"sqlite:///{tmp_path / 'app.db'}")
+    app = create_app()
+    app.config['TESTING'] = True
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.drop_all()
+
+def test_expensive_routes_spend_shared_budget(budget_app):
+    """Поиск стоит 10 единиц, хэширование пароля - 50, просмотр - 1; бюджет общий"""
+    client = budget_app.test_client()
+    for _ in range(2):
+        assert client.post('/api/v1/auth/login', json={'email': 'x@example.com', 'password': 'wrong-pass'}).status_code == 401
+    # Осталось 25 единиц: два поиска, третий уже не помещается, а просмотр еще доступен
+    assert client.get('/api/v1/catalog/products?q=шелк').status_code == 200
+    assert client.get('/api/v1/catalog/products?page=9').status_code == 200
+    assert client.get('/api/v1/catalog/products?q=лен').status_code == 429
+    assert client.get('/api/v1/catalog/categories').status_code == 200
+
+def test_cached_search_costs_one(budget_app):
+    """Поиск, уже лежащий в кэше, стоит как обычный просмотр; новая версия каталога - снова SEARCH_COST"""
+    from services.ratelimit import SEARCH_COST
+    from routes.catalog import invalidate_product_caches
+    url = '/api/v1/catalog/products?q=шелк&page=7'
+    with budget_app.test_request_context(url):
+        assert budget_app.request_costs() == SEARCH_COST
+    assert budget_app.test_client().get(url).status_code == 200
+    with budget_app.test_request_context(url):
+        assert budget_app.request_costs() == 1
+        invalidate_product_caches()
+        assert budget_app.request_costs() == SEARCH_COST
+    with budget_app.test_request_context('/api/v1/catalog/products?page=abc'):
+        assert budget_app.request_costs() == 1
+
+def test_cost_follows_measured_db_time(budget_app):
+    """Маршрут, который долго работает с БД, дорожает по EWMA времени запросов"""
+    costs = budget_app.request_costs
+    with budget_app.test_request_context('/api/v1/catalog/categories'):
+        from flask import request
+        endpoint = request.endpoint
+        assert costs.declared(endpoint) == 1
+        costs.observe(endpoint, 40.0)
+        assert costs.measured(endpoint) == 1
+        for _ in range(30):
+            costs.observe(endpoint, 400.0)
+        assert costs.measured(endpoint) == 8
+        assert costs() == 8